@@ -0,0 +1,365 @@
+"""Scanner benchmark on reproducible synthetic trees.
+
+Generates trees of several shapes in a temporary directory, scans each with
+every strategy and worker count in a fresh interpreter, and appends one JSON
+record per run to the output file so results can be compared across
+versions:
+
+    python benchmark.py run --scale 0.5 --output before.jsonl
+    python benchmark.py run --scale 0.5 --output after.jsonl
+    python benchmark.py compare before.jsonl after.jsonl
+
+Scans run against a warm page cache: each tree is generated right before it
+is measured and the first repeat can be discarded with --warmup.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import statistics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from pcCleaner import DirectoryScanner, DirNode, ParallelWalker, WalkTop
+
+STRATEGIES = ("serial", "thread", "process")
+
+
+def _write_file(path, size):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+def make_wide(path, rng, scale):
+    """One level of many folders holding a few small files each."""
+    for i in range(int(5000 * scale)):
+        folder = os.path.join(path, f"dir{i:06d}")
+        os.mkdir(folder)
+        for j in range(rng.randint(0, 8)):
+            _write_file(os.path.join(folder, f"f{j}.dat"), rng.randint(0, 8192))
+
+
+def make_deep(path, rng, scale):
+    """Chains of nested folders, deeper than PATH_MAX allows as plain paths."""
+    for chain in range(max(1, int(4 * scale))):
+        current = os.path.join(path, f"chain{chain}")
+        os.mkdir(current)
+        fd = os.open(current, os.O_RDONLY)
+        try:
+            for depth in range(1500):
+                with open(f"f{depth}.dat", "wb", opener=lambda name, flags: os.open(name, flags, dir_fd=fd)) as f:
+                    f.write(b"x" * rng.randint(0, 512))
+                os.mkdir("d", dir_fd=fd)
+                child = os.open("d", os.O_RDONLY, dir_fd=fd)
+                os.close(fd)
+                fd = child
+        finally:
+            os.close(fd)
+
+
+def make_tiny(path, rng, scale):
+    """Lots of tiny files in a two-level fan-out."""
+    total = int(200000 * scale)
+    per_dir = 1000
+    for i in range(0, total, per_dir):
+        folder = os.path.join(path, f"bucket{i // per_dir // 100:03d}", f"dir{i // per_dir:05d}")
+        os.makedirs(folder, exist_ok=True)
+        for j in range(min(per_dir, total - i)):
+            _write_file(os.path.join(folder, f"{j:04d}"), rng.randint(0, 64))
+
+
+def make_sparse(path, rng, scale):
+    """A few huge files that take almost no disk space."""
+    for i in range(max(1, int(8 * scale))):
+        with open(os.path.join(path, f"sparse{i}.img"), "wb") as f:
+            f.truncate(rng.randint(1, 64) << 30)
+
+
+def make_symlinks(path, rng, scale):
+    """Folders full of links back to their ancestors, which must not be followed."""
+    for i in range(int(500 * scale)):
+        folder = os.path.join(path, f"dir{i:05d}", "inner")
+        os.makedirs(folder)
+        _write_file(os.path.join(folder, "data.dat"), rng.randint(0, 4096))
+        os.symlink(path, os.path.join(folder, "to_root"), target_is_directory=True)
+        os.symlink("..", os.path.join(folder, "to_parent"), target_is_directory=True)
+        os.symlink("missing", os.path.join(folder, "dangling"))
+
+
+def make_unreadable(path, rng, scale):
+    """Readable folders mixed with folders the scanner may not list."""
+    for i in range(int(500 * scale)):
+        folder = os.path.join(path, f"dir{i:05d}")
+        os.makedirs(os.path.join(folder, "sub"))
+        _write_file(os.path.join(folder, "sub", "data.dat"), rng.randint(0, 4096))
+        if i % 2:
+            os.chmod(folder, 0)
+
+
+SHAPES = {
+    "wide": make_wide,
+    "deep": make_deep,
+    "tiny": make_tiny,
+    "sparse": make_sparse,
+    "symlinks": make_symlinks,
+    "unreadable": make_unreadable,
+}
+
+
+def generate(shape, path, seed, scale):
+    """Builds one synthetic tree.
+
+    Args:
+        shape (str): Key of SHAPES.
+        path (str): Empty directory to fill.
+        seed (int): Random seed; the same seed and scale give the same tree.
+        scale (float): Multiplier for the number of entries.
+    """
+    SHAPES[shape](path, random.Random(f"{shape}:{seed}"), scale)
+
+
+def remove_tree(path):
+    """Deletes a generated tree, including deep chains and unreadable folders.
+
+    Subfolders are moved up into the tree's top folder before they are
+    emptied, so paths stay short and nothing recurses however deep it goes.
+    """
+    moved = 0
+    os.chmod(path, 0o700)
+    while True:
+        with os.scandir(path) as entries:
+            folders = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+        if not folders:
+            break
+        for folder in folders:
+            os.chmod(folder, 0o700)
+            with os.scandir(folder) as entries:
+                for entry in list(entries):
+                    if entry.is_dir(follow_symlinks=False):
+                        moved += 1
+                        os.rename(entry.path, os.path.join(path, f"~{moved}"))
+                    else:
+                        os.unlink(entry.path)
+            os.rmdir(folder)
+    shutil.rmtree(path)
+
+
+def _peak_rss_kb(who):
+    """Returns the peak resident set size in KiB, or None where unsupported."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # Bytes on macOS
+
+
+def measure(path, strategy, workers):
+    """Scans path once with one strategy and returns the measurements.
+
+    Runs in its own interpreter (see the "measure" command) so peak RSS
+    belongs to this run alone.
+    """
+    scanner = DirectoryScanner()
+    start = time.perf_counter()
+    if strategy == "serial":
+        root = scanner.scan_tree(path)
+    else:
+        root = DirNode(path)
+        # Tally file types like the serial scanner does, as GUI scans do
+        walker = ParallelWalker(scanner, workers=workers, backend=strategy, collect_types=True)
+        walker.walk([WalkTop(root, path, None, None)])
+    wall = time.perf_counter() - start
+    worker_peak = None
+    if strategy == "process":
+        import multiprocessing
+        for child in multiprocessing.active_children():
+            child.join()
+        worker_peak = _peak_rss_kb(resource.RUSAGE_CHILDREN) if resource else None
+    entries = scanner.dirs_scanned + scanner.files_scanned
+    return {
+        "wall_s": round(wall, 6),
+        "entries": entries,
+        "entries_per_s": round(entries / wall, 1) if wall else None,
+        "dirs": scanner.dirs_scanned,
+        "files": root.files,
+        "size": root.size,
+        "syscalls": scanner.syscalls,
+        "syscalls_per_file": round(scanner.syscalls_per_file(), 3),
+        "peak_rss_kb": _peak_rss_kb(resource.RUSAGE_SELF) if resource else None,
+        "worker_peak_rss_kb": worker_peak,
+    }
+
+
+def _commit():
+    """Returns the short git commit of the benchmarked code, if known."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run_command(args):
+    """Runs the "run" command: generate, measure, record."""
+    shapes = args.shapes.split(",")
+    strategies = args.strategies.split(",")
+    worker_counts = [int(count) for count in args.workers.split(",")]
+    for name in shapes:
+        if name not in SHAPES:
+            print(f"benchmark: unknown shape: {name}", file=sys.stderr)
+            return 2
+    for name in strategies:
+        if name not in STRATEGIES:
+            print(f"benchmark: unknown strategy: {name}", file=sys.stderr)
+            return 2
+    if "unreadable" in shapes and hasattr(os, "geteuid") and os.geteuid() == 0:
+        print("benchmark: running as root, so the unreadable shape is fully readable", file=sys.stderr)
+
+    context = {"commit": _commit(), "python": platform.python_version(), "platform": platform.platform(),
+               "cpus": os.cpu_count(), "scale": args.scale, "seed": args.seed,
+               "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    try:
+        if args.root:
+            os.makedirs(args.root, exist_ok=True)
+        base = tempfile.mkdtemp(prefix="pccleaner-bench-", dir=args.root)
+    except OSError as e:
+        print(f"benchmark: cannot create trees in {args.root or tempfile.gettempdir()}: {e.strerror}",
+              file=sys.stderr)
+        return 2
+    try:
+        out = open(args.output, "a")
+    except OSError as e:
+        print(f"benchmark: cannot write {args.output}: {e.strerror}", file=sys.stderr)
+        remove_tree(base)
+        return 2
+    try:
+        with out:
+            for shape in shapes:
+                tree = os.path.join(base, shape)
+                os.mkdir(tree)
+                start = time.perf_counter()
+                generate(shape, tree, args.seed, args.scale)
+                print(f"{shape}: generated in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+                for strategy in strategies:
+                    for workers in ([1] if strategy == "serial" else worker_counts):
+                        for repeat in range(args.warmup + args.repeat):
+                            result = subprocess.run(
+                                [sys.executable, os.path.abspath(__file__), "measure", tree, strategy, str(workers)],
+                                capture_output=True, text=True)
+                            if result.returncode:
+                                print(f"{shape}/{strategy}/{workers}: failed\n{result.stderr}", file=sys.stderr)
+                                break
+                            if repeat < args.warmup:
+                                continue
+                            record = dict(context, shape=shape, strategy=strategy, workers=workers,
+                                          repeat=repeat - args.warmup)
+                            record.update(json.loads(result.stdout))
+                            out.write(json.dumps(record) + "\n")
+                            out.flush()
+                            print(f"{shape}/{strategy}/{workers}: {record['entries']:,} entries in "
+                                  f"{record['wall_s']:.3f} s ({record['entries_per_s']:,.0f}/s), "
+                                  f"{record['syscalls_per_file']} syscalls/file, "
+                                  f"peak RSS {record['peak_rss_kb']} KiB", file=sys.stderr)
+                if not args.keep:
+                    remove_tree(tree)
+    finally:
+        if args.keep:
+            print(f"benchmark: trees kept in {base}", file=sys.stderr)
+        else:
+            remove_tree(base)
+    return 0
+
+
+def _load(path):
+    """Groups the entries/sec of a results file by (shape, strategy, workers)."""
+    groups = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                key = (record["shape"], record["strategy"], record["workers"])
+                groups.setdefault(key, []).append(record["entries_per_s"])
+    return groups
+
+
+def _compare_command(args):
+    """Runs the "compare" command; exits with 1 if anything regressed."""
+    groups = []
+    for path in (args.old, args.new):
+        try:
+            groups.append(_load(path))
+        except OSError as e:
+            print(f"benchmark: cannot read {path}: {e.strerror}", file=sys.stderr)
+            return 2
+        except (ValueError, KeyError):
+            print(f"benchmark: {path} is not a results file of the run command", file=sys.stderr)
+            return 2
+    old, new = groups
+    regressed = False
+    print(f"{'shape':<11}{'strategy':<9}{'workers':>8}{'old/s':>14}{'new/s':>14}{'ratio':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        before = statistics.median(old[key])
+        after = statistics.median(new[key])
+        ratio = after / before if before else float("inf")
+        flag = ""
+        if ratio < args.threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{key[0]:<11}{key[1]:<9}{key[2]:>8}{before:>14,.0f}{after:>14,.0f}{ratio:>8.2f}{flag}")
+    return 1 if regressed else 0
+
+
+def build_parser():
+    """Builds the command line parser."""
+    parser = argparse.ArgumentParser(prog="benchmark", description="Benchmark the pcCleaner scanners.")
+    commands = parser.add_subparsers(dest="command")
+    run = commands.add_parser("run", help="generate trees, scan them and append JSON records to the output")
+    run.add_argument("--shapes", default=",".join(SHAPES), help="comma-separated tree shapes (default: all)")
+    run.add_argument("--strategies", default=",".join(STRATEGIES),
+                     help="comma-separated scan strategies (default: all)")
+    run.add_argument("--workers", default="1,4,16", help="comma-separated worker counts (default: 1,4,16)")
+    run.add_argument("--scale", type=float, default=1.0,
+                     help="entry count multiplier; 5 gives a million tiny files (default: 1)")
+    run.add_argument("--seed", type=int, default=1, help="random seed of the generated trees (default: 1)")
+    run.add_argument("--repeat", type=int, default=3, help="measured runs per configuration (default: 3)")
+    run.add_argument("--warmup", type=int, default=1, help="unrecorded runs first (default: 1)")
+    run.add_argument("--output", default="bench_output.txt", help="JSON Lines file to append to")
+    run.add_argument("--root", default=None, help="where to create the trees (default: system temp)")
+    run.add_argument("--keep", action="store_true", help="keep the generated trees")
+    compare = commands.add_parser("compare", help="compare the median entries/sec of two result files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=0.9,
+                         help="flag ratios below this as regressions (default: 0.9)")
+    measure_parser = commands.add_parser("measure", help="scan one tree once and print the JSON result (internal)")
+    measure_parser.add_argument("path")
+    measure_parser.add_argument("strategy", choices=STRATEGIES)
+    measure_parser.add_argument("workers", type=int)
+    return parser
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return _run_command(args)
+    if args.command == "compare":
+        return _compare_command(args)
+    if args.command == "measure":
+        print(json.dumps(measure(args.path, args.strategy, args.workers)))
+        return 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
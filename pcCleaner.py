@@ -1,528 +1,4772 @@
-import tkinter as tk
-from tkinter import ttk, filedialog
-import os
-import threading
-import time
-import logging
-import csv
-from concurrent.futures import ThreadPoolExecutor
-import platform
-import subprocess
-import sys
-
-# Configure logging
-logging.basicConfig(filename="treesize.log", level=logging.ERROR, format="%(asctime)s - %(message)s")
-
-class DirectoryScanner:
-    """Handles directory scanning logic for TreeSizeApp."""
-    
-    def __init__(self, app):
-        self.app = app
-        self.cancel_flag = False
-
-    def scan(self, path):
-        """Scans a directory and returns folder sizes and file counts.
-
-        Args:
-            path (str): Directory path to scan.
-
-        Returns:
-            dict: Dictionary mapping folder names to (size, files) tuples.
-        """
-        results = {}
-        try:
-            for item in os.scandir(path):
-                if self.cancel_flag:
-                    return {}
-                if item.is_dir(follow_symlinks=False):
-                    size, files = self.get_folder_info(item.path)
-                    results[item.name] = (size, files)
-        except (PermissionError, FileNotFoundError, OSError) as e:
-            logging.error(f"Error scanning {path}: {e}")
-        return results
-
-    def get_folder_info(self, directory):
-        """Recursively calculates total size and file count in a directory.
-
-        Args:
-            directory (str): Directory path to analyze.
-
-        Returns:
-            tuple: (total_size, total_files)
-        """
-        total_size = 0
-        total_files = 0
-        try:
-            for item in os.scandir(directory):
-                if self.cancel_flag:
-                    return 0, 0
-                if item.is_file(follow_symlinks=False):
-                    total_size += item.stat(follow_symlinks=False).st_size
-                    total_files += 1
-                elif item.is_dir(follow_symlinks=False):
-                    size, files = self.get_folder_info(item.path)
-                    total_size += size
-                    total_files += files
-        except (PermissionError, FileNotFoundError, OSError):
-            pass
-        return total_size, total_files
-
-class TreeSizeApp(tk.Tk):
-    """A Tkinter application to display directory sizes and file counts in a file explorer-like interface."""
-    
-    def __init__(self):
-        super().__init__()
-        self.title("Cleaner")
-        self.geometry("800x600")
-
-        # Initialize data
-        self.item_data = {}
-        self.cache = {}
-        self.sort_by = "size"
-        self.sort_descending = True
-        self.last_path = None  # No initial directory
-        self.scanner = DirectoryScanner(self)
-        self.cancel_scan_flag = False
-        self.executor = None  # To manage ThreadPoolExecutor
-
-        # Configure style
-        self.style = ttk.Style()
-        self.style.theme_use("clam")
-
-        # --- Create GUI Elements ---
-
-        # Top frame for buttons and filters
-        self.top_frame = ttk.Frame(self, padding="5")
-        self.top_frame.pack(side="top", fill="x")
-
-        # Select Directory button
-        self.select_button = ttk.Button(self.top_frame, text="Select Directory", command=self.select_directory)
-        self.select_button.pack(side="left", padx=5)
-
-        # Up button
-        self.up_button = ttk.Button(self.top_frame, text="Up", command=self.navigate_up, state="disabled")
-        self.up_button.pack(side="left", padx=5)
-
-        # Cancel button
-        self.cancel_button = ttk.Button(self.top_frame, text="Cancel", command=self.cancel_scan, state="disabled")
-        self.cancel_button.pack(side="left", padx=5)
-
-        # Refresh button
-        self.refresh_button = ttk.Button(self.top_frame, text="Refresh", command=self.refresh_scan)
-        self.refresh_button.pack(side="left", padx=5)
-
-        # Export button
-        self.export_button = ttk.Button(self.top_frame, text="Export to CSV", command=self.export_to_csv)
-        self.export_button.pack(side="left", padx=5)
-
-        # Open in Explorer button
-        self.open_explorer_button = ttk.Button(self.top_frame, text="Open in Explorer", command=self.open_in_explorer)
-        self.open_explorer_button.pack(side="left", padx=5)
-
-        # Progress bar
-        self.progress = ttk.Progressbar(self.top_frame, mode='indeterminate')
-        self.progress.pack(side="left", padx=5)
-        self.progress.pack_forget()
-
-        # Search bar
-        self.search_var = tk.StringVar()
-        self.search_entry = ttk.Entry(self.top_frame, textvariable=self.search_var)
-        self.search_entry.pack(side="left", padx=5)
-        self.search_var.trace("w", self.filter_by_search)
-
-        # Filter frame
-        self.filter_frame = ttk.Frame(self.top_frame)
-        self.filter_frame.pack(side="left", padx=5)
-        ttk.Label(self.filter_frame, text="Min Size (MB):").pack(side="left")
-        self.filter_size = ttk.Entry(self.filter_frame, width=10)
-        self.filter_size.pack(side="left", padx=2)
-        ttk.Button(self.filter_frame, text="Apply Filter", command=self.apply_filter).pack(side="left")
-
-        # Treeview frame
-        self.tree_frame = ttk.Frame(self, padding="5")
-        self.tree_frame.pack(side="top", fill="both", expand=True)
-
-        # Treeview widget
-        self.tree = ttk.Treeview(self.tree_frame, columns=("size", "files"), selectmode="browse")
-        self.tree.pack(side="left", fill="both", expand=True)
-
-        # Configure Treeview columns
-        self.tree.heading("#0", text="Directory", command=lambda: self.sort_by_column("#0", False))
-        self.tree.heading("size", text="Size ▼", command=lambda: self.sort_by_column("size", True))
-        self.tree.heading("files", text="Files", command=lambda: self.sort_by_column("files", True))
-
-        self.tree.column("#0", width=400, anchor="w", stretch=True)
-        self.tree.column("size", width=150, anchor="e", stretch=True)
-        self.tree.column("files", width=100, anchor="e", stretch=True)
-
-        # Scrollbar
-        self.scrollbar = ttk.Scrollbar(self.tree_frame, orient="vertical", command=self.tree.yview)
-        self.scrollbar.pack(side="right", fill="y")
-        self.tree.configure(yscrollcommand=self.scrollbar.set)
-
-        # Bind events
-        self.tree.bind("<Button-1>", self.navigate_into_directory)  # Single-click to navigate
-        self.tree.bind("<Double-1>", self.expand_directory)  # Double-click to expand
-
-        # Status bar
-        self.status_var = tk.StringVar()
-        self.status_bar = ttk.Label(self, textvariable=self.status_var, relief="sunken", anchor="w", padding="2")
-        self.status_bar.pack(side="bottom", fill="x")
-        self.status_var.set("Select a directory to begin.")
-
-        # Handle window close for graceful exit
-        self.protocol("WM_DELETE_WINDOW", self.on_closing)
-
-    def on_closing(self):
-        """Handles cleanup when the window is closed."""
-        self.cancel_scan_flag = True
-        self.scanner.cancel_flag = True
-        if self.executor:
-            self.executor.shutdown(wait=False)  # Forcefully terminate threads
-        self.destroy()  # Destroy Tkinter window
-        sys.exit(0)  # Ensure complete program exit
-
-    def select_directory(self):
-        """Opens a directory dialog and starts scanning."""
-        path = filedialog.askdirectory()
-        if path:
-            if path in self.cache:
-                self.populate_tree_from_cache(path)
-            else:
-                self.scan_directory(path)
-
-    def scan_directory(self, path):
-        """Scans the selected directory and populates the tree.
-
-        Args:
-            path (str): Directory path to scan.
-        """
-        start_time = time.time()
-        self.last_path = path
-        # Clear previous results
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        self.item_data.clear()
-
-        # Disable sorting and buttons
-        self.tree.heading("size", command=None)
-        self.tree.heading("#0", command=None)
-        self.tree.heading("files", command=None)
-        self.cancel_button.configure(state="normal")
-        self.up_button.configure(state="disabled")
-        self.select_button.configure(state="disabled")
-        self.cancel_scan_flag = False
-
-        self.status_var.set(f"Scanning: {path}...")
-        self.progress.pack(side="left", padx=5)
-        self.progress.start()
-
-        try:
-            self.executor = ThreadPoolExecutor(max_workers=4)
-            futures = []
-            update_counter = 0
-            for item in os.scandir(path):
-                if item.is_dir(follow_symlinks=False):
-                    node = self.tree.insert("", "end", text=item.name, values=("Calculating...", ""), open=False)
-                    self.item_data[node] = {'raw_size': 0, 'raw_files': 0}
-                    futures.append(self.executor.submit(self.scanner.get_folder_info, item.path))
-                    update_counter += 1
-                    if update_counter % 10 == 0:
-                        self.update_idletasks()
-            
-            for node, future in zip(self.tree.get_children(), futures):
-                if self.cancel_scan_flag:
-                    break
-                total_size, total_files = future.result()
-                self.item_data[node] = {'raw_size': total_size, 'raw_files': total_files}
-                self.tree.item(node, values=(self.format_size(total_size), f"{total_files:,}"))
-                self.update_idletasks()
-
-            # Cache results
-            self.cache[path] = {self.tree.item(node, "text"): (data['raw_size'], data['raw_files']) 
-                               for node, data in self.item_data.items()}
-            
-            # Calculate totals
-            total_size = sum(data["raw_size"] for data in self.item_data.values())
-            total_files = sum(data["raw_files"] for data in self.item_data.values())
-            
-            end_time = time.time()
-            self.status_var.set(f"Scan complete in {end_time - start_time:.2f} seconds. "
-                               f"Total: {self.format_size(total_size)}, {total_files:,} files. "
-                               f"Current: {path}")
-
-        except PermissionError as e:
-            logging.error(f"Permission denied: {path}")
-            self.status_var.set(f"Error: Permission denied to access some folders. Current: {path}")
-        except Exception as e:
-            logging.error(f"Error in scan_directory: {e}")
-            self.status_var.set(f"An error occurred: {e}. Current: {path}")
-        finally:
-            self.progress.stop()
-            self.progress.pack_forget()
-            self.cancel_button.configure(state="disabled")
-            self.up_button.configure(state="normal")
-            self.select_button.configure(state="normal")
-            self.tree.heading("size", text="Size ▼", command=lambda: self.sort_by_column("size", True))
-            self.tree.heading("#0", text="Directory", command=lambda: self.sort_by_column("#0", False))
-            self.tree.heading("files", text="Files", command=lambda: self.sort_by_column("files", True))
-            self.sort_by_column("size", True, initial_sort=True)
-            if self.executor:
-                self.executor.shutdown(wait=True)
-                self.executor = None
-
-    def populate_tree_from_cache(self, path):
-        """Populates the Treeview from cached data.
-
-        Args:
-            path (str): Directory path to load from cache.
-        """
-        self.last_path = path
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        self.item_data.clear()
-        for name, (size, files) in self.cache[path].items():
-            node = self.tree.insert("", "end", text=name, values=(self.format_size(size), f"{files:,}"), open=False)
-            self.item_data[node] = {'raw_size': size, 'raw_files': files}
-        self.sort_by_column("size", True, initial_sort=True)
-        self.status_var.set(f"Loaded from cache: {path}")
-
-    def sort_by_column(self, col, is_numeric, initial_sort=False):
-        """Sorts Treeview items by a column.
-
-        Args:
-            col (str): Column identifier.
-            is_numeric (bool): Whether the column contains numeric data.
-            initial_sort (bool): Whether this is the initial sort after scanning.
-        """
-        if not initial_sort and col == self.sort_by:
-            self.sort_descending = not self.sort_descending
-        else:
-            self.sort_descending = True
-        self.sort_by = col
-        
-        # Update heading text
-        self.tree.heading("size", text="Size")
-        self.tree.heading("#0", text="Directory")
-        self.tree.heading("files", text="Files")
-        arrow = "▼" if self.sort_descending else "▲"
-        self.tree.heading(col, text=f"{col.capitalize() if col != '#0' else 'Directory'} {arrow}")
-
-        # Sort items
-        if is_numeric:
-            data_key = 'raw_size' if col == 'size' else 'raw_files'
-            l = [(self.item_data[item_id].get(data_key, 0), item_id) for item_id in self.tree.get_children('')]
-        else:
-            l = [(self.tree.item(item_id, 'text').lower(), item_id) for item_id in self.tree.get_children('')]
-
-        l.sort(reverse=self.sort_descending)
-
-        # Rearrange items
-        for index, (val, item_id) in enumerate(l):
-            self.tree.move(item_id, '', index)
-
-    def expand_directory(self, event):
-        """Expands a directory to show subdirectories on double-click, sorted by size.
-
-        Args:
-            event: Tkinter event object.
-        """
-        item = self.tree.identify_row(event.y)
-        if not item or self.tree.identify_element(event.x, event.y) not in ("image", "text"):
-            return
-        # Build the full path
-        path_parts = []
-        current_item = item
-        while current_item:
-            path_parts.append(self.tree.item(current_item, "text"))
-            current_item = self.tree.parent(current_item)
-        path_parts.reverse()
-        full_path = os.path.join(self.last_path, *path_parts)
-        
-        # Clear existing children to refresh
-        for child in self.tree.get_children(item):
-            self.tree.delete(child)
-        
-        try:
-            # Scan subdirectories
-            subdirs = {}
-            for subitem in os.scandir(full_path):
-                if subitem.is_dir(follow_symlinks=False):
-                    total_size, total_files = self.scanner.get_folder_info(subitem.path)
-                    subdirs[subitem.name] = {'raw_size': total_size, 'raw_files': total_files}
-            
-            # Sort subdirectories by size
-            sorted_subdirs = sorted(subdirs.items(), key=lambda x: x[1]['raw_size'], reverse=True)
-            
-            # Populate Treeview
-            for name, data in sorted_subdirs:
-                node = self.tree.insert(item, "end", text=name, values=(self.format_size(data['raw_size']), f"{data['raw_files']:,}"), open=False)
-                self.item_data[node] = data
-            self.tree.item(item, open=True)  # Expand the node
-        except Exception as e:
-            logging.error(f"Error expanding directory {full_path}: {e}")
-            self.status_var.set(f"Error expanding directory: {e}")
-
-    def navigate_into_directory(self, event):
-        """Navigates into a directory on single-click.
-
-        Args:
-            event: Tkinter event object.
-        """
-        item = self.tree.identify_row(event.y)
-        if not item or self.tree.identify_element(event.x, event.y) not in ("image", "text"):
-            return
-        # Build the full path
-        path_parts = []
-        current_item = item
-        while current_item:
-            path_parts.append(self.tree.item(current_item, "text"))
-            current_item = self.tree.parent(current_item)
-        path_parts.reverse()
-        full_path = os.path.join(self.last_path, *path_parts)
-        
-        # Check if directory exists and is accessible
-        if os.path.isdir(full_path):
-            if full_path in self.cache:
-                self.populate_tree_from_cache(full_path)
-            else:
-                self.scan_directory(full_path)
-
-    def navigate_up(self):
-        """Navigates to the parent directory."""
-        if self.last_path:
-            parent_path = os.path.dirname(self.last_path)
-            if os.path.isdir(parent_path) and parent_path != self.last_path:  # Avoid infinite loop at root
-                if parent_path in self.cache:
-                    self.populate_tree_from_cache(parent_path)
-                else:
-                    self.scan_directory(parent_path)
-            else:
-                self.status_var.set("Cannot navigate up: already at root.")
-        else:
-            self.status_var.set("No directory selected.")
-
-    def open_in_explorer(self):
-        """Opens the selected directory in the system's file explorer."""
-        item = self.tree.selection()
-        if not item:
-            self.status_var.set("No directory selected.")
-            return
-        item = item[0]
-        # Build the full path
-        path_parts = []
-        current_item = item
-        while current_item:
-            path_parts.append(self.tree.item(current_item, "text"))
-            current_item = self.tree.parent(current_item)
-        path_parts.reverse()
-        full_path = os.path.join(self.last_path, *path_parts)
-        
-        try:
-            if platform.system() == "Windows":
-                os.startfile(full_path)
-            elif platform.system() == "Linux":
-                subprocess.run(["xdg-open", full_path], check=True)
-            elif platform.system() == "Darwin":  # macOS
-                subprocess.run(["open", full_path], check=True)
-            else:
-                self.status_var.set("Unsupported platform for opening directory.")
-                return
-            self.status_var.set(f"Opened {full_path} in file explorer.")
-        except Exception as e:
-            logging.error(f"Error opening directory {full_path}: {e}")
-            self.status_var.set(f"Error opening directory: {e}")
-
-    def cancel_scan(self):
-        """Cancels the current scan."""
-        self.cancel_scan_flag = True
-        self.scanner.cancel_flag = True
-        if self.executor:
-            self.executor.shutdown(wait=False)  # Forcefully terminate threads
-            self.executor = None
-        self.status_var.set("Scan cancelled.")
-        self.cancel_button.configure(state="disabled")
-        self.up_button.configure(state="normal")
-        self.select_button.configure(state="normal")
-        self.progress.stop()
-        self.progress.pack_forget()
-
-    def refresh_scan(self):
-        """Refreshes the scan for the current directory."""
-        if self.last_path:
-            # Clear cache for the current path to force a rescan
-            if self.last_path in self.cache:
-                del self.cache[self.last_path]
-            self.scan_directory(self.last_path)
-        else:
-            self.status_var.set("No directory selected.")
-
-    def export_to_csv(self):
-        """Exports Treeview data to a CSV file."""
-        file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
-        if file_path:
-            try:
-                with open(file_path, "w", newline="") as f:
-                    writer = csv.writer(f)
-                    writer.writerow(["Directory", "Size (Bytes)", "Files"])
-                    for item in self.tree.get_children():
-                        name = self.tree.item(item, "text")
-                        size = self.item_data[item]["raw_size"]
-                        files = self.item_data[item]["raw_files"]
-                        writer.writerow([name, size, files])
-                self.status_var.set(f"Exported to {file_path}")
-            except Exception as e:
-                logging.error(f"Error exporting CSV: {e}")
-            self.status_var.set(f"Error exporting CSV: {e}")
-
-    def apply_filter(self):
-        """Filters directories by minimum size."""
-        try:
-            min_size_mb = float(self.filter_size.get()) * 1024 * 1024
-        except ValueError:
-            min_size_mb = 0
-        for item in self.tree.get_children():
-            size = self.item_data[item]["raw_size"]
-            if size < min_size_mb:
-                self.tree.delete(item)
-            else:
-                self.tree.item(item, values=(self.format_size(self.item_data[item]["raw_size"]), 
-                                            f"{self.item_data[item]['raw_files']:,}"))
-        self.status_var.set(f"Filtered directories smaller than {min_size_mb/1024/1024:.2f} MB")
-
-    def filter_by_search(self, *args):
-        """Filters Treeview items by search term."""
-        search_term = self.search_var.get().lower()
-        for item in self.tree.get_children():
-            name = self.tree.item(item, "text").lower()
-            if search_term in name:
-                self.tree.item(item, tags=())
-            else:
-                self.tree.item(item, tags=("hidden",))
-        self.tree.tag_configure("hidden", foreground="gray")
-
-    def format_size(self, size_bytes):
-        """Formats a size in bytes to a human-readable string.
-
-        Args:
-            size_bytes (int): Size in bytes.
-
-        Returns:
-            str: Formatted size string.
-        """
-        if size_bytes is None:
-            return "N/A"
-        if size_bytes < 1024:
-            return f"{size_bytes} B"
-        elif size_bytes < 1024**2:
-            return f"{size_bytes/1024:.2f} KB"
-        elif size_bytes < 1024**3:
-            return f"{size_bytes/1024**2:.2f} MB"
-        elif size_bytes < 1024**4:
-            return f"{size_bytes/1024**3:.2f} GB"
-        else:
-            return f"{size_bytes/1024**4:.2f} TB"
-
-if __name__ == "__main__":
-    app = TreeSizeApp()
-    app.mainloop()
\ No newline at end of file
+"""Folder size scanning engine and headless command line interface.
+
+Importing this module does not load tkinter; the GUI lives in pcCleaner_gui
+and is only imported when it is started.
+"""
+import os
+import threading
+import time
+import logging
+import csv
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait, as_completed
+import platform
+import sys
+import sqlite3
+import queue
+import random
+import hashlib
+import heapq
+import mmap
+import re
+import errno
+import shutil
+import fnmatch
+import gzip
+import ctypes
+import ctypes.util
+import select
+import stat
+import struct
+from array import array
+from bisect import bisect_right
+from collections import namedtuple, OrderedDict, deque
+from contextlib import nullcontext
+
+
+def format_size(size_bytes):
+    """Formats a size in bytes to a human-readable string.
+
+    Args:
+        size_bytes (int): Size in bytes.
+
+    Returns:
+        str: Formatted size string.
+    """
+    if size_bytes is None:
+        return "N/A"
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    elif size_bytes < 1024**2:
+        return f"{size_bytes/1024:.2f} KB"
+    elif size_bytes < 1024**3:
+        return f"{size_bytes/1024**2:.2f} MB"
+    elif size_bytes < 1024**4:
+        return f"{size_bytes/1024**3:.2f} GB"
+    else:
+        return f"{size_bytes/1024**4:.2f} TB"
+
+
+class DirNode:
+    """A directory in the scanned tree with rolled-up size and file totals.
+
+    Nodes use __slots__ and interned names so an index of tens of millions of
+    directories stays compact. ``children`` stays None for leaf directories.
+    ``own_size``/``own_files`` count only the files directly inside the
+    directory; together with ``mtime_ns`` and ``ino`` they let a rescan reuse
+    the totals of directories whose listing has not changed. ``types`` breaks
+    the subtree's bytes down by extension and age, packed as described on
+    FileTypes, or is None when there are no files or it was not collected.
+
+    Children are found by a linear search while there are few of them; once
+    a lookup meets INDEX_THRESHOLD or more, the node keeps a name -> position
+    map so lookups, replacements and removals in huge folders stay constant
+    time. Code that assigns ``children`` directly must call reset_children.
+    """
+
+    __slots__ = ("name", "parent", "children", "size", "files",
+                 "own_size", "own_files", "mtime_ns", "ino", "types", "_positions")
+
+    INDEX_THRESHOLD = 64
+
+    def __init__(self, name, parent=None):
+        self.name = sys.intern(name)
+        self.parent = parent
+        self.children = None
+        self.size = 0
+        self.files = 0
+        self.own_size = 0
+        self.own_files = 0
+        self.mtime_ns = None
+        self.ino = None
+        self.types = None
+        self._positions = None  # Child name -> index in children, for large folders
+
+    def add_child(self, node):
+        """Attaches a child node."""
+        node.parent = self
+        if self.children is None:
+            self.children = [node]
+        else:
+            self.children.append(node)
+            if self._positions is not None:
+                self._positions[node.name] = len(self.children) - 1
+
+    def reset_children(self, children):
+        """Replaces the list of children, e.g. with None to drop them."""
+        self.children = children
+        self._positions = None
+
+    def _position(self, name):
+        """Returns the index of the child called name in children, or None."""
+        children = self.children
+        if not children:
+            return None
+        if self._positions is None:
+            if len(children) < self.INDEX_THRESHOLD:
+                for position, node in enumerate(children):
+                    if node.name == name:
+                        return position
+                return None
+            self._positions = {node.name: position for position, node in enumerate(children)}
+        return self._positions.get(name)
+
+    def child(self, name):
+        """Returns the child called name, or None."""
+        position = self._position(name)
+        return self.children[position] if position is not None else None
+
+    def replace_child(self, name, node):
+        """Replaces (or adds) the child called name and rolls the change up.
+
+        Args:
+            name (str): Child directory name.
+            node (DirNode): New subtree for that child.
+        """
+        position = self._position(name)
+        node.name = sys.intern(name)
+        if position is not None:
+            old = self.children[position]
+            self.children[position] = node
+            node.parent = self
+            old.parent = None  # Detached, so indexed names below it stop matching
+            self.adjust(node.size - old.size, node.files - old.files, node.types, old.types)
+        else:
+            self.add_child(node)
+            self.adjust(node.size, node.files, node.types)
+
+    def remove_child(self, node):
+        """Detaches a child node without touching the totals.
+
+        In a large folder the last child takes the removed one's place, so
+        the order of the children changes.
+        """
+        if self._positions is None:
+            self.children.remove(node)
+        else:
+            position = self._positions.pop(node.name)
+            last = self.children.pop()
+            if last is not node:
+                self.children[position] = last
+                self._positions[last.name] = position
+        if not self.children:
+            self.reset_children(None)
+        node.parent = None
+
+    def adjust(self, size_delta, files_delta, added_types=None, removed_types=None):
+        """Applies a delta to this node and all of its ancestors.
+
+        Args:
+            size_delta (int): Bytes added.
+            files_delta (int): Files added.
+            added_types (array): Packed file types to add, as in ``types``.
+            removed_types (array): Packed file types to take away.
+        """
+        retype = added_types is not None or removed_types is not None
+        node = self
+        while node is not None:
+            node.size += size_delta
+            node.files += files_delta
+            if retype:
+                node.types = merge_types((node.types, added_types), (removed_types,))
+            node = node.parent
+
+    def path(self):
+        """Returns the full path of this node."""
+        parts = []
+        node = self
+        while node is not None:
+            parts.append(node.name)
+            node = node.parent
+        parts.reverse()
+        return os.path.join(*parts)
+
+
+def _is_below(node, top):
+    """Returns True if node is top or one of its descendants."""
+    while node is not None:
+        if node is top:
+            return True
+        node = node.parent
+    return False
+
+
+def _relative_parts(path, root):
+    """Returns the path components of path below root, or None if outside it."""
+    if path == root:
+        return []
+    prefix = root if root.endswith(os.sep) else root + os.sep
+    if path.startswith(prefix):
+        return path[len(prefix):].split(os.sep)
+    return None
+
+
+# Upper bounds, in days, of the file age buckets; the last bucket holds all older files
+AGE_BUCKET_DAYS = (7, 30, 90, 365, 3 * 365)
+AGE_BUCKET_LABELS = ("Under a week", "1 week to 1 month", "1 to 3 months", "3 months to 1 year",
+                     "1 to 3 years", "Over 3 years")
+_AGE_BUCKET_SECONDS = tuple(days * 86400 for days in AGE_BUCKET_DAYS)
+_AGES = len(AGE_BUCKET_LABELS)
+# Extensions kept per folder; the smallest beyond that are merged into OTHER_EXTENSION
+MAX_EXTENSIONS = 64
+NO_EXTENSION = ""
+OTHER_EXTENSION = "(other)"
+# Longer "extensions" are mostly hashes or dates and are counted as OTHER_EXTENSION
+_MAX_EXTENSION_LENGTH = 12
+# Extension names by id, interned once per process so packed types only hold ids
+_extension_names = [NO_EXTENSION, OTHER_EXTENSION]
+_extension_ids = {name: extension_id for extension_id, name in enumerate(_extension_names)}
+_extension_lock = threading.Lock()
+_OTHER_ID = _extension_ids[OTHER_EXTENSION]
+
+
+def _extension_id(extension):
+    """Returns the interned id of an extension name."""
+    extension_id = _extension_ids.get(extension)
+    if extension_id is None:
+        with _extension_lock:
+            extension_id = _extension_ids.get(extension)
+            if extension_id is None:
+                extension_id = len(_extension_names)
+                _extension_names.append(extension)
+                _extension_ids[extension] = extension_id
+    return extension_id
+
+
+class FileTypes:
+    """Tally of files by extension and by age, filled while listing a directory.
+
+    It holds plain extension strings so process workers can pickle it;
+    pack() turns it into the compact form kept in DirNode.types: an
+    array("q") with the bytes of each age bucket, followed by one
+    (extension id, bytes, files) triple per extension, sorted by id.
+    Ages are measured from ``now``, the time of the scan.
+    """
+
+    __slots__ = ("now", "ages", "extensions")
+
+    def __init__(self, now=None):
+        self.now = time.time() if now is None else now
+        self.ages = [0] * _AGES
+        self.extensions = {}  # Lower-cased extension, with its dot -> [bytes, files]
+
+    def add(self, name, size, mtime, count=1):
+        """Counts a file; a negative size with count=-1 takes one out again."""
+        dot = name.rfind(".")
+        extension = name[dot:].lower() if dot > 0 else NO_EXTENSION
+        if len(extension) > _MAX_EXTENSION_LENGTH:
+            extension = OTHER_EXTENSION
+        entry = self.extensions.get(extension)
+        if entry is None:
+            self.extensions[extension] = [size, count]
+        else:
+            entry[0] += size
+            entry[1] += count
+        self.ages[bisect_right(_AGE_BUCKET_SECONDS, self.now - mtime)] += size
+
+    def pack(self):
+        """Returns the tally packed as for DirNode.types, or None if it is empty."""
+        return _pack_types(self.ages, {_extension_id(extension): entry
+                                       for extension, entry in self.extensions.items()})
+
+
+def _pack_types(ages, extensions):
+    """Packs age bytes and {extension id: [bytes, files]}, keeping the largest MAX_EXTENSIONS."""
+    other = extensions.pop(_OTHER_ID, [0, 0])
+    entries = [(extension_id, entry) for extension_id, entry in extensions.items() if entry[0] or entry[1]]
+    if len(entries) >= MAX_EXTENSIONS:
+        entries.sort(key=lambda item: item[1][0], reverse=True)
+        for _, (size, files) in entries[MAX_EXTENSIONS - 1:]:
+            other = [other[0] + size, other[1] + files]
+        del entries[MAX_EXTENSIONS - 1:]
+    if other[0] or other[1]:
+        entries.append((_OTHER_ID, other))
+    if not entries and not any(ages):
+        return None
+    packed = array("q", ages)
+    for extension_id, (size, files) in sorted(entries):
+        packed.extend((extension_id, size, files))
+    return packed
+
+
+def merge_types(added, removed=()):
+    """Adds up packed file types.
+
+    Args:
+        added (iterable): Packed types (DirNode.types) to add; None is skipped.
+        removed (iterable): Packed types to subtract.
+
+    Returns:
+        array: The packed sum, or None if it is empty. A single non-empty
+        input is returned as is, so packed types are never modified in place.
+    """
+    parts = [(1, packed) for packed in added if packed is not None]
+    parts += [(-1, packed) for packed in removed if packed is not None]
+    if not parts:
+        return None
+    if len(parts) == 1 and parts[0][0] == 1:
+        return parts[0][1]
+    ages = [0] * _AGES
+    extensions = {}
+    for sign, packed in parts:
+        for bucket in range(_AGES):
+            ages[bucket] += sign * packed[bucket]
+        for i in range(_AGES, len(packed), 3):
+            entry = extensions.get(packed[i])
+            if entry is None:
+                extensions[packed[i]] = [sign * packed[i + 1], sign * packed[i + 2]]
+            else:
+                entry[0] += sign * packed[i + 1]
+                entry[1] += sign * packed[i + 2]
+    return _pack_types(ages, extensions)
+
+
+def _own_types(node):
+    """Returns the packed types of the files directly inside node."""
+    return merge_types((node.types,), [child.types for child in node.children or ()])
+
+
+def type_breakdown(packed):
+    """Unpacks file types for display.
+
+    Args:
+        packed (array): DirNode.types, or None.
+
+    Returns:
+        tuple: ([(age label, bytes)], [(extension, bytes, files)]) with the
+        extensions largest first; NO_EXTENSION is "" and OTHER_EXTENSION
+        collects what did not fit.
+    """
+    if packed is None:
+        return [(label, 0) for label in AGE_BUCKET_LABELS], []
+    # Live updates measure ages from a later time than the scan, so a bucket can dip below zero
+    ages = [(label, max(0, size)) for label, size in zip(AGE_BUCKET_LABELS, packed[:_AGES])]
+    extensions = [(_extension_names[packed[i]], packed[i + 1], packed[i + 2]) for i in range(_AGES, len(packed), 3)]
+    extensions.sort(key=lambda entry: entry[1], reverse=True)
+    return ages, extensions
+
+
+def _types_to_json(packed):
+    """Serialises packed types with extension names, as ids only hold within a process."""
+    if packed is None:
+        return None
+    ages, extensions = type_breakdown(packed)
+    return json.dumps([[size for _, size in ages], extensions], separators=(",", ":"))
+
+
+def _types_from_json(text):
+    """Rebuilds packed types saved by _types_to_json."""
+    if text is None:
+        return None
+    ages, extensions = json.loads(text)
+    return _pack_types(ages, {_extension_id(extension): [size, files] for extension, size, files in extensions})
+
+
+# Number of largest and of oldest files tracked per scan root and top-level folder
+DEFAULT_TOP_FILES = 50
+
+
+class FileRanking:
+    """Bounded heaps of the largest and the least recently modified files.
+
+    Memory stays at 2 * limit entries however many files are offered, so the
+    ranking can be kept during a walk of any size.
+    """
+
+    __slots__ = ("limit", "largest", "oldest")
+
+    def __init__(self, limit=DEFAULT_TOP_FILES):
+        self.limit = limit
+        self.largest = []  # Min-heap of (size, path, mtime)
+        self.oldest = []  # Min-heap of (-mtime, path, size)
+
+    def __bool__(self):
+        return bool(self.largest)
+
+    def offer(self, path, size, mtime):
+        """Considers one file for both rankings."""
+        self._push(self.largest, (size, path, mtime))
+        self._push(self.oldest, (-mtime, path, size))
+
+    def _push(self, heap, entry):
+        if len(heap) < self.limit:
+            heapq.heappush(heap, entry)
+        elif entry[0] > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+
+    def merge(self, other, prefix=None):
+        """Merges another ranking, optionally joining its paths onto prefix.
+
+        Args:
+            other (FileRanking): Ranking to merge, e.g. one directory's files
+                ranked by name only.
+            prefix (str): Directory to join in front of other's paths.
+        """
+        for size, path, mtime in other.largest:
+            if len(self.largest) < self.limit or size > self.largest[0][0]:
+                self._push(self.largest, (size, os.path.join(prefix, path) if prefix else path, mtime))
+        for key, path, size in other.oldest:
+            if len(self.oldest) < self.limit or key > self.oldest[0][0]:
+                self._push(self.oldest, (key, os.path.join(prefix, path) if prefix else path, size))
+
+    def largest_files(self):
+        """Returns (path, size, mtime) tuples, largest first."""
+        return [(path, size, mtime) for size, path, mtime in sorted(self.largest, reverse=True)]
+
+    def oldest_files(self):
+        """Returns (path, size, mtime) tuples, least recently modified first."""
+        return [(path, size, -key) for key, path, size in sorted(self.oldest, reverse=True)]
+
+    def entries(self):
+        """Returns every distinct ranked file as (path, size, mtime)."""
+        found = {path: (path, size, mtime) for size, path, mtime in self.largest}
+        for key, path, size in self.oldest:
+            found.setdefault(path, (path, size, -key))
+        return list(found.values())
+
+    def filtered(self, keep):
+        """Returns a copy holding only the entries whose path passes keep."""
+        ranking = FileRanking(self.limit)
+        ranking.largest = [entry for entry in self.largest if keep(entry[1])]
+        ranking.oldest = [entry for entry in self.oldest if keep(entry[1])]
+        heapq.heapify(ranking.largest)
+        heapq.heapify(ranking.oldest)
+        return ranking
+
+
+class NameIndex:
+    """Trigram index of the directory and file names of a scanned tree.
+
+    Each distinct name is stored once and listed under every trigram of its
+    lower-cased form. Entries, one per directory or file, point at their
+    name, at a DirNode (the directory itself, or the directory holding the
+    file) and at the file size. A substring or glob query only checks the
+    names under its rarest trigram, so lookups stay fast however many
+    entries there are; queries without a three-character literal check every
+    distinct name instead. Entries hold nodes rather than paths, so paths
+    and directory totals are worked out for the results only.
+
+    Names are added from the scanning thread while the GUI searches, so both
+    sides take the lock.
+    """
+
+    GLOB_CHARS = "*?["
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = []  # Distinct names
+        self._name_ids = {}
+        self._trigrams = {}  # Trigram -> array of name ids
+        self._last = array("i")  # Name id -> newest entry with that name
+        self._prev = array("i")  # Entry -> previous entry with the same name, or -1
+        self._entry_name = array("I")
+        self._entry_size = array("q")  # File size, -1 for directories
+        self._entry_node = []
+        self._files = {}  # DirNode -> (start, end) range of its file entries
+        self.stale = 0  # Rough count of entries left below replaced subtrees
+
+    def __len__(self):
+        return len(self._entry_node)
+
+    def _add(self, name, node, size):
+        """Adds one entry; the caller holds the lock."""
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+            self._last.append(-1)
+            folded = name.lower()
+            for gram in {folded[i:i + 3] for i in range(len(folded) - 2)}:
+                posting = self._trigrams.get(gram)
+                if posting is None:
+                    self._trigrams[gram] = array("I", (name_id,))
+                else:
+                    posting.append(name_id)
+        entry = len(self._entry_node)
+        self._entry_name.append(name_id)
+        self._entry_size.append(size)
+        self._entry_node.append(node)
+        self._prev.append(self._last[name_id])
+        self._last[name_id] = entry
+
+    def add_dir(self, node):
+        """Indexes a directory under its own name."""
+        with self._lock:
+            self._add(node.name, node, -1)
+
+    def add_files(self, node, files):
+        """Indexes the files directly inside a directory.
+
+        Args:
+            node (DirNode): Directory holding the files.
+            files (list): (name, size) pairs, or (name, size, mtime) as listed.
+        """
+        if not files:
+            return
+        with self._lock:
+            start = len(self._entry_node)
+            for entry in files:
+                self._add(entry[0], node, entry[1])
+            self._files[node] = (start, len(self._entry_node))
+
+    def carry_files(self, node, source, previous):
+        """Indexes the files source holds for previous as the files of node.
+
+        Used when a listing is reused instead of read again.
+        """
+        span = source._files.get(previous) if source is not None else None
+        if span:
+            self.add_files(node, [(source._names[source._entry_name[entry]], source._entry_size[entry])
+                                  for entry in range(*span)])
+
+    def add_tree(self, node, source=None):
+        """Indexes every directory below node, and the files source holds for them."""
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current is not node:
+                self.add_dir(current)
+            self.carry_files(current, source, current)
+            stack.extend(current.children or ())
+
+    def merge(self, other, live=None):
+        """Adds the entries of another index.
+
+        Args:
+            other (NameIndex): Index to copy from.
+            live (callable): Keeps only entries whose node it returns True for.
+        """
+        memo = {}
+
+        def keep(node):
+            if live is None:
+                return True
+            if node not in memo:
+                memo[node] = live(node)
+            return memo[node]
+
+        for entry, node in enumerate(other._entry_node):
+            if other._entry_size[entry] < 0 and keep(node):
+                self.add_dir(node)
+        for node in list(other._files):
+            if keep(node):
+                self.carry_files(node, other, node)
+
+    def pruned(self, live):
+        """Returns a copy without the entries whose node live rejects."""
+        fresh = NameIndex()
+        fresh.merge(self, live)
+        return fresh
+
+    def search(self, query, under, limit=1000):
+        """Finds the directories and files below a directory whose name matches.
+
+        Args:
+            query (str): Case-insensitive substring, or a glob such as "*.iso"
+                when it contains *, ? or [.
+            under (DirNode): Directory to search below.
+            limit (int): Most results to return.
+
+        Returns:
+            list: (path, size, is_dir) tuples, largest first.
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        if any(char in query for char in self.GLOB_CHARS):
+            matches = re.compile(fnmatch.translate(query)).match
+            literals = re.split(r"\*|\?|\[[^\]]*\]?", query)
+        else:
+            matches = lambda name: query in name
+            literals = [query]
+        grams = {literal[i:i + 3] for literal in literals for i in range(len(literal) - 2)}
+
+        with self._lock:
+            if grams:
+                postings = [self._trigrams.get(gram) for gram in grams]
+                if None in postings:
+                    return []
+                candidates = min(postings, key=len)
+            else:
+                candidates = range(len(self._names))
+            names = self._names
+            found = []
+            for name_id in candidates:
+                if matches(names[name_id].lower()):
+                    entry = self._last[name_id]
+                    while entry >= 0:
+                        size = self._entry_size[entry]
+                        found.append((self._entry_node[entry].size if size < 0 else size, entry))
+                        entry = self._prev[entry]
+            found.sort(reverse=True)
+
+            results = []
+            for size, entry in found:
+                node = self._entry_node[entry]
+                is_dir = self._entry_size[entry] < 0
+                if not _is_below(node.parent if is_dir else node, under):
+                    continue  # Outside the directory, or below a replaced subtree
+                path = node.path()
+                if not is_dir:
+                    path = os.path.join(path, names[self._entry_name[entry]])
+                results.append((path, size, is_dir))
+                if len(results) >= limit:
+                    break
+        return results
+
+
+class ScanIndex:
+    """In-memory index of every scanned tree, keyed by root path.
+
+    Navigating, expanding or going up inside an indexed tree is a lookup
+    instead of another walk of the disk. Each root remembers the
+    rules_fingerprint of the exclusion rules its tree was scanned with.
+
+    The trees belong to one thread, e.g. the GUI thread. insert, remove and
+    clear change them under ``lock``, and so must any other code that
+    changes their nodes; other threads hold it while reading nodes, e.g.
+    for a whole export or search. The owning thread reads without it.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.roots = {}
+        # Root path -> {None: ranking of the whole tree, top-level name: its ranking}
+        self.rankings = {}
+        self.names = {}  # Root path -> NameIndex of its directory and file names
+        self.fingerprints = {}  # Root path -> rules fingerprint, None once trees of several rules are mixed
+
+    def __contains__(self, path):
+        return self.lookup(path) is not None
+
+    def containing_root(self, path):
+        """Returns the root path of the indexed tree holding path, or None."""
+        path = os.path.normpath(path)
+        for root_path in self.roots:
+            if _relative_parts(path, root_path) is not None:
+                return root_path
+        return None
+
+    def lookup(self, path):
+        """Finds the node for a directory path.
+
+        Args:
+            path (str): Directory path.
+
+        Returns:
+            DirNode: The indexed node, or None if the path was never scanned.
+        """
+        path = os.path.normpath(path)
+        for root_path, root in self.roots.items():
+            parts = _relative_parts(path, root_path)
+            if parts is None:
+                continue
+            node = root
+            for part in parts:
+                node = node.child(part)
+                if node is None:
+                    return None
+            return node
+        return None
+
+    def insert(self, path, node, rankings=None, names=None, fingerprint=""):
+        """Adds a freshly scanned tree to the index.
+
+        A tree inside an existing root replaces the matching subtree and its
+        totals are rolled up to the ancestors; the root's file rankings drop
+        the files below path and take in the new ones. A tree containing
+        existing roots supersedes them.
+
+        Args:
+            path (str): Directory path that was scanned.
+            node (DirNode): Root node of the scan.
+            rankings (dict): File rankings of the scan, as in ``rankings``.
+            names (NameIndex): Names found by the scan; without it only the
+                directory names of node are indexed.
+            fingerprint (str): rules_fingerprint of the scan's exclusion rules.
+        """
+        with self.lock:
+            path = os.path.normpath(path)
+            parent_path, name = os.path.split(path)
+            if name and parent_path != path:
+                parent = self.lookup(parent_path)
+                if parent is not None:
+                    self._graft(path, parent, node, rankings, names, fingerprint)
+                    return
+            for root_path in list(self.roots):
+                if _relative_parts(root_path, path) is not None:
+                    del self.roots[root_path]
+                    self.rankings.pop(root_path, None)
+                    self.names.pop(root_path, None)
+                    self.fingerprints.pop(root_path, None)
+            self.fingerprints[path] = fingerprint
+            node.name = sys.intern(path)
+            node.parent = None
+            self.roots[path] = node
+            if rankings:
+                self.rankings[path] = rankings
+            if names is None:
+                names = NameIndex()
+                names.add_tree(node)
+            self.names[path] = names
+
+    def replace(self, path, node, fingerprint=""):
+        """Replaces an indexed directory with a rescan of it, e.g. of what a
+        partial deletion left, rolling the change up to every ancestor.
+
+        Args:
+            path (str): Indexed directory path.
+            node (DirNode): Root node of the rescan.
+            fingerprint (str): rules_fingerprint of the rescan's exclusion rules.
+
+        Returns:
+            DirNode: The replaced node, or None if path was not indexed, in
+            which case nothing changes.
+        """
+        with self.lock:
+            path = os.path.normpath(path)
+            replaced = self.lookup(path)
+            if replaced is None:
+                return None
+            if replaced.parent is None:  # A root
+                self.insert(path, node, fingerprint=fingerprint)
+            else:
+                self._graft(path, replaced.parent, node, None, None, fingerprint)
+            return replaced
+
+    def _graft(self, path, parent, node, rankings, names, fingerprint):
+        """Puts node in place of the child of parent at path and rolls the change up."""
+        replaced = parent.child(os.path.basename(path))
+        parent.replace_child(os.path.basename(path), node)
+        self._graft_rankings(path, rankings)
+        self._graft_names(path, node, replaced, names)
+        root_path = self.containing_root(path)
+        if self.fingerprints.get(root_path) != fingerprint:
+            self.fingerprints[root_path] = None
+
+    def _graft_names(self, path, node, replaced, names):
+        """Adds the names of a grafted subtree to its root's name index.
+
+        Entries below the replaced subtree stop matching at once, as it is
+        detached; the index is rebuilt without them once they pile up.
+        """
+        root_path = self.containing_root(path)
+        root_names = self.names.get(root_path)
+        if root_names is None:
+            return
+        root_names.add_dir(node)
+        if names is not None:
+            root_names.merge(names)
+        else:
+            root_names.add_tree(node)
+        if replaced is not None:
+            self._add_stale_names(root_path, replaced.files)
+
+    def _add_stale_names(self, root_path, count):
+        """Counts entries left below a detached subtree, rebuilding the name index once they pile up."""
+        root_names = self.names[root_path]
+        root_names.stale += count
+        if root_names.stale * 2 > len(root_names):
+            root = self.roots[root_path]
+            self.names[root_path] = root_names.pruned(lambda entry_node: _is_below(entry_node, root))
+
+    def _graft_rankings(self, path, rankings):
+        """Replaces the ranked files below path in its root's rankings."""
+        root_path = self.containing_root(path)
+        root_rankings = self.rankings.get(root_path)
+        if not root_rankings:
+            return
+        parts = _relative_parts(path, root_path)
+        new_ranking = rankings.get(None) if rankings else None
+
+        def outside(file_path):
+            return _relative_parts(file_path, path) is None
+
+        for key, ranking in list(root_rankings.items()):
+            if key is not None and key != parts[0]:
+                continue
+            if key is not None and len(parts) == 1:
+                replaced = FileRanking(ranking.limit)
+            else:
+                replaced = ranking.filtered(outside)
+            if new_ranking:
+                replaced.merge(new_ranking)
+            root_rankings[key] = replaced
+
+    def remove(self, path):
+        """Drops a deleted directory and takes its totals off every ancestor.
+
+        Its files leave the rankings at once; its names stop matching as it
+        is detached, and the name index is rebuilt without them once they
+        pile up, as for a replaced subtree.
+
+        Args:
+            path (str): Indexed directory path.
+
+        Returns:
+            DirNode: The detached node, or None if path was not indexed.
+        """
+        with self.lock:
+            path = os.path.normpath(path)
+            if path in self.roots:
+                self.rankings.pop(path, None)
+                self.names.pop(path, None)
+                self.fingerprints.pop(path, None)
+                return self.roots.pop(path)
+            parent = self.lookup(os.path.dirname(path))
+            node = parent.child(os.path.basename(path)) if parent is not None else None
+            if node is None:
+                return None
+            parent.remove_child(node)
+            parent.adjust(-node.size, -node.files, removed_types=node.types)
+            self._graft_rankings(path, None)
+            root_path = self.containing_root(path)
+            if root_path in self.names:
+                self._add_stale_names(root_path, node.files)
+            return node
+
+    def file_ranking(self, path):
+        """Returns the ranking of the largest and oldest files below path.
+
+        Args:
+            path (str): Indexed directory path.
+
+        Returns:
+            tuple: (FileRanking, exact). exact is False when path is deeper
+            than a top-level folder and the ranking was filtered from its
+            top-level folder's, so it may hold fewer entries than the limit.
+            (None, False) if nothing is ranked for path.
+        """
+        path = os.path.normpath(path)
+        root_path = self.containing_root(path)
+        rankings = self.rankings.get(root_path)
+        if not rankings:
+            return None, False
+        parts = _relative_parts(path, root_path)
+        if not parts:
+            return rankings.get(None), True
+        ranking = rankings.get(parts[0]) or rankings.get(None)
+        if ranking is None:
+            return None, False
+        if len(parts) == 1 and parts[0] in rankings:
+            return ranking, True
+        return ranking.filtered(lambda file_path: _relative_parts(file_path, path) is not None), False
+
+    def fingerprint(self, path):
+        """Returns the rules fingerprint of the tree holding path.
+
+        Returns:
+            str: The fingerprint, or None if path is not indexed or its tree
+            mixes scans made with different rules.
+        """
+        return self.fingerprints.get(self.containing_root(path))
+
+    def name_index(self, path):
+        """Returns the name index covering path and the node to search below.
+
+        Returns:
+            tuple: (NameIndex, DirNode), or (None, None) if path is not indexed.
+        """
+        node = self.lookup(path)
+        names = self.names.get(self.containing_root(path)) if node is not None else None
+        if names is None:
+            return None, None
+        return names, node
+
+    def clear(self):
+        """Drops every indexed tree."""
+        with self.lock:
+            self.roots.clear()
+            self.rankings.clear()
+            self.names.clear()
+            self.fingerprints.clear()
+
+
+# Snapshot rows read from the cache per query
+SNAPSHOT_PAGE = 10000
+# Checkpoints older than this many seconds are discarded instead of resumed
+CHECKPOINT_MAX_AGE = 24 * 3600
+
+
+def default_cache_path():
+    """Returns the platform-specific location of the persistent scan cache."""
+    if platform.system() == "Windows":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pcCleaner", "scan_cache.sqlite3")
+
+
+class ScanCache:
+    """Persistent SQLite store of scanned trees.
+
+    Each saved root is stored as its directory nodes in pre-order, so a tree
+    is rebuilt with one sequential read. Nodes keep their mtime and inode so a
+    refresh can tell which directories need to be read again. The root's file
+    rankings are stored alongside (top is NULL for the whole tree).
+
+    An unfinished scan checkpoints its completed subtrees, in the same
+    pre-order form, so it can resume from them after a cancel or crash.
+    File types are stored as JSON with extension names, since the packed
+    form only holds ids interned by the running process.
+
+    Snapshots keep only the totals of every directory, keyed by snapshot_key
+    so that two snapshots can be read back in the same order and diffed.
+
+    Saved trees and checkpoints record the rules_fingerprint of the
+    exclusion rules they were scanned with, and are only read back for the
+    same rules; trees saved before rules were recorded count as unknown.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS scans (
+            root TEXT PRIMARY KEY,
+            scanned_at REAL NOT NULL,
+            rules TEXT
+        );
+        CREATE TABLE IF NOT EXISTS nodes (
+            root TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            parent INTEGER,
+            name TEXT NOT NULL,
+            mtime_ns INTEGER,
+            ino INTEGER,
+            own_size INTEGER NOT NULL,
+            own_files INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            files INTEGER NOT NULL,
+            types TEXT,
+            PRIMARY KEY (root, id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS top_files (
+            root TEXT NOT NULL,
+            top TEXT,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS top_files_root ON top_files (root);
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            scan_root TEXT NOT NULL,
+            path TEXT NOT NULL,
+            saved_at REAL NOT NULL,
+            rules TEXT,
+            PRIMARY KEY (scan_root, path)
+        );
+        CREATE TABLE IF NOT EXISTS checkpoint_nodes (
+            scan_root TEXT NOT NULL,
+            root TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            parent INTEGER,
+            name TEXT NOT NULL,
+            mtime_ns INTEGER,
+            ino INTEGER,
+            own_size INTEGER NOT NULL,
+            own_files INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            files INTEGER NOT NULL,
+            types TEXT,
+            PRIMARY KEY (scan_root, root, id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY,
+            root TEXT NOT NULL,
+            taken_at REAL NOT NULL,
+            size INTEGER,
+            files INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS snapshots_root ON snapshots (root);
+        CREATE TABLE IF NOT EXISTS snapshot_nodes (
+            snapshot INTEGER NOT NULL,
+            key BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            files INTEGER NOT NULL,
+            PRIMARY KEY (snapshot, key)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or default_cache_path()
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Saves run on a background thread; the lock serialises them with loads
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.executescript(self.SCHEMA)
+        for table in ("nodes", "checkpoint_nodes"):
+            columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if "types" not in columns:  # Written before file types were tracked
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN types TEXT")
+        for table in ("scans", "checkpoints"):
+            columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if "rules" not in columns:  # Written before exclusion rules were recorded
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN rules TEXT")
+
+    def close(self):
+        """Closes the database connection."""
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def find_root(self, path, fingerprint=""):
+        """Returns (root, scanned_at) of the saved tree holding path, or None.
+
+        Only trees scanned with the exclusion rules of fingerprint count.
+        """
+        path = os.path.normpath(path)
+        with self.lock:
+            scans = self.conn.execute("SELECT root, scanned_at FROM scans WHERE rules = ?",
+                                      (fingerprint,)).fetchall()
+        for root, scanned_at in scans:
+            if _relative_parts(path, root) is not None:
+                return root, scanned_at
+        return None
+
+    def save(self, path, node, rankings=None, fingerprint=""):
+        """Saves a scanned tree, replacing any saved tree at or below path.
+
+        Args:
+            path (str): Root path of the tree.
+            node (DirNode): Root node of the tree.
+            rankings (dict): File rankings of the tree, as in ScanIndex.
+            fingerprint (str): rules_fingerprint of the tree's exclusion
+                rules, None if unknown.
+        """
+        path = os.path.normpath(path)
+        with self.lock, self.conn:
+            for (root,) in self.conn.execute("SELECT root FROM scans").fetchall():
+                if _relative_parts(root, path) is not None:
+                    self.conn.execute("DELETE FROM nodes WHERE root = ?", (root,))
+                    self.conn.execute("DELETE FROM top_files WHERE root = ?", (root,))
+                    self.conn.execute("DELETE FROM scans WHERE root = ?", (root,))
+            self.conn.executemany(
+                "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._rows(path, node))
+            for top, ranking in (rankings or {}).items():
+                self.conn.executemany(
+                    "INSERT INTO top_files VALUES (?, ?, ?, ?, ?)",
+                    ((path, top, file_path, size, mtime) for file_path, size, mtime in ranking.entries()))
+            self.conn.execute("INSERT INTO scans VALUES (?, ?, ?)", (path, time.time(), fingerprint))
+
+    def _rows(self, path, node):
+        """Yields the pre-order rows of a tree without recursion."""
+        next_id = 0
+        stack = [(node, None)]
+        while stack:
+            current, parent_id = stack.pop()
+            node_id = next_id
+            next_id += 1
+            name = path if parent_id is None else current.name
+            yield (path, node_id, parent_id, name, current.mtime_ns, current.ino,
+                   current.own_size, current.own_files, current.size, current.files, _types_to_json(current.types))
+            if current.children:
+                stack.extend((child, node_id) for child in reversed(current.children))
+
+    def save_checkpoint(self, scan_root, subtrees, fingerprint=""):
+        """Saves completed subtrees of an unfinished scan.
+
+        A subtree replaces any saved one at or below its path, so a parent
+        that completes later takes over its children's checkpoints.
+
+        Args:
+            scan_root (str): Path the scan started from.
+            subtrees (list): (path, DirNode) pairs of complete subtrees.
+            fingerprint (str): rules_fingerprint of the scan's exclusion rules.
+        """
+        with self.lock, self.conn:
+            for path, node in subtrees:
+                # The path itself and everything between path + sep and path + (sep + 1)
+                bounds = (scan_root, path, path + os.sep, path + chr(ord(os.sep) + 1))
+                self.conn.execute("DELETE FROM checkpoint_nodes WHERE scan_root = ? "
+                                  "AND (root = ? OR (root >= ? AND root < ?))", bounds)
+                self.conn.execute("DELETE FROM checkpoints WHERE scan_root = ? "
+                                  "AND (path = ? OR (path >= ? AND path < ?))", bounds)
+                self.conn.executemany(
+                    "INSERT INTO checkpoint_nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((scan_root,) + row for row in self._rows(path, node)))
+                self.conn.execute("INSERT INTO checkpoints VALUES (?, ?, ?, ?)",
+                                  (scan_root, path, time.time(), fingerprint))
+
+    def load_checkpoints(self, scan_root, fingerprint="", max_age=CHECKPOINT_MAX_AGE):
+        """Rebuilds the checkpointed subtrees of an unfinished scan.
+
+        A checkpoint taken with other exclusion rules, or with a subtree
+        saved more than max_age seconds ago, is dropped instead.
+
+        Args:
+            scan_root (str): Path the scan started from.
+            fingerprint (str): rules_fingerprint of the resuming scan's rules.
+            max_age (float): Oldest subtree to resume, in seconds.
+
+        Returns:
+            dict: Subtree path -> DirNode; empty if there is no checkpoint.
+        """
+        with self.lock:
+            stale = self.conn.execute("SELECT COUNT(*) FROM checkpoints WHERE scan_root = ? "
+                                      "AND (rules IS NOT ? OR saved_at < ?)",
+                                      (scan_root, fingerprint, time.time() - max_age)).fetchone()[0]
+        if stale:
+            self.clear_checkpoints(scan_root)
+            return {}
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT root, parent, name, mtime_ns, ino, own_size, own_files, size, files, types "
+                "FROM checkpoint_nodes WHERE scan_root = ? ORDER BY root, id", (scan_root,)).fetchall()
+        subtrees = {}
+        nodes = []
+        for root, parent_id, name, mtime_ns, ino, own_size, own_files, size, files, types in rows:
+            node = DirNode(name)
+            node.mtime_ns = mtime_ns
+            node.ino = ino
+            node.own_size = own_size
+            node.own_files = own_files
+            node.size = size
+            node.files = files
+            node.types = _types_from_json(types)
+            if parent_id is None:
+                nodes = [node]
+                subtrees[root] = node
+            else:
+                nodes[parent_id].add_child(node)
+                nodes.append(node)
+        return subtrees
+
+    def checkpoint_count(self, scan_root):
+        """Returns how many completed subtrees are checkpointed for scan_root."""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM checkpoints WHERE scan_root = ?",
+                                     (scan_root,)).fetchone()[0]
+
+    def clear_checkpoints(self, scan_root):
+        """Drops the checkpoint of a scan that has finished."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM checkpoint_nodes WHERE scan_root = ?", (scan_root,))
+            self.conn.execute("DELETE FROM checkpoints WHERE scan_root = ?", (scan_root,))
+
+    def load(self, root):
+        """Rebuilds a saved tree.
+
+        Args:
+            root (str): Root path as returned by find_root.
+
+        Returns:
+            DirNode: Root node of the tree, or None if nothing was saved.
+        """
+        nodes = []
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT parent, name, mtime_ns, ino, own_size, own_files, size, files, types "
+                "FROM nodes WHERE root = ? ORDER BY id", (root,)).fetchall()
+        for parent_id, name, mtime_ns, ino, own_size, own_files, size, files, types in rows:
+            node = DirNode(name)
+            node.mtime_ns = mtime_ns
+            node.ino = ino
+            node.own_size = own_size
+            node.own_files = own_files
+            node.size = size
+            node.files = files
+            node.types = _types_from_json(types)
+            if parent_id is not None:
+                nodes[parent_id].add_child(node)
+            nodes.append(node)
+        return nodes[0] if nodes else None
+
+    def save_snapshot(self, root, records):
+        """Saves a snapshot of a tree's directory totals.
+
+        Args:
+            root (str): Root path of the tree.
+            records (iterable): (path, depth, size, files, mtime) records of
+                every directory, as yielded by iter_tree.
+
+        Returns:
+            int: Id of the new snapshot.
+        """
+        writer = SnapshotWriter(self, root)
+        try:
+            for record in records:
+                writer.add(*record)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+
+    def snapshots(self, root):
+        """Lists the complete snapshots of root, newest first.
+
+        Returns:
+            list: (id, taken_at, size, files) tuples.
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT id, taken_at, size, files FROM snapshots WHERE root = ? AND size IS NOT NULL "
+                "ORDER BY taken_at DESC, id DESC", (os.path.normpath(root),)).fetchall()
+
+    def snapshot_rows(self, snapshot_id, page=SNAPSHOT_PAGE):
+        """Yields the (key, size, files) rows of a snapshot in key order.
+
+        Rows are read a page at a time, resuming after the last key, so
+        memory stays bounded and other threads can use the cache between
+        pages.
+        """
+        last = None
+        while True:
+            with self.lock:
+                if last is None:
+                    rows = self.conn.execute(
+                        "SELECT key, size, files FROM snapshot_nodes WHERE snapshot = ? ORDER BY key LIMIT ?",
+                        (snapshot_id, page)).fetchall()
+                else:
+                    rows = self.conn.execute(
+                        "SELECT key, size, files FROM snapshot_nodes WHERE snapshot = ? AND key > ? "
+                        "ORDER BY key LIMIT ?", (snapshot_id, last, page)).fetchall()
+            for key, size, files in rows:
+                yield bytes(key), size, files
+            if len(rows) < page:
+                return
+            last = rows[-1][0]
+
+    def delete_snapshot(self, snapshot_id):
+        """Drops a snapshot and its rows."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM snapshot_nodes WHERE snapshot = ?", (snapshot_id,))
+            self.conn.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
+
+    def load_rankings(self, root, limit=DEFAULT_TOP_FILES):
+        """Rebuilds the file rankings saved with a tree.
+
+        Args:
+            root (str): Root path as returned by find_root.
+            limit (int): Ranking size.
+
+        Returns:
+            dict: Rankings as in ScanIndex; empty if none were saved.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT top, path, size, mtime FROM top_files WHERE root = ?", (root,)).fetchall()
+        rankings = {}
+        for top, path, size, mtime in rows:
+            if top not in rankings:
+                rankings[top] = FileRanking(limit)
+            rankings[top].offer(path, size, mtime)
+        return rankings
+
+
+def snapshot_key(parts):
+    """Returns the snapshot key of a directory from its path components below the root.
+
+    Components are joined by a NUL byte, which sorts before every byte a
+    file name can contain, so in key order each directory is followed by
+    its whole subtree: the pre-order of a tree with children sorted by name.
+    """
+    return b"\0".join(os.fsencode(part) for part in parts)
+
+
+def _key_path(root, key):
+    """Returns the full path of a snapshot key below root."""
+    if not key:
+        return root
+    return os.path.join(root, *(os.fsdecode(part) for part in key.split(b"\0")))
+
+
+class SnapshotWriter:
+    """Streams the directory totals of a tree into a new snapshot.
+
+    Directories may be added in any order, e.g. children first as
+    stream_scan reports them. Rows are written in batches, and the snapshot
+    is only listed once close() has stored the root's totals. Paths are
+    taken relative to scanned_path, which defaults to root; pass it when the
+    scan was given root in another form, e.g. relative to the working
+    directory.
+    """
+
+    BATCH = 10000
+
+    def __init__(self, store, root, scanned_path=None):
+        self.store = store
+        self.root = os.path.normpath(root)
+        self.scanned_path = os.path.normpath(scanned_path) if scanned_path else self.root
+        self.rows = []
+        self.size = self.files = None
+        with store.lock, store.conn:
+            self.id = store.conn.execute("INSERT INTO snapshots (root, taken_at) VALUES (?, ?)",
+                                         (self.root, time.time())).lastrowid
+
+    def add(self, path, depth, size, files, mtime=None):
+        """Adds one directory; the arguments match stream_scan's on_dir."""
+        key = snapshot_key(_relative_parts(path, self.scanned_path))
+        if not key:
+            self.size, self.files = size, files
+        self.rows.append((self.id, key, size, files))
+        if len(self.rows) >= self.BATCH:
+            self._flush()
+
+    def _flush(self):
+        with self.store.lock, self.store.conn:
+            self.store.conn.executemany("INSERT OR REPLACE INTO snapshot_nodes VALUES (?, ?, ?, ?)", self.rows)
+        self.rows = []
+
+    def close(self):
+        """Writes the remaining rows and completes the snapshot.
+
+        Returns:
+            int: Id of the snapshot.
+        """
+        self._flush()
+        with self.store.lock, self.store.conn:
+            self.store.conn.execute("UPDATE snapshots SET size = ?, files = ? WHERE id = ?",
+                                    (self.size or 0, self.files or 0, self.id))
+        return self.id
+
+    def abort(self):
+        """Drops an unfinished snapshot."""
+        self.rows = []
+        self.store.delete_snapshot(self.id)
+
+
+# Directories are opened and listed through descriptors where the platform
+# allows it, so per-file stats are fstatat() calls relative to the directory
+# instead of full path lookups.
+_DIR_FD_SUPPORTED = os.scandir in os.supports_fd and os.open in os.supports_dir_fd
+_DIR_OPEN_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+_SUBDIR_OPEN_FLAGS = _DIR_OPEN_FLAGS | getattr(os, "O_NOFOLLOW", 0)
+# Deeper than MAX_OPEN_DIRS, only every ANCHOR_INTERVAL-th level keeps its
+# descriptor open and the levels in between are opened by a short relative
+# path from it, so very deep trees neither run out of descriptors nor hit
+# PATH_MAX
+MAX_OPEN_DIRS = 128
+ANCHOR_INTERVAL = 32
+# Syscalls of one listing besides per-file stats. scandir() of a path opens,
+# reads (getdents) and closes it; scandir() of a descriptor does the same with
+# a dup of it
+LISTING_SYSCALLS = 3
+# Syscalls of the descriptor a directory is listed through: open, fstat, close
+DESCRIPTOR_SYSCALLS = 3
+# Seconds between checkpoints of an interrupted-scan-safe walk
+CHECKPOINT_INTERVAL = 30
+
+
+# Listings in flight per device, by kind of storage. Spinning disks thrash
+# when several walkers seek at once, while network filesystems hide their
+# latency best with many requests outstanding; None is the walker's default.
+DEVICE_CONCURRENCY = {"hdd": 2, "ssd": None, "network": 64, "unknown": None}
+DEVICE_KINDS = tuple(DEVICE_CONCURRENCY)
+_NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph", "glusterfs", "lustre", "gpfs",
+                        "fuse.sshfs", "fuse.rclone", "fuse.s3fs", "davfs"}
+_device_kinds = {}  # st_dev -> kind, filled as devices are met
+
+
+def _mount_types():
+    """Returns {"major:minor": filesystem type} of the mounted filesystems, on Linux."""
+    types = {}
+    try:
+        with open("/proc/self/mountinfo") as f:
+            for line in f:
+                fields = line.split()
+                types.setdefault(fields[2], fields[fields.index("-", 6) + 1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return types
+
+
+def device_kind(dev):
+    """Returns the kind of storage holding a device number: "hdd", "ssd", "network" or "unknown".
+
+    Network filesystems are recognised by their type in the mount table;
+    block devices by the rotational flag sysfs keeps for the disk (for a
+    partition, for the disk holding it). Elsewhere, and for devices without
+    either, such as btrfs subvolumes, the kind is "unknown". Results are
+    cached per device.
+    """
+    kind = _device_kinds.get(dev)
+    if kind is not None:
+        return kind
+    kind = "unknown"
+    if hasattr(os, "major"):
+        number = f"{os.major(dev)}:{os.minor(dev)}"
+        fstype = _mount_types().get(number, "")
+        if fstype in _NETWORK_FILESYSTEMS or fstype.startswith("nfs"):
+            kind = "network"
+        else:
+            block = os.path.join("/sys/dev/block", number)
+            for flag in (os.path.join(block, "queue", "rotational"), os.path.join(block, "..", "queue", "rotational")):
+                try:
+                    with open(flag) as f:
+                        kind = "hdd" if f.read().strip() == "1" else "ssd"
+                    break
+                except OSError:
+                    continue
+    _device_kinds[dev] = kind
+    return kind
+
+
+# Exclusion rules compare names case-insensitively where the filesystem does
+_IGNORE_CASE = os.path.normcase("A") == "a"
+
+
+def _glob_regex(pattern):
+    """Translates a gitignore-style glob into the body of a regular expression.
+
+    * and ? stay within one path component, [...] is a character class
+    ([!...] negated) and a ** component spans any number of components.
+    A backslash escapes the next character.
+    """
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/") and (i + 2 == n or pattern[i + 2] == "/"):
+            if i + 2 == n:
+                out.append(".*")
+                i += 2
+            else:
+                out.append("(?:.*/)?")
+                i += 3
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            j = pattern.find("]", j)
+            if j < 0:
+                out.append("\\[")
+            else:
+                body = pattern[i + 1:j]
+                negate = body[:1] in ("!", "^")
+                if negate:
+                    body = body[1:]
+                body = body.replace("\\", "\\\\").replace("[", "\\[")
+                out.append(f"[^/{body}]" if negate else f"[{body}]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class ExcludeRules:
+    """Gitignore-style rules for folders and files that scans leave out.
+
+    One rule per line; blank lines and lines starting with # are ignored.
+
+    - A pattern without a slash, like node_modules or *.iso, matches that
+      name at any depth.
+    - A trailing slash, like build/, matches folders only.
+    - A leading slash anchors the pattern at the filesystem root, so /proc
+      or /mnt/backup exclude those folders whatever folder is scanned (in a
+      .gitignore it would anchor at the .gitignore's folder). Other patterns
+      with a slash, like .git/objects, match at any depth.
+    - * and ? match within one component, [abc] is a character class and
+      ** matches any number of components.
+    - A leading ! re-includes what an earlier rule excluded; the last
+      matching rule wins. As in git, nothing below an excluded folder can be
+      re-included, because it is never read.
+
+    The rules are compiled into one matcher: exact names, name suffixes
+    (*.iso) and anchored paths go into hash tables, and the other glob
+    patterns into one alternation for names and one for paths, ordered last
+    rule first so the first alternative that matches is the rule that
+    decides. A check costs a few dict lookups and at most two regex matches
+    however many rules there are.
+    Matching uses absolute paths, with / as the separator.
+
+    ``fingerprint`` identifies the rules, so trees scanned with other rules
+    are not reused; see rules_fingerprint.
+
+    Args:
+        patterns (iterable): Rule lines.
+
+    Raises:
+        ValueError: A pattern is not a valid glob.
+    """
+
+    def __init__(self, patterns=()):
+        self.patterns = []
+        self.match_files = False  # Some rule can match a file, so listings check every file name
+        self._names = {}  # Literal name -> [(rule, negated, folders only)], last rule last
+        self._suffixes = {}  # Literal name suffix of a *suffix pattern -> [(rule, negated, folders only)]
+        self._paths = {}  # Literal absolute path -> [(rule, negated, folders only)]
+        self._negated = []  # Rule number -> negated
+        dir_names, file_names, dir_paths, file_paths = [], [], [], []
+        for line in patterns:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            rule = len(self._negated)
+            self.patterns.append(line)
+            negated = line.startswith("!")
+            if negated or line.startswith(("\\!", "\\#")):
+                line = line[1:]
+            folders_only = line.endswith("/")
+            pattern = line.rstrip("/")
+            if os.sep != "/":
+                pattern = pattern.replace(os.sep, "/")
+            self._negated.append(negated)
+            if not pattern:
+                continue
+            self.match_files = self.match_files or not folders_only
+            anchored = pattern.startswith("/") or os.path.isabs(pattern)
+            literal = not any(c in pattern for c in "*?[\\")
+            suffix = pattern[1:] if pattern.startswith("*") and "/" not in pattern else None
+            if suffix and not any(c in suffix for c in "*?[\\"):
+                literal = True
+            if literal and (anchored or "/" not in pattern):
+                key = (suffix or pattern).lower() if _IGNORE_CASE else suffix or pattern
+                table = self._paths if anchored else self._suffixes if suffix else self._names
+                table.setdefault(key, []).append((rule, negated, folders_only))
+                continue
+            body = _glob_regex(pattern)
+            try:
+                re.compile(body)
+            except re.error as e:
+                raise ValueError(f"Invalid exclusion pattern {line!r}: {e}")
+            if "/" not in pattern:
+                targets = (dir_names,) if folders_only else (dir_names, file_names)
+            else:
+                if not anchored:
+                    body = "(?:.*/)?" + body
+                targets = (dir_paths,) if folders_only else (dir_paths, file_paths)
+            for target in targets:
+                target.append(f"(?P<r{rule}>{body})")
+        self._suffix_lengths = sorted({len(suffix) for suffix in self._suffixes})
+        flags = re.IGNORECASE if _IGNORE_CASE else 0
+        self._dir_names, self._file_names, self._dir_paths, self._file_paths = (
+            re.compile("|".join(reversed(alternatives)), flags) if alternatives else None
+            for alternatives in (dir_names, file_names, dir_paths, file_paths))
+        # Last components of the anchored paths; other names need no path lookup
+        self._path_names = {key[key.rfind("/") + 1:] for key in self._paths}
+        self.fingerprint = hashlib.sha1("\n".join(self.patterns).encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def load(cls, path):
+        """Reads rules from a file, one per line.
+
+        Raises:
+            OSError: The file cannot be read.
+            ValueError: A pattern is not a valid glob.
+        """
+        with open(path, encoding="utf-8") as f:
+            return cls(f.read().splitlines())
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def excluded(self, path, is_dir=True):
+        """Returns True if a rule leaves the folder or file at path out.
+
+        Args:
+            path (str): Path of the entry; relative paths are made absolute.
+            is_dir (bool): The entry is a folder.
+        """
+        return self.excluded_entry(None, path[path.rfind(os.sep) + 1:], is_dir, path)
+
+    def excluded_entry(self, directory, name, is_dir=True, path=None):
+        """Like excluded, for a directory entry; its path is only joined when a path rule needs it.
+
+        Args:
+            directory (str): Path of the directory holding the entry.
+            name (str): Name of the entry.
+            is_dir (bool): The entry is a folder.
+            path (str): Path of the entry, if already known.
+        """
+        if _IGNORE_CASE:
+            name = name.lower()
+        rules = self._names.get(name)
+        decided, excluded = self._lookup(rules, is_dir) if rules else (-1, False)
+        for length in self._suffix_lengths:
+            rules = self._suffixes.get(name[-length:])
+            if rules:
+                rule, verdict = self._lookup(rules, is_dir)
+                if rule > decided:
+                    decided, excluded = rule, verdict
+        regex = self._dir_names if is_dir else self._file_names
+        match = regex.fullmatch(name) if regex is not None else None
+        if match is not None:
+            rule = int(match.lastgroup[1:])
+            if rule > decided:
+                decided, excluded = rule, not self._negated[rule]
+        regex = self._dir_paths if is_dir else self._file_paths
+        if regex is not None or name in self._path_names:
+            if path is None:
+                path = os.path.join(directory, name)
+            if not os.path.isabs(path):
+                path = os.path.abspath(path)
+            if os.sep != "/":
+                path = path.replace(os.sep, "/")
+            rules = self._paths.get(path.lower() if _IGNORE_CASE else path)
+            if rules:
+                rule, verdict = self._lookup(rules, is_dir)
+                if rule > decided:
+                    decided, excluded = rule, verdict
+            match = regex.fullmatch(path) if regex is not None else None
+            if match is not None:
+                rule = int(match.lastgroup[1:])
+                if rule > decided:
+                    excluded = not self._negated[rule]
+        return excluded
+
+    @staticmethod
+    def _lookup(rules, is_dir):
+        """Returns (rule number, excluded) of the last literal rule that applies, or (-1, False)."""
+        for rule, negated, folders_only in reversed(rules):
+            if is_dir or not folders_only:
+                return rule, not negated
+        return -1, False
+
+
+def rules_fingerprint(exclude):
+    """Returns the fingerprint of the ExcludeRules a tree is scanned with, "" for none.
+
+    Scan indexes, the scan cache and checkpoints record it with each tree,
+    since a listing read under other rules counts other files.
+    """
+    return exclude.fingerprint if exclude else ""
+
+
+class ListingCancelled(OSError):
+    """Error of a listing cut short by its CancelToken; its totals are partial and must not be used."""
+
+    def __init__(self, path=None):
+        super().__init__(errno.ECANCELED, os.strerror(errno.ECANCELED), path)
+
+
+def _read_entries(target, rank_limit=0, files=None, token=None, types=None, inode_order=False, exclude=None,
+                  path=None):
+    """Reads one directory listing.
+
+    File sizes come from DirEntry.stat(), which is an fstatat() relative to
+    the directory when target is a descriptor. Entry types come from the
+    listing itself, so directories cost no stat here. The same stat results
+    feed the file ranking, so ranking costs no extra syscalls.
+
+    Args:
+        target: Directory path or open directory descriptor.
+        rank_limit (int): Rank this many largest and oldest files; 0 skips it.
+        files (list): If given, (name, size, mtime) of every file is appended to it.
+        token (CancelToken): Stops reading a huge listing early once cancelled;
+            error is then a ListingCancelled.
+        types (FileTypes): If given, every file is tallied into it.
+        inode_order (bool): Stat the files, and list the subdirectories, in
+            inode order, which cuts seeks on rotational disks.
+        exclude (ExcludeRules): Entries it excludes are skipped, excluded
+            files without a stat.
+        path (str): Path of the directory, for the exclude rules when target
+            is a descriptor.
+
+    Returns:
+        tuple: (own_size, own_files, subdirs, error, ranking) where subdirs
+        lists the subdirectory names, error is the first OSError that cut the
+        listing short or skipped a file, if any (a ListingCancelled when the
+        token cut it short), and ranking is a FileRanking
+        of file names (None when not ranking or the directory has no files).
+    """
+    own_size = 0
+    own_files = 0
+    subdirs = []
+    ranking = FileRanking(rank_limit) if rank_limit else None
+    error = None
+    if exclude is not None and path is None:
+        path = target
+    exclude_files = exclude is not None and exclude.match_files
+    try:
+        with os.scandir(target) as entries:
+            if inode_order:
+                entries = sorted(entries, key=lambda item: item.inode())
+            for count, item in enumerate(entries):
+                if token is not None and not count & 1023 and token.cancelled:
+                    error = ListingCancelled(path if path is not None else target)
+                    break
+                if item.is_file(follow_symlinks=False):
+                    if exclude_files and exclude.excluded_entry(path, item.name, False):
+                        continue
+                    try:
+                        st = item.stat(follow_symlinks=False)
+                    except OSError as e:  # Deleted or unreadable since the listing
+                        error = error or e
+                        continue
+                    own_size += st.st_size
+                    own_files += 1
+                    if ranking is not None:
+                        ranking.offer(item.name, st.st_size, st.st_mtime)
+                    if files is not None:
+                        files.append((item.name, st.st_size, st.st_mtime))
+                    if types is not None:
+                        types.add(item.name, st.st_size, st.st_mtime)
+                elif item.is_dir(follow_symlinks=False):
+                    if exclude is None or not exclude.excluded_entry(path, item.name):
+                        subdirs.append(item.name)
+    except (PermissionError, FileNotFoundError, OSError) as e:
+        error = error or e
+    return own_size, own_files, subdirs, error, ranking or None
+
+
+class CancelToken:
+    """Cancellation flag of one scan or search.
+
+    Each operation gets its own token, so cancelling one never affects the
+    next. Thread workers check it while reading large listings.
+    """
+
+    __slots__ = ("_event",)
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Asks the operation holding the token to stop."""
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        """Sleeps up to timeout seconds, waking early when cancelled."""
+        return self._event.wait(timeout)
+
+
+def _error_name(error):
+    """Returns a short name for an OSError, such as "EACCES"."""
+    return errno.errorcode.get(error.errno) or type(error).__name__
+
+
+class ScanStats:
+    """Live instrumentation of a scan: listing times, errors and missing space.
+
+    The scanning thread makes one cheap call per directory; any thread can
+    read snapshot() while the scan runs. Only the slowest directories and the
+    first error paths are kept, so memory does not grow with the tree. Set
+    on_dir to on_dir(path, seconds, entries) or on_error to
+    on_error(path, error_name, message) to see every directory or error.
+    """
+
+    SLOWEST = 100
+    MAX_ERROR_PATHS = 1000
+
+    def __init__(self, on_dir=None, on_error=None):
+        self.on_dir = on_dir
+        self.on_error = on_error
+        self.reset()
+
+    def reset(self, root=None):
+        """Starts counting a new scan of root."""
+        self.root = root
+        self.started = time.time()
+        self.finished = None
+        self.dirs = 0
+        self.entries = 0
+        self.listing_seconds = 0.0
+        self.slowest = []  # Min-heap of (seconds, path, entries)
+        self.histogram = [0] * 24  # Directories per listing time, in doubling buckets from 1 µs
+        self.devices = {}  # st_dev -> [shortest path seen, dirs, entries, listing seconds]
+        self.errors = {}  # Error name -> count
+        self.error_paths = []  # (path, error name, message) of the first errors
+        self.unreadable_dirs = 0
+        self.skipped_mounts = 0  # Directories on other filesystems left unread
+        self.scanned_bytes = None
+        self.used_bytes = None
+
+    def record_dir(self, path, seconds, entries, dev=None):
+        """Counts one listed directory.
+
+        Args:
+            path (str): Directory path.
+            seconds (float): Time spent opening and listing it.
+            entries (int): Files and subdirectories it holds.
+            dev (int): Device number, to add up the time per filesystem.
+        """
+        self.dirs += 1
+        self.entries += entries
+        self.listing_seconds += seconds
+        self.histogram[min(len(self.histogram) - 1, int(seconds * 1e6).bit_length())] += 1
+        if len(self.slowest) < self.SLOWEST:
+            heapq.heappush(self.slowest, (seconds, path, entries))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, path, entries))
+        if dev is not None:
+            device = self.devices.get(dev)
+            if device is None:
+                self.devices[dev] = [path, 1, entries, seconds]
+            else:
+                if len(path) < len(device[0]):
+                    device[0] = path
+                device[1] += 1
+                device[2] += entries
+                device[3] += seconds
+        if self.on_dir is not None:
+            self.on_dir(path, seconds, entries)
+
+    def record_error(self, path, error, unreadable=False):
+        """Counts an error met while scanning path.
+
+        Args:
+            path (str): Directory being scanned.
+            error (OSError): The error.
+            unreadable (bool): The directory could not be listed at all, so
+                nothing below it is counted.
+        """
+        name = _error_name(error)
+        self.errors[name] = self.errors.get(name, 0) + 1
+        if unreadable:
+            self.unreadable_dirs += 1
+        if len(self.error_paths) < self.MAX_ERROR_PATHS:
+            self.error_paths.append((path, name, error.strerror or str(error)))
+            logging.warning(f"Error scanning {path}: {error}")
+        if self.on_error is not None:
+            self.on_error(path, name, error.strerror or str(error))
+
+    def finish(self, size):
+        """Stops the clock and compares the scanned total with the disk usage.
+
+        Args:
+            size (int): Bytes counted by the scan.
+        """
+        self.finished = time.time()
+        self.scanned_bytes = size
+        # Only a whole filesystem can be compared with its usage
+        if self.root and os.path.ismount(self.root):
+            try:
+                self.used_bytes = shutil.disk_usage(self.root).used
+            except OSError:
+                self.used_bytes = None
+
+    def snapshot(self):
+        """Returns the current figures as a JSON-serialisable dict."""
+        elapsed = (self.finished or time.time()) - self.started
+        unaccounted = None
+        if self.used_bytes is not None and self.scanned_bytes is not None:
+            unaccounted = max(0, self.used_bytes - self.scanned_bytes)
+        return {
+            "root": self.root,
+            "elapsed_seconds": round(elapsed, 3),
+            "finished": self.finished is not None,
+            "dirs": self.dirs,
+            "entries": self.entries,
+            "entries_per_second": round(self.entries / elapsed, 1) if elapsed > 0 else None,
+            "listing_seconds": round(self.listing_seconds, 3),
+            "listing_time_histogram_us": {str(1 << bucket >> 1): count
+                                          for bucket, count in enumerate(self.histogram) if count},
+            "slowest_dirs": [{"path": path, "seconds": round(seconds, 6), "entries": entries}
+                             for seconds, path, entries in sorted(self.slowest, reverse=True)],
+            "devices": [{"dev": dev, "kind": device_kind(dev), "path": path, "dirs": dirs, "entries": entries,
+                         "seconds": round(seconds, 3)}
+                        for dev, (path, dirs, entries, seconds) in list(self.devices.items())],
+            "errors": dict(self.errors),
+            "error_paths": [{"path": path, "error": name, "message": message}
+                            for path, name, message in list(self.error_paths)],
+            "unreadable_dirs": self.unreadable_dirs,
+            "skipped_mount_points": self.skipped_mounts,
+            "scanned_bytes": self.scanned_bytes,
+            "filesystem_used_bytes": self.used_bytes,
+            "unaccounted_bytes": unaccounted,
+        }
+
+    def dump(self, path):
+        """Writes snapshot() to a JSON file."""
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+# Directories listed exactly, breadth first, per estimated folder before probing
+ESTIMATE_LISTINGS = 512
+# Random walks from the unlisted frontier per estimated folder
+ESTIMATE_PROBES = 128
+# Files stat()ed per directory while estimating; the rest are extrapolated
+ESTIMATE_FILE_SAMPLE = 512
+# Normal quantile of the two-sided 95% confidence intervals
+ESTIMATE_Z = 1.96
+
+
+class SizeEstimate(namedtuple("SizeEstimate", "size low high files probes")):
+    """Estimated totals of a folder tree: its size with an approximate 95%
+    confidence interval (low, high), its file count and the number of probes behind
+    them, 0 when the tree was small enough to list completely."""
+
+    __slots__ = ()
+
+    @property
+    def margin(self):
+        """Returns the half-width of the interval as a fraction of the size."""
+        return (self.high - self.low) / 2 / self.size if self.size else 0.0
+
+
+def _list_entries(path, only_dev=None, exclude=None):
+    """Lists one directory for SizeEstimator without stat()ing its files.
+
+    Entries excluded by the ExcludeRules exclude are left out.
+
+    Returns:
+        tuple: (files, subdirs), the DirEntry objects of the files and the
+        subdirectory names. A directory that cannot be read, or is on
+        another device than only_dev, counts as empty.
+    """
+    files = []
+    subdirs = []
+    try:
+        if only_dev is not None and os.stat(path).st_dev != only_dev:
+            return files, subdirs
+        with os.scandir(path) as entries:
+            for item in entries:
+                if item.is_file(follow_symlinks=False):
+                    if exclude is None or not exclude.match_files or not exclude.excluded(item.path, False):
+                        files.append(item)
+                elif item.is_dir(follow_symlinks=False):
+                    if exclude is None or not exclude.excluded(item.path):
+                        subdirs.append(item.name)
+    except OSError:
+        pass  # Left to the exact scan to report
+    return files, subdirs
+
+
+def _sample_sizes(files, file_sample, rng):
+    """Stats at most file_sample of a directory's files, drawn at random.
+
+    DirEntry caches its stat result, so drawing again from the same files
+    only stat()s the ones not drawn before.
+
+    Returns:
+        tuple: (own_size, own_files, variance); own_size extrapolates the
+        mean size of the sampled files to all of them and variance is the
+        sampling variance of that extrapolation (0 when every file was
+        stat()ed).
+    """
+    sample = files if len(files) <= file_sample else rng.sample(files, file_sample)
+    sizes = []
+    for item in sample:
+        try:
+            sizes.append(item.stat(follow_symlinks=False).st_size)
+        except OSError:
+            pass
+    total = len(files)
+    if not sizes:
+        return 0, total, 0.0
+    if len(sizes) == total or len(sizes) < 2:
+        return sum(sizes) * total // len(sizes), total, 0.0
+    mean = sum(sizes) / len(sizes)
+    spread = sum((size - mean) ** 2 for size in sizes) / (len(sizes) - 1)
+    # Sampling without replacement: the finite population correction shrinks the variance
+    variance = total * total * (1 - len(sizes) / total) * spread / len(sizes)
+    return int(mean * total), total, variance
+
+
+class SizeEstimator:
+    """Estimates the totals of folder trees by sampling instead of a full scan.
+
+    The top of each tree is listed breadth first until listings directories
+    have been read, so shallow folders count exactly. Whatever lies below
+    that frontier is estimated with random walks (Knuth's estimator): each
+    probe starts at a random frontier directory and walks down to a leaf,
+    picking one subdirectory at random on every level and weighting each
+    directory's own totals by the product of the branching factors above
+    it. Averaged over the probes this is an unbiased estimate of the
+    frontier's totals, and the spread of the probes, plus that of the file
+    samples, gives the confidence interval. Directories with more than
+    file_sample files have only a random sample of them stat()ed, drawn
+    afresh by every probe that reaches them, so the probes stay independent.
+
+    An estimate costs at most listings plus probes times the tree depth
+    listings, however many files the tree holds. Intervals are widest for
+    trees whose size sits in a few deep folders or a few huge files, and
+    such heavy tails also make them miss more often than one time in twenty.
+
+    Args:
+        listings (int): Directories listed exactly per estimated folder.
+        probes (int): Random walks per estimated folder.
+        file_sample (int): Most files stat()ed per directory.
+        seed: Seeds the random choices, for reproducible estimates.
+        only_dev (int): Count directories on other devices as empty, like
+            one_filesystem scans.
+        exclude (ExcludeRules): Leave out the folders and files it excludes.
+
+    Raises:
+        ValueError: probes is less than 1.
+    """
+
+    def __init__(self, listings=ESTIMATE_LISTINGS, probes=ESTIMATE_PROBES, file_sample=ESTIMATE_FILE_SAMPLE,
+                 seed=None, only_dev=None, exclude=None):
+        if probes < 1:
+            raise ValueError(f"probes must be at least 1, not {probes}")
+        self.listings = listings
+        self.probes = probes
+        self.file_sample = file_sample
+        self.seed = seed
+        self.only_dev = only_dev
+        self.exclude = exclude
+        self.dirs_read = 0  # Directories listed by all estimates so far
+        self._lock = threading.Lock()
+
+    def estimate(self, path, token=None):
+        """Estimates the total size and file count of a folder tree.
+
+        Safe to call from several threads for different folders.
+
+        Args:
+            path (str): Folder to estimate.
+            token (CancelToken): Stops the estimate.
+
+        Returns:
+            SizeEstimate: The estimate, or None if cancelled.
+        """
+        rng = random.Random(f"{self.seed}:{path}") if self.seed is not None else random.Random()
+        cache = {}  # Path -> (files, subdirs), so probes sharing a path list it once
+
+        def listing(current):
+            entry = cache.get(current)
+            if entry is None:
+                entry = cache[current] = self._list(current)
+            return entry
+
+        size = files = variance = 0
+        frontier = deque([path])
+        for _ in range(self.listings):
+            if not frontier:
+                break
+            if token is not None and token.cancelled:
+                return None
+            current = frontier.popleft()
+            files_found, subdirs = self._list(current)
+            own_size, own_files, own_variance = _sample_sizes(files_found, self.file_sample, rng)
+            size += own_size
+            files += own_files
+            variance += own_variance
+            frontier.extend(os.path.join(current, name) for name in subdirs)
+        probes = 0
+        if frontier:
+            frontier = list(frontier)
+            sizes = []
+            counts = []
+            for _ in range(self.probes):
+                if token is not None and token.cancelled:
+                    return None
+                probe_size = probe_files = 0
+                weight = len(frontier)
+                current = rng.choice(frontier)
+                while True:
+                    files_found, subdirs = listing(current)
+                    own_size, own_files, _ = _sample_sizes(files_found, self.file_sample, rng)
+                    probe_size += weight * own_size
+                    probe_files += weight * own_files
+                    if not subdirs:
+                        break
+                    weight *= len(subdirs)
+                    current = os.path.join(current, rng.choice(subdirs))
+                sizes.append(probe_size)
+                counts.append(probe_files)
+            probes = len(sizes)
+        if probes:
+            mean = sum(sizes) / probes
+            size += mean
+            files += sum(counts) / probes
+            if probes > 1:
+                variance += sum((probe - mean) ** 2 for probe in sizes) / (probes - 1) / probes
+        half_width = ESTIMATE_Z * variance ** 0.5
+        return SizeEstimate(int(size), int(max(0, size - half_width)), int(size + half_width), int(files), probes)
+
+    def _list(self, path):
+        """Runs _list_entries on one directory and counts it in dirs_read."""
+        entry = _list_entries(path, self.only_dev, self.exclude)
+        with self._lock:  # Estimates of several folders run on a thread pool
+            self.dirs_read += 1
+        return entry
+
+
+class DirectoryScanner:
+    """Handles directory scanning logic for TreeSizeApp and the command line."""
+    
+    def __init__(self, app=None):
+        self.app = app
+        self.dirs_scanned = 0  # Approximate live progress counter
+        self.files_scanned = 0
+        self.syscalls = 0  # Filesystem syscalls issued, to measure per-file cost
+        self.stats = ScanStats()
+        # Set to a FileRanking to rank files during get_folder_info; on a
+        # refresh, ranking_carry maps directory paths to their previously
+        # ranked (path, size, mtime) files, re-offered when a listing is reused
+        self.ranking = None
+        self.ranking_carry = None
+        # Tally every subtree's files by extension and age into DirNode.types
+        self.collect_types = True
+        # Leave directories on other filesystems than the scanned one unread, like du -x
+        self.one_filesystem = False
+        self._only_dev = None
+        # ExcludeRules of folders and files to leave unread; excluded folders cost no I/O at all
+        self.exclude = None
+
+    def syscalls_per_file(self):
+        """Returns the filesystem syscalls issued per file scanned so far."""
+        return self.syscalls / self.files_scanned if self.files_scanned else 0.0
+
+    def scan(self, path, token=None):
+        """Scans a directory and returns folder sizes and file counts.
+
+        Args:
+            path (str): Directory path to scan.
+            token (CancelToken): Cancels the scan.
+
+        Returns:
+            dict: Dictionary mapping folder names to (size, files) tuples.
+        """
+        root = self.scan_tree(path, token=token)
+        if token is not None and token.cancelled:
+            return {}
+        return {node.name: (node.size, node.files) for node in root.children or ()}
+
+    def estimate(self, path, probes=ESTIMATE_PROBES, seed=None, token=None):
+        """Estimates folder sizes and file counts by sampling instead of scanning.
+
+        With one_filesystem, folders on other filesystems than path count as
+        empty.
+
+        Args:
+            path (str): Directory path to estimate.
+            probes (int): Random walks per subfolder; see SizeEstimator.
+            seed: Seeds the random choices, for reproducible estimates.
+            token (CancelToken): Cancels the estimate.
+
+        Returns:
+            dict: Dictionary mapping folder names to SizeEstimate tuples.
+
+        Raises:
+            ValueError: probes is less than 1.
+        """
+        only_dev = None
+        if self.one_filesystem:
+            try:
+                only_dev = os.stat(path).st_dev
+            except OSError:
+                pass  # Nothing to estimate; the listing below finds no folders
+        estimator = SizeEstimator(probes=probes, seed=seed, only_dev=only_dev, exclude=self.exclude)
+        _, subdirs = _list_entries(path, exclude=self.exclude)
+        estimates = {}
+        for name in subdirs:
+            estimate = estimator.estimate(os.path.join(path, name), token)
+            if estimate is None:
+                return {}
+            estimates[name] = estimate
+        self.dirs_scanned += 1 + estimator.dirs_read
+        return estimates
+
+    def scan_tree(self, path, previous=None, token=None):
+        """Scans a directory once and indexes its whole subtree.
+
+        Args:
+            path (str): Directory path to scan.
+            previous (DirNode): Earlier scan of the same path with the same
+                exclude rules; directories whose mtime and inode are
+                unchanged reuse its totals.
+            token (CancelToken): Cancels the scan.
+
+        Returns:
+            DirNode: Root node named after the full path.
+        """
+        root = DirNode(os.path.normpath(path))
+        try:
+            self.get_folder_info(path, root, previous, token)
+        except (PermissionError, FileNotFoundError, OSError) as e:
+            logging.error(f"Error scanning {path}: {e}")
+        return root
+
+    def iter_files(self, directory, min_size=0, token=None):
+        """Walks a tree and yields its regular files, without recursion.
+
+        Each directory is opened by its path and, where the platform allows
+        it, listed through its descriptor, so the file stats are fstatat()
+        calls relative to it. A file that vanishes or cannot be stat()ed is
+        recorded in ``stats`` and skipped; the rest of its directory is still
+        read.
+
+        Args:
+            directory (str): Directory path to walk.
+            min_size (int): Skip files smaller than this many bytes.
+            token (CancelToken): Stops the walk.
+
+        Yields:
+            tuple: (path, size, dev, ino) for each file.
+        """
+        exclude_files = self.exclude is not None and self.exclude.match_files
+        stack = [directory]
+        while stack:
+            if token is not None and token.cancelled:
+                return
+            path = stack.pop()
+            self.dirs_scanned += 1
+            fd = None
+            try:
+                if _DIR_FD_SUPPORTED:
+                    fd = os.open(path, _DIR_OPEN_FLAGS if path == directory else _SUBDIR_OPEN_FLAGS)
+                with os.scandir(fd if fd is not None else path) as entries:
+                    for item in entries:
+                        if item.is_file(follow_symlinks=False):
+                            if exclude_files and self.exclude.excluded_entry(path, item.name, False):
+                                continue
+                            try:
+                                st = item.stat(follow_symlinks=False)
+                            except OSError as e:  # Deleted or unreadable since the listing
+                                self.stats.record_error(os.path.join(path, item.name), e)
+                                continue
+                            self.files_scanned += 1
+                            if st.st_size >= min_size:
+                                yield os.path.join(path, item.name), st.st_size, st.st_dev, st.st_ino
+                        elif item.is_dir(follow_symlinks=False):
+                            if self.exclude is None or not self.exclude.excluded_entry(path, item.name):
+                                stack.append(os.path.join(path, item.name))
+            except (PermissionError, FileNotFoundError, OSError) as e:
+                logging.error(f"Error scanning {path}: {e}")
+            finally:
+                if fd is not None:
+                    os.close(fd)
+
+    def get_folder_info(self, directory, node=None, previous=None, token=None):
+        """Calculates total size and file count of a directory tree.
+
+        Walks with an explicit stack, so deep trees cannot hit the recursion
+        limit, and opens every subdirectory relative to its parent's
+        descriptor (openat style) where the platform allows it, so full paths
+        are not resolved again for each directory and file. Every
+        subdirectory walked is recorded as a child DirNode. When a previous
+        scan of a directory is given and its mtime and inode still match, its
+        listing is not read again: the direct file totals are reused and only
+        the subdirectories are revisited.
+
+        Args:
+            directory (str): Directory path to analyze.
+            node (DirNode): Node to fill in; a detached one is used if omitted.
+            previous (DirNode): Earlier scan of the same directory, if any.
+            token (CancelToken): Cancels the walk, which then returns (0, 0).
+
+        Returns:
+            tuple: (total_size, total_files)
+        """
+        if node is None:
+            node = DirNode(os.path.basename(directory))
+        self._only_dev = None
+        if self.one_filesystem:
+            try:
+                self._only_dev = os.stat(directory).st_dev
+            except OSError:
+                pass  # Reported when the directory is entered
+        frame = self._enter(node, directory, directory, None, previous, _DIR_OPEN_FLAGS, True)
+        if frame is None:
+            return node.size, node.files
+        stack = [frame]
+        while stack:
+            if token is not None and token.cancelled:
+                for frame in stack:
+                    self._leave(frame)
+                return 0, 0
+            frame = stack[-1]
+            parent, path, fd, pending, anchor_fd, rel = frame
+            if pending:
+                name, prev_child = pending.pop()
+                child = DirNode(name)
+                parent.add_child(child)
+                depth = len(stack)
+                keep_fd = depth < MAX_OPEN_DIRS or depth % ANCHOR_INTERVAL == 0
+                if fd is not None:
+                    anchor_fd, rel = fd, name
+                else:
+                    rel = os.path.join(rel, name)
+                child_frame = self._enter(child, rel, os.path.join(path, name), anchor_fd, prev_child,
+                                          _SUBDIR_OPEN_FLAGS, keep_fd)
+                if child_frame is not None:
+                    stack.append(child_frame)
+            else:
+                stack.pop()
+                self._leave(frame)
+                if self.collect_types and parent.children:
+                    parent.types = merge_types([parent.types] + [child.types for child in parent.children])
+                if stack:
+                    stack[-1][0].size += parent.size
+                    stack[-1][0].files += parent.files
+        return node.size, node.files
+
+    def _enter(self, node, name, path, parent_fd, previous, flags, keep_fd):
+        """Opens and lists one directory for get_folder_info.
+
+        Args:
+            node (DirNode): Node to fill in with the direct file totals.
+            name (str): Path relative to parent_fd.
+            path (str): Full path, used when there is no parent descriptor.
+            parent_fd (int): Descriptor of the nearest open ancestor, or None.
+            previous (DirNode): Earlier scan of the directory, if any.
+            flags (int): os.open flags.
+            keep_fd (bool): Keep the descriptor open for the subdirectories.
+
+        Returns:
+            list: [node, path, fd, pending subdirectories, anchor fd, path
+            relative to the anchor] stack frame, or None if the directory
+            could not be opened. Without its own descriptor a frame inherits
+            the anchor of its parent.
+        """
+        fd = None
+        start = time.perf_counter()
+        try:
+            if _DIR_FD_SUPPORTED:
+                self.syscalls += 2  # open, fstat; the close is counted where the descriptor is closed
+                if parent_fd is not None:
+                    fd = os.open(name, flags, dir_fd=parent_fd)
+                else:
+                    fd = os.open(path, flags)
+                st = os.fstat(fd)
+            else:
+                self.syscalls += 1
+                st = os.stat(path, follow_symlinks=False)
+        except (PermissionError, FileNotFoundError, OSError) as e:
+            if fd is not None:
+                os.close(fd)
+            self.stats.record_error(path, e, unreadable=True)
+            return None
+        self.dirs_scanned += 1
+        node.mtime_ns = st.st_mtime_ns
+        node.ino = st.st_ino
+        if self._only_dev is not None and st.st_dev != self._only_dev:
+            self.stats.skipped_mounts += 1
+            if fd is not None:
+                os.close(fd)
+                self.syscalls += 1
+            return None
+        if (previous is not None and previous.mtime_ns == st.st_mtime_ns and previous.ino == st.st_ino
+                and (not self.collect_types or previous.types is not None or not previous.files)):
+            own_size = previous.own_size
+            own_files = previous.own_files
+            node.types = _own_types(previous) if self.collect_types else None
+            pending = [(child.name, child) for child in previous.children or ()]
+            if self.ranking is not None and self.ranking_carry:
+                for entry in self.ranking_carry.get(path, ()):
+                    self.ranking.offer(*entry)
+            self.stats.record_dir(path, time.perf_counter() - start, 0, st.st_dev)
+        else:
+            types = FileTypes() if self.collect_types else None
+            inode_order = device_kind(st.st_dev) == "hdd"
+            own_size, own_files, subdirs, error, ranked = _read_entries(
+                fd if fd is not None else path, self.ranking.limit if self.ranking is not None else 0, types=types,
+                inode_order=inode_order, exclude=self.exclude, path=path)
+            if inode_order:
+                subdirs.reverse()  # Subdirectories are taken from the end, so lowest inode first
+            node.types = types.pack() if types is not None else None
+            self.stats.record_dir(path, time.perf_counter() - start, own_files + len(subdirs), st.st_dev)
+            if error is not None:
+                self.stats.record_error(path, error)
+            if ranked:
+                self.ranking.merge(ranked, path)
+            self.syscalls += LISTING_SYSCALLS + own_files
+            self.files_scanned += own_files
+            prev_children = {}
+            if previous is not None and previous.children:
+                prev_children = {child.name: child for child in previous.children}
+            pending = [(subdir, prev_children.get(subdir)) for subdir in subdirs]
+        node.own_size = own_size
+        node.own_files = own_files
+        node.size = own_size
+        node.files = own_files
+        if fd is not None and (not keep_fd or not pending):
+            os.close(fd)
+            self.syscalls += 1
+            fd = None
+            return [node, path, None, pending, parent_fd, name]
+        return [node, path, fd, pending, fd, ""]
+
+    def _leave(self, frame):
+        """Closes a stack frame's directory descriptor, if still open."""
+        if frame[2] is not None:
+            os.close(frame[2])
+            self.syscalls += 1
+            frame[2] = None
+
+
+Listing = namedtuple("Listing",
+                     "mtime_ns ino own_size own_files subdirs syscalls ranking files error seconds dev types")
+
+
+def list_directory(path, prev_mtime_ns=None, prev_ino=None, follow_symlinks=False, rank_limit=0,
+                   collect_files=False, token=None, collect_types=False, only_dev=None, inode_order=False,
+                   exclude=None):
+    """Reads a single directory without recursing into it.
+
+    This is the unit of work of ParallelWalker. It is a module-level function
+    so the process-pool backend can pickle it. Workers share no descriptors,
+    so the directory is opened by its full path; only its files are stat()ed
+    relative to its descriptor.
+
+    Args:
+        path (str): Directory path.
+        prev_mtime_ns (int): mtime recorded by a previous scan, if any.
+        prev_ino (int): Inode recorded by a previous scan, if any.
+        follow_symlinks (bool): Allow path itself to be a symlink, as a scan
+            root may be. Subdirectories never are.
+        rank_limit (int): Rank this many largest and oldest files.
+        collect_files (bool): Return the name, size and mtime of every file.
+        token (CancelToken): Cuts a huge listing short once cancelled, with a
+            ListingCancelled error; only passed to thread workers, as it
+            cannot be pickled.
+        collect_types (bool): Tally the files by extension and age.
+        only_dev (int): Leave the directory unread, as if empty, when it is
+            on another device (a mount point), to stay on one filesystem.
+        inode_order (bool): Read the entries in inode order; see _read_entries.
+        exclude (ExcludeRules): Leave out the subdirectories and files it
+            excludes; excluded subdirectories are never listed.
+
+    Returns:
+        Listing: subdirs lists the subdirectory names, or is None when mtime
+        and inode match the previous scan and the listing was not read.
+        ranking is a FileRanking of file names, or None. files lists
+        (name, size, mtime) tuples when collected, else it is None. error is
+        the first OSError met, or a ListingCancelled when the listing was cut
+        short; mtime_ns is None when the directory could not
+        be opened at all. seconds is the time spent on the directory. types
+        is a FileTypes tally when collected and the listing was read.
+    """
+    start = time.perf_counter()
+    fd = None
+    try:
+        if _DIR_FD_SUPPORTED:
+            fd = os.open(path, _DIR_OPEN_FLAGS if follow_symlinks else _SUBDIR_OPEN_FLAGS)
+            st = os.fstat(fd)
+            syscalls = DESCRIPTOR_SYSCALLS
+        else:
+            st = os.stat(path, follow_symlinks=follow_symlinks)
+            syscalls = 1
+    except (PermissionError, FileNotFoundError, OSError) as e:
+        if fd is not None:
+            os.close(fd)
+        return Listing(None, None, 0, 0, [], 1, None, None, e, time.perf_counter() - start, None, None)
+    try:
+        if only_dev is not None and st.st_dev != only_dev:
+            return Listing(st.st_mtime_ns, st.st_ino, 0, 0, [], syscalls, None, [] if collect_files else None, None,
+                           time.perf_counter() - start, st.st_dev, None)
+        if prev_mtime_ns is not None and st.st_mtime_ns == prev_mtime_ns and st.st_ino == prev_ino:
+            return Listing(st.st_mtime_ns, st.st_ino, 0, 0, None, syscalls, None, None, None,
+                           time.perf_counter() - start, st.st_dev, None)
+        files = [] if collect_files else None
+        types = FileTypes() if collect_types else None
+        own_size, own_files, subdirs, error, ranking = _read_entries(fd if fd is not None else path, rank_limit,
+                                                                     files, token, types, inode_order, exclude, path)
+        syscalls += LISTING_SYSCALLS + own_files
+        return Listing(st.st_mtime_ns, st.st_ino, own_size, own_files, subdirs, syscalls, ranking, files, error,
+                       time.perf_counter() - start, st.st_dev, types)
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def _list_directory_batch(tasks):
+    """Runs list_directory over a batch of argument tuples."""
+    return [list_directory(*task) for task in tasks]
+
+
+class WalkTop(namedtuple("WalkTop", "node path previous parent_dev")):
+    """One subtree for ParallelWalker.walk: the node to fill in, the path of
+    its directory, an earlier scan of that directory with the same exclude
+    rules or None, and the device of its parent directory, or None for a
+    root read whatever its device."""
+
+    __slots__ = ()
+
+
+class ParallelWalker:
+    """Scans trees by splitting the work at every directory level.
+
+    Every directory found is pushed onto one shared stack and listed by
+    whichever worker is free, so a single huge top-level folder is spread
+    across all workers instead of pinning one. Totals are rolled up as
+    subtrees finish. The process backend sidesteps the GIL on stat-heavy
+    trees at the cost of pickling listings back to the coordinator. With
+    collect_types, every node also gets the extension and age breakdown of
+    its subtree, tallied from the same stat calls.
+
+    Work is queued per device (st_dev), and each device has its own limit
+    of listings in flight: by default DEVICE_CONCURRENCY for its kind, else
+    twice the worker count. device_limits overrides them, keyed by kind or
+    by device number. The thread pool grows to the largest limit of the
+    tops' devices, so a network mount can keep more requests outstanding
+    than there are CPUs. On rotational disks entries are read in inode
+    order. With one_filesystem, directories on another device than their
+    parent are left unread, as if empty. Subdirectories and files excluded
+    by the ExcludeRules exclude are skipped while listing their parent, so
+    excluded subtrees are never opened.
+    """
+
+    BACKENDS = ("thread", "process")
+
+    def __init__(self, scanner, workers=None, backend="thread", batch_size=None, rank_limit=0, collect_types=False,
+                 one_filesystem=False, device_limits=None, exclude=None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown scan backend: {backend}")
+        self.scanner = scanner
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.backend = backend
+        # Batching amortises the per-task IPC cost of the process pool
+        self.batch_size = batch_size or (1 if backend == "thread" else 32)
+        self.rank_limit = rank_limit
+        self.collect_types = collect_types
+        self.one_filesystem = one_filesystem
+        self.device_limits = dict(device_limits or {})
+        self.exclude = exclude
+        self.rankings = {}  # id(top node) -> FileRanking of its subtree
+
+    def device_limit(self, dev):
+        """Returns how many listings of a device may be in flight at once."""
+        if dev in self.device_limits:
+            return self.device_limits[dev]
+        kind = device_kind(dev) if dev is not None else "unknown"
+        limit = self.device_limits.get(kind, DEVICE_CONCURRENCY[kind])
+        return limit or self.workers * 2
+
+    def walk(self, tops, on_complete=None, on_dir=None, retain=True, carry=None, names=None, previous_names=None,
+             token=None, resume=None, on_checkpoint=None, checkpoint_interval=CHECKPOINT_INTERVAL, lock=None):
+        """Scans several subtrees with one shared pool of workers.
+
+        Args:
+            tops (list): WalkTop records; each node is filled in with its
+                whole subtree. With one_filesystem, a top on another device
+                than its parent_dev is left unread. Tops may be on different
+                devices; each device's directories are queued separately.
+            on_complete (callable): Called with each top node as soon as its
+                subtree is complete.
+            on_dir (callable): Called with every directory node as soon as
+                its subtree is complete, children before parents.
+            retain (bool): Keep the finished subtrees. With False each node
+                drops its children once it is complete, so memory is bounded
+                by the directories still in progress rather than the tree.
+            carry (dict): On a refresh, directory path -> previously ranked
+                (path, size, mtime) files, re-offered for reused listings.
+            names (NameIndex): Filled with the name of every directory and
+                file found below the tops.
+            previous_names (NameIndex): On a refresh, the index whose file
+                names are carried over for reused listings.
+            token (CancelToken): Stops the walk within a fraction of a second;
+                the nodes are then left incomplete. Listings that finish after
+                the cancel are dropped, as they may have been cut short, so
+                only subtrees whose every listing completed are finished and
+                checkpointed.
+            resume (dict): Directory path -> complete subtree saved by an
+                interrupted scan; such directories are grafted, not listed,
+                if their mtime and inode still match the saved ones.
+            on_checkpoint (callable): Called every checkpoint_interval
+                seconds, and once more if the walk is cancelled or fails, with
+                the (path, node) subtrees completed since the last call. Needs
+                retain=True.
+            checkpoint_interval (float): Seconds between checkpoints.
+            lock (RLock): Held while reading the earlier scans of the tops,
+                such as a ScanIndex's lock when another thread may change
+                them.
+        """
+        self._top_ids = {id(top.node) for top in tops}
+        self._top_paths = {id(top.node): top.path for top in tops}
+        self._pending = {}  # Node -> number of unfinished children
+        # Subtrees completed since the last checkpoint, tracked only when checkpointing
+        self._completed = [] if on_checkpoint is not None else None
+        self._on_complete = on_complete
+        self._on_dir = on_dir
+        self._retain = retain
+        self._carry = carry or {}
+        self._names = names
+        self._previous_names = previous_names
+        lock = lock or nullcontext()
+        self._queues = {}  # Device -> stack of directories to list
+        for node, path, prev, parent_dev in reversed(tops):
+            ranking = None
+            if self.rank_limit:
+                ranking = self.rankings[id(node)] = FileRanking(self.rank_limit)
+            try:
+                dev = os.stat(path).st_dev
+            except OSError:
+                dev = None  # Reported when the directory is listed
+            if parent_dev is None:
+                parent_dev = dev
+            self._queues.setdefault(dev, []).append((node, path, prev, ranking, parent_dev))
+        busy = {dev: 0 for dev in self._queues}  # Device -> batches in flight
+        pool_size = self.workers
+        if self.backend == "thread":
+            pool_size = max([pool_size] + [self.device_limit(dev) for dev in self._queues])
+        in_flight = {}
+        pool = ThreadPoolExecutor if self.backend == "thread" else ProcessPoolExecutor
+        executor = pool(max_workers=pool_size)
+        # Thread workers share the token; process workers cannot unpickle it
+        worker_token = token if self.backend == "thread" else None
+        next_checkpoint = time.monotonic() + checkpoint_interval
+        complete = False
+        try:
+            while in_flight or any(self._queues.values()):
+                if token is not None and token.cancelled:
+                    return
+                for dev, stack in self._queues.items():
+                    limit = self.device_limit(dev)
+                    while stack and busy.get(dev, 0) < limit and len(in_flight) < pool_size * 2:
+                        batch = []
+                        while stack and len(batch) < self.batch_size:
+                            item = stack.pop()
+                            saved = resume.pop(item[1], None) if resume else None
+                            if saved is not None and self._unchanged(item[1], saved):
+                                self._graft(item[0], saved)
+                            else:
+                                batch.append(item)
+                        if not batch:
+                            continue
+                        inode_order = device_kind(dev) == "hdd" if dev is not None else False
+                        with lock:
+                            tasks = [(path, prev.mtime_ns if self._reusable(prev) else None,
+                                      prev.ino if prev is not None else None, id(node) in self._top_ids,
+                                      self.rank_limit, names is not None, worker_token, self.collect_types,
+                                      parent_dev if self.one_filesystem else None, inode_order, self.exclude)
+                                     for node, path, prev, _, parent_dev in batch]
+                        in_flight[executor.submit(_list_directory_batch, tasks)] = (dev, batch)
+                        busy[dev] = busy.get(dev, 0) + 1
+                if not in_flight:
+                    continue
+                # Time out now and then so a cancel is noticed during slow listings
+                done, _ = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+                if token is not None and token.cancelled:
+                    return  # Listings done meanwhile may have been cut short
+                for future in done:
+                    dev, batch = in_flight.pop(future)
+                    busy[dev] -= 1
+                    with lock:  # Reused listings take the earlier scans' totals and children
+                        for item, listing in zip(batch, future.result()):
+                            self._apply(item, listing)
+                if on_checkpoint is not None and time.monotonic() >= next_checkpoint:
+                    self._checkpoint(on_checkpoint)
+                    next_checkpoint = time.monotonic() + checkpoint_interval
+            complete = True
+        finally:
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=False)
+            if on_checkpoint is not None and not complete:
+                try:
+                    self._checkpoint(on_checkpoint)
+                except Exception as e:
+                    logging.error(f"Error saving scan checkpoint: {e}")
+            self._pending = None
+            self._completed = None
+            self._queues = None
+
+    def _reusable(self, previous):
+        """Returns True if the listing of a previously scanned directory may be reused.
+
+        Trees cached without file types are read again when collecting them.
+        """
+        if previous is None:
+            return False
+        return not self.collect_types or previous.types is not None or not previous.files
+
+    @staticmethod
+    def _unchanged(path, saved):
+        """Returns True if the directory at path still has the mtime and inode of a saved subtree."""
+        try:
+            st = os.stat(path, follow_symlinks=False)
+        except OSError:
+            return False  # Listed instead, which reports the error
+        return st.st_mtime_ns == saved.mtime_ns and st.st_ino == saved.ino
+
+    def _graft(self, node, saved):
+        """Fills node from a subtree saved by an interrupted scan and completes it."""
+        node.mtime_ns = saved.mtime_ns
+        node.ino = saved.ino
+        node.types = saved.types
+        node.own_size = saved.own_size
+        node.own_files = saved.own_files
+        node.size = saved.size
+        node.files = saved.files
+        node.reset_children(saved.children)
+        for child in node.children or ():
+            child.parent = node
+        if self._names is not None:
+            self._names.add_tree(node)
+        self._finish(node, saved=True)
+
+    def _checkpoint(self, on_checkpoint):
+        """Hands the subtrees completed since the last checkpoint to on_checkpoint.
+
+        A subtree whose parent has completed since is covered by the parent
+        (or a further ancestor) and is skipped.
+        """
+        subtrees = [(self._path_of(node), node) for node in self._completed
+                    if id(node) in self._top_ids or node.parent in self._pending]
+        self._completed = []
+        if subtrees:
+            on_checkpoint(subtrees)
+
+    def _path_of(self, node):
+        """Returns the full path of a node below one of the walk's tops."""
+        parts = []
+        while id(node) not in self._top_paths:
+            parts.append(node.name)
+            node = node.parent
+        parts.reverse()
+        return os.path.join(self._top_paths[id(node)], *parts)
+
+    def _apply(self, item, listing):
+        """Records one directory listing and queues its subdirectories on its device.
+
+        A listing cut short by a cancel is dropped, leaving the node and its
+        ancestors incomplete.
+        """
+        if isinstance(listing.error, ListingCancelled):
+            return
+        node, path, previous, ranking, parent_dev = item
+        mtime_ns, ino, own_size, own_files, subdirs, syscalls, ranked, files = listing[:8]
+        self.scanner.dirs_scanned += 1
+        self.scanner.syscalls += syscalls
+        stats = self.scanner.stats
+        if listing.error is not None:
+            stats.record_error(path, listing.error, unreadable=mtime_ns is None)
+        if self.one_filesystem and mtime_ns is not None and listing.dev != parent_dev:
+            stats.skipped_mounts += 1
+        elif mtime_ns is not None:
+            stats.record_dir(path, listing.seconds, own_files + len(subdirs or ()), listing.dev)
+        node.mtime_ns = mtime_ns
+        node.ino = ino
+        if subdirs is None:
+            node.own_size = previous.own_size
+            node.own_files = previous.own_files
+            node.types = _own_types(previous) if self.collect_types else None
+            children = [(child.name, child) for child in previous.children or ()]
+            if ranking is not None:
+                for entry in self._carry.get(path, ()):
+                    ranking.offer(*entry)
+            if self._names is not None:
+                self._names.carry_files(node, self._previous_names, previous)
+        else:
+            node.own_size = own_size
+            node.own_files = own_files
+            node.types = listing.types.pack() if listing.types is not None else None
+            self.scanner.files_scanned += own_files
+            if ranked:
+                ranking.merge(ranked, path)
+            if self._names is not None:
+                self._names.add_files(node, files)
+            prev_children = {}
+            if previous is not None and previous.children:
+                prev_children = {child.name: child for child in previous.children}
+            children = [(name, prev_children.get(name)) for name in subdirs]
+        node.size = node.own_size
+        node.files = node.own_files
+        if not children:
+            self._finish(node)
+            return
+        self._pending[node] = len(children)
+        stack = self._queues.setdefault(listing.dev, [])
+        if subdirs is not None and device_kind(listing.dev) == "hdd":
+            children.reverse()  # Listed in inode order; the stack is taken from the end
+        for name, prev_child in children:
+            child = DirNode(name)
+            node.add_child(child)
+            if self._names is not None:
+                self._names.add_dir(child)
+            stack.append((child, os.path.join(path, name), prev_child, ranking, listing.dev))
+
+    def _finish(self, node, saved=False):
+        """Rolls a completed node into its parent, completing ancestors in turn.
+
+        Children add their totals to the parent as they finish, so a parent
+        is complete as soon as its last child is; its file types, which hold
+        its own files until then, take in its children's at that point. The
+        highest node completed is remembered for the next checkpoint, unless
+        it was grafted from one (saved).
+        """
+        pending = self._pending
+        while True:
+            if self._on_dir:
+                self._on_dir(node)
+            if not self._retain:
+                node.reset_children(None)
+            if id(node) in self._top_ids:
+                if not saved and self._completed is not None:
+                    self._completed.append(node)
+                if self._on_complete:
+                    self._on_complete(node)
+                return
+            parent = node.parent
+            parent.size += node.size
+            parent.files += node.files
+            pending[parent] -= 1
+            if pending[parent]:
+                if not saved and self._completed is not None:
+                    self._completed.append(node)
+                return
+            del pending[parent]
+            if self.collect_types:
+                parent.types = merge_types([parent.types] + [child.types for child in parent.children])
+            node = parent
+            saved = False
+
+
+class ScanJob(threading.Thread):
+    """Runs one directory scan off the GUI thread.
+
+    Progress is reported through ``events`` as tuples, with top-level folders
+    reported in the order they finish rather than the order they were listed:
+
+    - ("resumed", count) first, when resuming from count checkpointed subtrees
+    - ("entries", [(name, cached_node_or_None), ...]) once the root is listed
+    - ("estimate", name, SizeEstimate) for each folder still to scan, when
+      estimating, before any exact totals
+    - ("dir", name, node) whenever a top-level folder is complete
+    - ("done", root_node), ("cancelled", None) or ("error", message) at the end
+
+    After "done", ``rankings`` holds the largest and oldest files of the
+    whole tree (key None) and of each top-level folder (key: its name), and
+    ``names`` indexes every directory and file name of the tree, and every
+    node carries the extension and age breakdown of its subtree. The
+    scanner's ``stats`` instrument the scan throughout and are written to
+    stats_path as JSON when the scan ends, if given.
+
+    one_filesystem and device_limits are passed on to ParallelWalker, and so
+    are the scanner's exclude rules. Indexed trees and checkpoints are only
+    reused if they were scanned with the same rules (``fingerprint``); a
+    refresh of a tree scanned with other rules reads everything again.
+
+    With estimate, the folders still to scan are first sized by a
+    SizeEstimator, in parallel, and then scanned exactly largest estimate
+    first, so the folders that matter are reported soonest. A refresh
+    orders them by their previous totals instead.
+
+    With a ScanCache as store, completed subtrees are checkpointed every
+    checkpoint_interval seconds and when the scan is cancelled or fails, and a
+    later scan of the same path resumes from them, unless it is a refresh of
+    a cached tree. A subtree is only resumed if its top directory still has
+    the saved mtime and inode, and checkpoints older than CHECKPOINT_MAX_AGE
+    are discarded, since changes deeper down go unnoticed.
+    Resumed subtrees keep their totals, but their files are missing from the
+    file rankings and the name index until they are scanned again.
+    """
+
+    def __init__(self, scanner, path, index=None, refresh=False, max_workers=None, backend="thread",
+                 rank_limit=DEFAULT_TOP_FILES, stats_path=None, store=None,
+                 checkpoint_interval=CHECKPOINT_INTERVAL, one_filesystem=False, device_limits=None, estimate=False):
+        super().__init__(daemon=True)
+        self.scanner = scanner
+        self.stats_path = stats_path
+        self.store = store
+        self.checkpoint_interval = checkpoint_interval
+        self.token = CancelToken()
+        self.resumed = 0
+        self.path = os.path.normpath(path)
+        self.index = index
+        self.refresh = refresh
+        self.rank_limit = rank_limit
+        self.estimate = estimate
+        self.fingerprint = rules_fingerprint(scanner.exclude)
+        self.walker = ParallelWalker(scanner, workers=max_workers, backend=backend, rank_limit=rank_limit,
+                                     collect_types=True, one_filesystem=one_filesystem, device_limits=device_limits,
+                                     exclude=scanner.exclude)
+        self.events = queue.Queue()
+        self.rankings = {}
+        self.names = NameIndex()
+        self.start_time = None
+
+    def cancel(self):
+        """Asks the scan to stop; a "cancelled" event follows."""
+        self.token.cancel()
+
+    def run(self):
+        self.start_time = time.time()
+        self.scanner.dirs_scanned = 0
+        self.scanner.files_scanned = 0
+        self.scanner.syscalls = 0
+        stats = self.scanner.stats
+        stats.reset(self.path)
+        try:
+            root = self._scan()
+        except PermissionError:
+            logging.error(f"Permission denied: {self.path}")
+            self.events.put(("error", "Permission denied to access some folders"))
+            return
+        except Exception as e:
+            logging.error(f"Error in scan_directory: {e}")
+            self.events.put(("error", f"An error occurred: {e}"))
+            return
+        stats.finish(root.size)
+        if self.stats_path:
+            try:
+                stats.dump(self.stats_path)
+            except OSError as e:
+                logging.error(f"Error writing scan stats to {self.stats_path}: {e}")
+        if self.token.cancelled:
+            self.events.put(("cancelled", None))
+            return
+        if self.store is not None:
+            try:
+                self.store.clear_checkpoints(self.path)
+            except sqlite3.Error as e:
+                logging.error(f"Error clearing scan checkpoint of {self.path}: {e}")
+        self.events.put(("done", root))
+
+    def _scan(self):
+        """Lists the root, then scans all of its subfolders with one parallel walk.
+
+        Returns:
+            DirNode: Root node of the scanned tree.
+        """
+        root = DirNode(self.path)
+        # The indexed trees may change on their owner's thread, so they are read under the index's lock
+        lock = self.index.lock if self.index is not None else nullcontext()
+        with lock:
+            # Listings read under other exclusion rules count other files, so they are never reused
+            index = self.index if self.index and self.index.fingerprint(self.path) == self.fingerprint else None
+            previous = index.lookup(self.path) if self.refresh and index else None
+        resume = None
+        if self.store is not None:
+            try:
+                if previous is not None:
+                    # A refresh revalidates the cached tree; an older checkpoint would only mix in stale totals
+                    self.store.clear_checkpoints(self.path)
+                else:
+                    resume = self.store.load_checkpoints(self.path, self.fingerprint)
+            except sqlite3.Error as e:
+                logging.error(f"Error loading scan checkpoint of {self.path}: {e}")
+            if resume:
+                self.resumed = len(resume)
+                self.events.put(("resumed", self.resumed))
+        st = os.stat(self.path)
+        root.mtime_ns = st.st_mtime_ns
+        root.ino = st.st_ino
+        files = []
+        types = FileTypes()
+        start = time.perf_counter()
+        root.own_size, root.own_files, names, error, ranked = _read_entries(
+            self.path, self.rank_limit, files, types=types, inode_order=device_kind(st.st_dev) == "hdd",
+            exclude=self.scanner.exclude)
+        if error is not None:
+            self.scanner.stats.record_error(self.path, error, unreadable=not names and not root.own_files)
+            if not names and not root.own_files:
+                raise error
+        self.scanner.stats.record_dir(self.path, time.perf_counter() - start, root.own_files + len(names), st.st_dev)
+        self.names.add_files(root, files)
+        overall = FileRanking(self.rank_limit)
+        if ranked:
+            overall.merge(ranked, self.path)
+        self.scanner.files_scanned += root.own_files
+        self.scanner.syscalls += 1 + LISTING_SYSCALLS + root.own_files
+        subdirs = []
+        reused = []
+        tops = []
+        previous_names = carry = None
+        with lock:
+            for name in names:
+                child_path = os.path.join(self.path, name)
+                cached = index.lookup(child_path) if index and not self.refresh else None
+                subdirs.append((name, child_path, cached))
+            for name, child_path, cached in subdirs:
+                if cached is not None:
+                    reused.append((name, child_path, cached))
+                else:
+                    prev_child = previous.child(name) if previous is not None else None
+                    top = DirNode(name)
+                    self.names.add_dir(top)
+                    tops.append(WalkTop(top, child_path, prev_child, st.st_dev))
+            if previous is not None:
+                tops.sort(key=lambda top: top.previous.size if top.previous is not None else 0, reverse=True)
+                previous_names = self.index.name_index(self.path)[0]
+                carry = self._ranking_carry()
+        self.events.put(("entries", [(name, cached) for name, _, cached in subdirs]))
+        if previous is None and self.estimate and tops:
+            estimates = self._estimate(tops, st.st_dev if self.walker.one_filesystem else None)
+            tops.sort(key=lambda top: estimates.get(id(top.node), 0), reverse=True)
+
+        def report(child):
+            root.add_child(child)
+            if self.rank_limit:
+                self.rankings[child.name] = self.walker.rankings[id(child)]
+            self.events.put(("dir", child.name, child))
+
+        self.walker.walk(tops, report, carry=carry, names=self.names, previous_names=previous_names,
+                         token=self.token, resume=resume,
+                         on_checkpoint=self._checkpoint if self.store is not None else None,
+                         checkpoint_interval=self.checkpoint_interval,
+                         lock=self.index.lock if previous is not None else None)
+
+        # Graft already indexed subtrees under their plain names. Their names
+        # are copied unless the scan is itself grafted into the tree that
+        # already indexes them.
+        with lock:
+            root_path = self.index.containing_root(self.path) if reused else None
+            graft_names = self.index.names.get(root_path) if root_path not in (None, self.path) else None
+            for name, child_path, cached in reused:
+                if self.rank_limit:
+                    ranking = self.index.file_ranking(child_path)[0]
+                    if ranking is not None:
+                        self.rankings[name] = ranking
+                cached_names = self.index.name_index(child_path)[0]
+                cached.name = sys.intern(name)
+                root.add_child(cached)
+                if cached_names is not graft_names:
+                    self.names.add_dir(cached)
+                    self.names.add_tree(cached, cached_names)
+        for ranking in self.rankings.values():
+            overall.merge(ranking)
+        if self.rank_limit:
+            self.rankings[None] = overall
+        root.size = root.own_size
+        root.files = root.own_files
+        for child in root.children or ():
+            root.size += child.size
+            root.files += child.files
+        root.types = merge_types([types.pack()] + [child.types for child in root.children or ()])
+        return root
+
+    def _estimate(self, tops, only_dev):
+        """Estimates the tops in parallel, reporting each in an "estimate" event.
+
+        Returns:
+            dict: id(top node) -> estimated size.
+        """
+        estimator = SizeEstimator(only_dev=only_dev, exclude=self.scanner.exclude)
+        sizes = {}
+        with ThreadPoolExecutor(max_workers=self.walker.workers) as executor:
+            futures = {executor.submit(estimator.estimate, top.path, self.token): top.node for top in tops}
+            for future in as_completed(futures):
+                node = futures[future]
+                estimate = future.result()
+                if estimate is not None:
+                    sizes[id(node)] = estimate.size
+                    self.events.put(("estimate", node.name, estimate))
+        self.scanner.dirs_scanned += estimator.dirs_read
+        return sizes
+
+    def _checkpoint(self, subtrees):
+        """Saves completed subtrees so an interrupted scan can resume from them."""
+        try:
+            self.store.save_checkpoint(self.path, subtrees, self.fingerprint)
+        except sqlite3.Error as e:
+            logging.error(f"Error saving scan checkpoint of {self.path}: {e}")
+
+    def _ranking_carry(self):
+        """Groups the previously ranked files below the scan path by directory."""
+        ranked = {}
+        if self.rank_limit and self.index is not None:
+            root_path = self.index.containing_root(self.path)
+            for ranking in self.index.rankings.get(root_path, {}).values():
+                for entry in ranking.entries():
+                    if _relative_parts(entry[0], self.path) is not None:
+                        ranked[entry[0]] = entry
+        carry = {}
+        for entry in ranked.values():
+            carry.setdefault(os.path.dirname(entry[0]), []).append(entry)
+        return carry
+
+
+def _mtime_seconds(node):
+    """Returns the mtime of a node in seconds, or None if unknown."""
+    return node.mtime_ns / 1e9 if node.mtime_ns is not None else None
+
+
+def iter_tree(node, path=None):
+    """Yields every directory of an indexed tree, parents first.
+
+    The walk keeps one child iterator per level, so memory grows with the
+    depth of the tree, not its size.
+
+    Args:
+        node (DirNode): Top of the tree.
+        path (str): Full path of node; defaults to its name, which is the
+            full path for scan roots.
+
+    Yields:
+        tuple: (path, depth, size, files, mtime), depth 0 for node itself and
+        mtime in seconds or None.
+    """
+    path = path or node.name
+    yield path, 0, node.size, node.files, _mtime_seconds(node)
+    stack = [(path, iter(node.children or ()))]
+    while stack:
+        parent_path, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            continue
+        child_path = os.path.join(parent_path, child.name)
+        yield child_path, len(stack), child.size, child.files, _mtime_seconds(child)
+        if child.children:
+            stack.append((child_path, iter(child.children)))
+
+
+# Write buffer of export files
+EXPORT_BUFFER = 1 << 20
+
+
+def open_export(path, compress=None):
+    """Opens a text file to export records to.
+
+    Args:
+        path (str): File to create.
+        compress (bool): gzip the output; by default only for paths ending in .gz.
+
+    Returns:
+        file: Buffered text stream.
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+    if compress:
+        return gzip.open(path, "wt", compresslevel=6, encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="", buffering=EXPORT_BUFFER)
+
+
+def export_tree(node, dest, fmt="csv", path=None, compress=None, ranking=None, token=None, on_progress=None):
+    """Writes every directory below node to a file, one record per directory.
+
+    Records stream from iter_tree through a buffered writer, so memory stays
+    constant however large the tree is. Output goes to dest + ".part" first
+    and is renamed when complete, so a cancelled or failed export never
+    leaves a truncated file behind.
+
+    Args:
+        node (DirNode): Top of the tree to export.
+        dest (str): File to write.
+        fmt (str): One of _RecordWriter.FORMATS, e.g. "csv" or "jsonl".
+        path (str): Full path of node, as for iter_tree.
+        compress (bool): gzip the output; by default only if dest ends in .gz.
+        ranking (FileRanking): Largest and oldest files appended after the
+            directories.
+        token (CancelToken): Stops the export.
+        on_progress (callable): Called with the record count every 10,000 records.
+
+    Returns:
+        int: Records written, or None if the export was cancelled.
+    """
+    def write(stream):
+        writer = _RecordWriter(stream, fmt, flush_interval=None)
+        for record in iter_tree(node, path):
+            writer.write(*record)
+            if not writer.count % 10000:
+                if token is not None and token.cancelled:
+                    return None
+                if on_progress is not None:
+                    on_progress(writer.count)
+        if ranking:
+            writer.write_files("largest", ranking.largest_files())
+            writer.write_files("oldest", ranking.oldest_files())
+        writer.close()
+        return writer.count
+
+    return _write_export(dest, compress, write, token)
+
+
+def _write_export(dest, compress, write, token=None):
+    """Runs write(stream) on dest + ".part" and renames it to dest when complete.
+
+    Returns:
+        The result of write, or None if it returned None or token was
+        cancelled, in which case the partial file is removed.
+    """
+    part = dest + ".part"
+    try:
+        with open_export(part, dest.endswith(".gz") if compress is None else compress) as stream:
+            result = write(stream)
+        if result is None or (token is not None and token.cancelled):
+            os.remove(part)
+            return None
+        os.replace(part, dest)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    return result
+
+
+class SnapshotChange(namedtuple("SnapshotChange", "path status old_size new_size old_files new_files")):
+    """A directory that was added, removed or resized between two snapshots."""
+
+    STATUSES = ("added", "removed", "resized")
+
+    @property
+    def delta(self):
+        """Bytes the directory grew by; negative if it shrank."""
+        return self.new_size - self.old_size
+
+
+# Changes kept by rank_changes
+DEFAULT_TOP_CHANGES = 1000
+
+
+def tree_rows(node):
+    """Yields the (key, size, files) rows of an indexed tree in snapshot key order.
+
+    This is the order of ScanCache.snapshot_rows, so a tree in memory can be
+    diffed against a saved snapshot without saving it first. Each level's
+    children are sorted when the walk reaches them, so memory grows with the
+    depth of the tree, not its size.
+    """
+    yield b"", node.size, node.files
+    stack = [(b"", iter(_sorted_children(node)))]
+    while stack:
+        parent_key, children = stack[-1]
+        entry = next(children, None)
+        if entry is None:
+            stack.pop()
+            continue
+        name, child = entry
+        key = parent_key + b"\0" + name if parent_key else name
+        yield key, child.size, child.files
+        if child.children:
+            stack.append((key, iter(_sorted_children(child))))
+
+
+def _sorted_children(node):
+    """Returns (encoded name, child) pairs of a node sorted by encoded name."""
+    return sorted(((os.fsencode(child.name), child) for child in node.children or ()),
+                  key=lambda entry: entry[0])
+
+
+def diff_snapshots(old_rows, new_rows, root):
+    """Yields the directories that differ between two snapshots of root.
+
+    Both inputs are (key, size, files) rows in key order, as read by
+    ScanCache.snapshot_rows or tree_rows. They are merged in one pass that
+    holds a single row of each, so memory stays constant however large the
+    trees are. A directory added or removed with its whole subtree is
+    reported once, at its top.
+
+    Args:
+        old_rows (iterable): Rows of the earlier snapshot.
+        new_rows (iterable): Rows of the later snapshot.
+        root (str): Root path of both snapshots.
+
+    Yields:
+        SnapshotChange: Changed directories in key order.
+    """
+    old_rows = iter(old_rows)
+    new_rows = iter(new_rows)
+    old = next(old_rows, None)
+    new = next(new_rows, None)
+    # Key prefix of the subtree below the last reported removal or addition
+    removed_below = added_below = None
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            key, size, files = old
+            if removed_below is None or not key.startswith(removed_below):
+                removed_below = key + b"\0"
+                yield SnapshotChange(_key_path(root, key), "removed", size, 0, files, 0)
+            old = next(old_rows, None)
+        elif old is None or new[0] < old[0]:
+            key, size, files = new
+            if added_below is None or not key.startswith(added_below):
+                added_below = key + b"\0"
+                yield SnapshotChange(_key_path(root, key), "added", 0, size, 0, files)
+            new = next(new_rows, None)
+        else:
+            if old[1] != new[1] or old[2] != new[2]:
+                yield SnapshotChange(_key_path(root, old[0]), "resized", old[1], new[1], old[2], new[2])
+            old = next(old_rows, None)
+            new = next(new_rows, None)
+
+
+def rank_changes(changes, limit=DEFAULT_TOP_CHANGES):
+    """Keeps the changes with the largest byte deltas, however many there are.
+
+    Args:
+        changes (iterable): SnapshotChange records, e.g. from diff_snapshots.
+        limit (int): Number of changes to keep.
+
+    Returns:
+        tuple: (changes ordered by absolute delta, largest first,
+        {status: count} over all changes).
+    """
+    counts = dict.fromkeys(SnapshotChange.STATUSES, 0)
+    ranked = heapq.nlargest(limit, _count_changes(changes, counts), key=lambda change: abs(change.delta))
+    return ranked, counts
+
+
+def _count_changes(changes, counts):
+    """Passes changes through, counting them by status into counts."""
+    for change in changes:
+        counts[change.status] += 1
+        yield change
+
+
+def write_changes(stream, changes, fmt="csv", token=None, on_progress=None):
+    """Writes snapshot changes to a stream, one record per directory.
+
+    Args:
+        stream (file): Text stream.
+        changes (iterable): SnapshotChange records.
+        fmt (str): One of _RecordWriter.FORMATS.
+        token (CancelToken): Stops writing.
+        on_progress (callable): Called with the record count every 10,000 records.
+
+    Returns:
+        int: Records written, or None if cancelled.
+    """
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(["path", "status", "old_size", "new_size", "delta", "old_files", "new_files"])
+    elif fmt == "json":
+        stream.write("[")
+    for change in changes:
+        if fmt == "csv":
+            writer.writerow([change.path, change.status, change.old_size, change.new_size, change.delta,
+                             change.old_files, change.new_files])
+        elif fmt == "text":
+            sign = "-" if change.delta < 0 else "+"
+            stream.write(f"{sign}{format_size(abs(change.delta)):>11}  {change.status:<8}  {change.path}\n")
+        else:
+            record = json.dumps(dict(change._asdict(), delta=change.delta))
+            if fmt == "json":
+                stream.write(("\n" if not count else ",\n") + record)
+            else:
+                stream.write(record + "\n")
+        count += 1
+        if not count % 10000:
+            if token is not None and token.cancelled:
+                return None
+            if on_progress is not None:
+                on_progress(count)
+    if fmt == "json":
+        stream.write("\n]\n")
+    return count
+
+
+def export_changes(changes, dest, fmt="csv", compress=None, token=None, on_progress=None):
+    """Writes snapshot changes to a file through a .part file, like export_tree.
+
+    Returns:
+        int: Records written, or None if the export was cancelled.
+    """
+    return _write_export(dest, compress, lambda stream: write_changes(stream, changes, fmt, token, on_progress),
+                         token)
+
+
+def stream_scan(path, on_dir, max_depth=None, workers=None, backend="thread", scanner=None, ranking=None,
+                token=None, one_filesystem=False, device_limits=None):
+    """Scans a tree and reports each directory as soon as its subtree is complete.
+
+    Finished subtrees are not kept, so memory stays bounded by the directories
+    still being scanned rather than by the size of the tree. Several trees,
+    e.g. on different disks, can be scanned in one walk; each device then
+    gets its own queue and concurrency limit.
+
+    Args:
+        path (str or list): Directory to scan, or a list of them.
+        on_dir (callable): Called as on_dir(path, depth, size, files, mtime)
+            for every directory at most max_depth levels below its scanned
+            directory, children first. mtime is in seconds, None if unknown.
+        max_depth (int): Deepest level to report; None reports every level.
+        workers (int): Worker count for ParallelWalker.
+        backend (str): "thread" or "process".
+        scanner (DirectoryScanner): Scanner to use, e.g. to cancel or read
+            its counters from another thread. Its exclude rules apply.
+        ranking (FileRanking): Filled with the largest and oldest files.
+        token (CancelToken): Stops the scan.
+        one_filesystem (bool): Leave directories on other filesystems unread.
+        device_limits (dict): Listings in flight per device kind or device
+            number, as for ParallelWalker.
+
+    Returns:
+        DirNode: Root node holding the totals of the whole tree, or a list of
+        them when path is a list.
+    """
+    scanner = scanner or DirectoryScanner()
+    paths = [os.path.normpath(top) for top in ([path] if isinstance(path, str) else path)]
+    roots = [DirNode(top) for top in paths]
+    scanner.stats.reset(paths[0] if len(paths) == 1 else None)
+
+    def report(node):
+        depth = 0
+        current = node
+        while current.parent is not None:
+            depth += 1
+            current = current.parent
+        if max_depth is None or depth <= max_depth:
+            on_dir(node.path(), depth, node.size, node.files, _mtime_seconds(node))
+
+    walker = ParallelWalker(scanner, workers=workers, backend=backend,
+                            rank_limit=ranking.limit if ranking is not None else 0,
+                            one_filesystem=one_filesystem, device_limits=device_limits, exclude=scanner.exclude)
+    walker.walk([WalkTop(root, top, None, None) for root, top in zip(roots, paths)], on_dir=report, retain=False,
+                token=token)
+    if ranking is not None:
+        for root in roots:
+            ranking.merge(walker.rankings[id(root)])
+    scanner.stats.finish(sum(root.size for root in roots))
+    return roots[0] if isinstance(path, str) else roots
+
+
+# inotify event bits, from <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_DONT_FOLLOW = 0x02000000
+_IN_EXCL_UNLINK = 0x04000000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = (_IN_MODIFY | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF
+               | _IN_ONLYDIR | _IN_DONT_FOLLOW | _IN_EXCL_UNLINK)
+_INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+# Most folders a DirectoryWatcher gives an inotify watch; the rest are polled
+MAX_WATCHES = 65536
+# Seconds one round of mtime polling over the unwatched folders takes
+WATCH_POLL_INTERVAL = 30
+# Seconds the events of a folder are collected before it is reread
+WATCH_SETTLE = 0.5
+# Folders whose file sizes are remembered, so a write costs one stat of the file
+WATCH_FILE_MAPS = 64
+_WATCH_TICK = 0.25
+
+
+def _inotify_watch_limit():
+    """Returns the kernel's per-user inotify watch limit, or None if unknown."""
+    try:
+        with open("/proc/sys/fs/inotify/max_user_watches") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+class _Inotify:
+    """Minimal ctypes binding of the Linux inotify calls."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+    def add_watch(self, path, mask):
+        """Watches a directory and returns the watch descriptor."""
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+        return wd
+
+    def rm_watch(self, wd):
+        """Removes a watch; the kernel may already have dropped it."""
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """Returns the (wd, mask, name) events that arrive within timeout seconds."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher(threading.Thread):
+    """Keeps an indexed tree current by watching its folders for changes.
+
+    On Linux the folders get inotify watches, breadth first so the top of the
+    tree is covered first, up to max_watches and 90% of the kernel's per-user
+    limit. Every other folder, and every folder on other systems, is polled
+    for mtime changes a slice at a time, so one round takes poll_interval
+    seconds. Polling sees files being added, removed or renamed, but not a
+    file growing in place.
+
+    The events of a folder are collected for settle seconds and then turned
+    into deltas. Written, created, deleted and moved files are stat'ed one by
+    one against the file sizes remembered for the folder; the first change
+    in a folder, and any change to its subfolders, reads that one folder
+    again and scans only the subfolders that are new. The watcher thread
+    never modifies the tree: it queues changes on ``changes`` and the thread
+    that owns the index applies them with apply(). It reads the tree only
+    under the index's lock, which apply() and the index's own changes hold,
+    so it never sees a half-updated folder. New subfolders have their
+    folder names indexed; rankings are not updated. The scanner's exclude
+    rules apply to new folders and files as they did to the scan.
+    """
+
+    def __init__(self, index, path, scanner=None, max_watches=MAX_WATCHES, poll_interval=WATCH_POLL_INTERVAL,
+                 settle=WATCH_SETTLE):
+        super().__init__(daemon=True)
+        self.index = index
+        self.path = os.path.normpath(path)
+        self.scanner = scanner or DirectoryScanner()
+        self.max_watches = max_watches
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.token = CancelToken()
+        self.changes = queue.Queue()
+        self.applied = 0  # Changes applied to the index so far
+        self._inotify = None
+        self._wds = {}  # Watch descriptor -> folder path
+        self._watch_paths = {}  # Folder path -> watch descriptor
+        self._polled = {}  # Folder path -> mtime_ns last seen
+        self._poll_queue = deque()
+        self._dirty = {}  # Folder path -> [time of first event, changed file names or None to reread]
+        self._file_maps = OrderedDict()  # Folder path -> {file name: (size, mtime)}, least recently used first
+
+    @property
+    def watched(self):
+        """Number of folders with an inotify watch."""
+        return len(self._watch_paths)
+
+    @property
+    def polled(self):
+        """Number of folders checked by mtime polling."""
+        return len(self._polled)
+
+    def stop(self):
+        """Stops watching; queued changes can still be applied."""
+        self.token.cancel()
+
+    def run(self):
+        try:
+            self._start_watching()
+            while not self.token.cancelled:
+                if self._inotify is not None:
+                    self._handle_events(self._inotify.read(_WATCH_TICK))
+                else:
+                    self.token.wait(_WATCH_TICK)
+                self._poll_some()
+                self._flush()
+        except Exception as e:
+            logging.error(f"Error watching {self.path}: {e}")
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+
+    def apply(self, change):
+        """Applies one queued change to the index.
+
+        Call it from the thread that owns the index, e.g. the GUI thread.
+
+        Args:
+            change (tuple): ("files", path, size_delta, files_delta,
+                packed types delta) or ("listing", path, Listing,
+                {name: DirNode of a new subfolder}).
+
+        Returns:
+            DirNode: The folder that changed, or None if it is no longer indexed.
+        """
+        with self.index.lock:
+            kind, path = change[0], change[1]
+            node = self.index.lookup(path)
+            if node is None:
+                return None
+            self.applied += 1
+            if kind == "files":
+                _, _, size_delta, files_delta, added_types = change
+                removed_types = None
+            else:
+                _, _, listing, subtrees = change
+                size_delta = listing.own_size - node.own_size
+                files_delta = listing.own_files - node.own_files
+                added_types = listing.types.pack() if listing.types is not None else None
+                removed_types = _own_types(node)
+                node.mtime_ns, node.ino = listing.mtime_ns, listing.ino
+                names = self.index.names.get(self.index.containing_root(path))
+                present = set(listing.subdirs)
+                for child in list(node.children or ()):
+                    if child.name not in present:
+                        node.remove_child(child)  # Detached, so indexed names below it stop matching
+                        node.adjust(-child.size, -child.files, None, child.types)
+                        if names is not None:
+                            names.stale += child.files
+                for name, subtree in subtrees.items():
+                    if node.child(name) is None:
+                        node.replace_child(name, subtree)
+                        if names is not None:
+                            names.add_dir(subtree)
+                            names.add_tree(subtree)
+            node.own_size += size_delta
+            node.own_files += files_delta
+            node.adjust(size_delta, files_delta, added_types, removed_types)
+            return node
+
+    def _start_watching(self):
+        """Watches or polls every indexed folder, breadth first."""
+        folders = []  # (path, mtime_ns), breadth first
+        with self.index.lock:
+            node = self.index.lookup(self.path)
+            pending = deque([(self.path, node)] if node is not None else ())
+            while pending and not self.token.cancelled:
+                path, node = pending.popleft()
+                folders.append((path, node.mtime_ns))
+                pending.extend((os.path.join(path, child.name), child) for child in node.children or ())
+        if not folders:
+            return
+        if platform.system() == "Linux" and self.max_watches > 0:
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError) as e:  # AttributeError: libc without inotify
+                logging.error(f"inotify unavailable, polling {self.path} instead: {e}")
+            limit = _inotify_watch_limit()
+            if limit is not None:
+                self.max_watches = min(self.max_watches, limit * 9 // 10)
+        for path, mtime_ns in folders:
+            if self.token.cancelled:
+                return
+            self._track(path, mtime_ns)
+
+    def _track(self, path, mtime_ns):
+        """Gives a folder a watch while the cap allows, else polls it."""
+        if self._inotify is not None and len(self._watch_paths) < self.max_watches:
+            try:
+                wd = self._inotify.add_watch(path, _WATCH_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:  # Kernel limit reached; poll from now on
+                    self.max_watches = len(self._watch_paths)
+            else:
+                self._wds[wd] = path
+                self._watch_paths[path] = wd
+                return
+        if path not in self._polled:
+            self._poll_queue.append(path)
+        self._polled[path] = mtime_ns
+
+    def _untrack_below(self, top):
+        """Forgets a removed folder and everything below it."""
+        for path in [path for path in self._watch_paths if _relative_parts(path, top) is not None]:
+            wd = self._watch_paths.pop(path)
+            self._wds.pop(wd, None)
+            self._inotify.rm_watch(wd)
+        for mapping in (self._polled, self._dirty, self._file_maps):
+            for path in [path for path in mapping if _relative_parts(path, top) is not None]:
+                del mapping[path]
+
+    def _mark(self, path, name):
+        """Records a change in a folder: a file name, or None to reread the folder."""
+        entry = self._dirty.get(path)
+        if entry is None:
+            self._dirty[path] = [time.monotonic(), {name} if name is not None else None]
+        elif name is None:
+            entry[1] = None
+        elif entry[1] is not None:
+            entry[1].add(name)
+
+    def _handle_events(self, events):
+        for wd, mask, name in events:
+            if mask & _IN_Q_OVERFLOW:  # Events were lost; reread every watched folder
+                for path in self._watch_paths:
+                    self._mark(path, None)
+                continue
+            path = self._wds.get(wd)
+            if path is None:
+                continue
+            if mask & _IN_IGNORED:  # Folder gone; its parent's event updates the tree
+                del self._wds[wd]
+                self._watch_paths.pop(path, None)
+            elif mask & _IN_DELETE_SELF:
+                continue
+            elif mask & _IN_ISDIR or not name:
+                self._mark(path, None)
+            elif self.scanner.exclude is None or not self.scanner.exclude.excluded(os.path.join(path, name), False):
+                self._mark(path, name)
+
+    def _poll_some(self):
+        """Checks the next slice of polled folders for a changed mtime."""
+        count = min(len(self._poll_queue), -(-len(self._poll_queue) * _WATCH_TICK // self.poll_interval))
+        for _ in range(int(count)):
+            path = self._poll_queue.popleft()
+            if path not in self._polled:
+                continue
+            self._poll_queue.append(path)
+            try:
+                mtime_ns = os.stat(path, follow_symlinks=path == self.path).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            if mtime_ns != self._polled[path]:
+                self._polled[path] = mtime_ns
+                self._mark(path, None)
+
+    def _flush(self):
+        """Turns the folders whose events have settled into queued changes."""
+        now = time.monotonic()
+        ready = [path for path, (since, _) in self._dirty.items() if now - since >= self.settle]
+        for path in ready:
+            if self.token.cancelled:
+                return
+            entry = self._dirty.pop(path, None)
+            if entry is None:  # Forgotten along with a removed parent
+                continue
+            names = entry[1]
+            if names is not None and path in self._file_maps:
+                self._stat_files(path, names)
+            else:
+                self._reread(path)
+
+    def _stat_files(self, path, names):
+        """Queues the size change of individual files of a folder."""
+        known = self._file_maps[path]
+        self._file_maps.move_to_end(path)
+        size_delta = files_delta = 0
+        types = FileTypes()
+        for name in names:
+            old = known.pop(name, None)
+            if old is not None:
+                size_delta -= old[0]
+                files_delta -= 1
+                types.add(name, -old[0], old[1], -1)
+            try:
+                st = os.stat(os.path.join(path, name), follow_symlinks=False)
+            except OSError:  # Deleted or moved away
+                continue
+            if stat.S_ISREG(st.st_mode):
+                known[name] = (st.st_size, st.st_mtime)
+                size_delta += st.st_size
+                files_delta += 1
+                types.add(name, st.st_size, st.st_mtime)
+        packed = types.pack()
+        if size_delta or files_delta or packed is not None:
+            self.changes.put(("files", path, size_delta, files_delta, packed))
+
+    def _reread(self, path):
+        """Queues a fresh listing of one folder and scans of its new subfolders.
+
+        Once stop() cancels the token, listings and scans may be cut short,
+        so whatever they produced is dropped rather than queued.
+        """
+        with self.index.lock:
+            node = self.index.lookup(path)
+            known = {child.name for child in node.children or ()} if node is not None else None
+        if known is None:
+            return
+        listing = list_directory(path, follow_symlinks=path == self.path, collect_files=True, token=self.token,
+                                 collect_types=True, exclude=self.scanner.exclude)
+        if self.token.cancelled:
+            return
+        if listing.mtime_ns is None:
+            if isinstance(listing.error, FileNotFoundError):
+                self._untrack_below(path)
+            return
+        subtrees = {}
+        for name in listing.subdirs:
+            if name not in known:
+                subtree = self.scanner.scan_tree(os.path.join(path, name), token=self.token)
+                if self.token.cancelled:
+                    return
+                self._track_tree(os.path.join(path, name), subtree)
+                subtrees[name] = subtree
+        for name in known.difference(listing.subdirs):
+            self._untrack_below(os.path.join(path, name))
+        if path in self._polled:
+            self._polled[path] = listing.mtime_ns
+        self._file_maps[path] = {name: (size, mtime) for name, size, mtime in listing.files}
+        self._file_maps.move_to_end(path)
+        while len(self._file_maps) > WATCH_FILE_MAPS:
+            self._file_maps.popitem(last=False)
+        self.changes.put(("listing", path, listing._replace(files=None), subtrees))
+
+    def _track_tree(self, top, node):
+        """Watches or polls a newly scanned subtree."""
+        pending = [(top, node)]
+        while pending:
+            path, node = pending.pop()
+            self._track(path, node.mtime_ns)
+            pending.extend((os.path.join(path, child.name), child) for child in node.children or ())
+
+
+class DuplicateGroup(namedtuple("DuplicateGroup", "size digest paths")):
+    """Files with identical content; paths holds one path per distinct file."""
+
+    __slots__ = ()
+
+    @property
+    def reclaimable(self):
+        """Bytes freed by keeping a single copy."""
+        return self.size * (len(self.paths) - 1)
+
+
+def _hash_file(path, size, block_size, partial, mmap_threshold):
+    """Hashes a file, or only its first and last blocks when partial.
+
+    Large files are hashed through mmap; hashlib releases the GIL while
+    hashing big buffers, so several files hash in parallel on threads.
+
+    Returns:
+        bytes: Digest, or None if the file could not be read.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    try:
+        with open(path, "rb") as f:
+            if partial:
+                digest.update(f.read(block_size))
+                if size > block_size:
+                    f.seek(max(block_size, size - block_size))
+                    digest.update(f.read(block_size))
+            elif size >= mmap_threshold:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        for offset in range(0, len(mapped), DuplicateFinder.CHUNK_SIZE):
+                            digest.update(view[offset:offset + DuplicateFinder.CHUNK_SIZE])
+                    finally:
+                        view.release()
+            else:
+                for chunk in iter(lambda: f.read(DuplicateFinder.CHUNK_SIZE), b""):
+                    digest.update(chunk)
+    except (OSError, ValueError) as e:
+        logging.error(f"Error hashing {path}: {e}")
+        return None
+    return digest.digest()
+
+
+class DuplicateFinder:
+    """Finds duplicate files in stages so most files are never read.
+
+    1. Files are grouped by size; a unique size cannot have a duplicate.
+       Hard links to the same inode count as one file.
+    2. Same-size files are grouped by a hash of their first and last blocks.
+    3. Only files still sharing a partial hash are hashed in full.
+
+    Hashing runs on a thread pool. ``stage`` and the counters can be read from
+    another thread to show progress.
+    """
+
+    BLOCK_SIZE = 64 * 1024
+    CHUNK_SIZE = 8 * 1024 * 1024
+    MMAP_THRESHOLD = 32 * 1024 * 1024
+
+    def __init__(self, workers=None, min_size=1, scanner=None):
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.min_size = max(1, min_size)
+        self.scanner = scanner or DirectoryScanner()
+        self.token = CancelToken()
+        self.stage = "idle"
+        self.files_hashed = 0
+        self.bytes_hashed = 0
+
+    def cancel(self):
+        """Stops the search; find() then returns the groups confirmed so far."""
+        self.token.cancel()
+
+    def find(self, paths):
+        """Finds duplicate files below one or more directories.
+
+        Args:
+            paths (list): Directory paths to search.
+
+        Returns:
+            list: DuplicateGroup objects, most reclaimable bytes first.
+        """
+        self.stage = "scanning"
+        by_size = {}
+        seen_inodes = set()
+        for path in paths:
+            for file_path, size, dev, ino in self.scanner.iter_files(path, self.min_size, self.token):
+                if (dev, ino) in seen_inodes:
+                    continue
+                seen_inodes.add((dev, ino))
+                by_size.setdefault(size, []).append(file_path)
+        seen_inodes = None
+        candidates = [(size, group) for size, group in by_size.items() if len(group) > 1]
+        by_size = None
+
+        self.stage = "partial hashing"
+        groups = []
+        full_candidates = []
+        for (size, digest), files in self._group_by_hash(candidates, partial=True):
+            # Files no larger than the two sampled blocks were hashed completely
+            if size <= 2 * self.BLOCK_SIZE:
+                groups.append(DuplicateGroup(size, digest.hex(), sorted(files)))
+            else:
+                full_candidates.append((size, files))
+
+        self.stage = "full hashing"
+        for (size, digest), files in self._group_by_hash(full_candidates, partial=False):
+            groups.append(DuplicateGroup(size, digest.hex(), sorted(files)))
+
+        self.stage = "cancelled" if self.token.cancelled else "done"
+        groups.sort(key=lambda group: group.reclaimable, reverse=True)
+        return groups
+
+    def _group_by_hash(self, candidates, partial):
+        """Hashes candidate groups in parallel and splits them by digest.
+
+        Only a bounded number of files is queued on the pool at a time.
+
+        Args:
+            candidates (list): (size, [paths]) groups of at least two files.
+            partial (bool): Hash only the first and last blocks.
+
+        Returns:
+            list: ((size, digest), [paths]) groups of at least two files.
+        """
+        tasks = ((size, path) for size, files in candidates for path in files)
+        by_digest = {}
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                while len(in_flight) < self.workers * 4 and not self.token.cancelled:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    size, path = task
+                    future = executor.submit(_hash_file, path, size, self.BLOCK_SIZE, partial, self.MMAP_THRESHOLD)
+                    in_flight[future] = task
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    size, path = in_flight.pop(future)
+                    digest = future.result()
+                    self.files_hashed += 1
+                    self.bytes_hashed += min(size, 2 * self.BLOCK_SIZE) if partial else size
+                    if digest is not None:
+                        by_digest.setdefault((size, digest), []).append(path)
+        if self.token.cancelled:
+            return []
+        return [(key, files) for key, files in by_digest.items() if len(files) > 1]
+
+
+class DeleteResult(namedtuple("DeleteResult", "files dirs size errors removed cancelled")):
+    """Outcome of a BulkDeleter run.
+
+    files, dirs and size count what was (or, for a preview, would be)
+    deleted, size in file bytes as the scan counts them. removed lists the
+    targets that are gone completely; errors is the number of entries that
+    could not be deleted or read.
+    """
+
+
+class _DeleteDir:
+    """A directory being emptied: its descriptor stays open until its subdirectories are gone."""
+
+    __slots__ = ("name", "path", "parent", "dev", "fd", "pending", "listed", "failed")
+
+    def __init__(self, name, path, parent, dev):
+        self.name = name
+        self.path = path
+        self.parent = parent
+        self.dev = dev
+        self.fd = None
+        self.pending = 0  # Subdirectories not removed yet
+        self.listed = False
+        self.failed = False  # Something below could not be deleted, so rmdir is skipped
+
+
+class BulkDeleter:
+    """Deletes directory trees with parallel, descriptor-relative unlinks.
+
+    Every directory is opened relative to its parent's descriptor with
+    O_NOFOLLOW and its files are unlinked relative to its own, so no path is
+    resolved twice and a directory swapped for a symlink mid-way is refused
+    instead of followed. Listing and unlinking run on a thread pool, since
+    those syscalls release the GIL; the calling thread removes each
+    directory once its subdirectories are gone. Work is taken depth first,
+    which keeps the number of open descriptors near the depth of the tree.
+    Directories on another filesystem than their target are not entered.
+
+    preview() walks the same way without deleting anything, and delete()
+    refuses to run until a complete preview of the same targets has, so
+    nothing is removed without the caller having seen what will go. The
+    counters can be read from another thread to show progress.
+    """
+
+    MAX_ERROR_PATHS = 1000
+
+    def __init__(self, paths, workers=None, token=None):
+        self.paths = [os.path.normpath(os.path.abspath(path)) for path in paths]
+        for path in self.paths:
+            if os.path.dirname(path) == path:
+                raise ValueError(f"Refusing to delete a filesystem root: {path}")
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.token = token or CancelToken()
+        self.previewed = None  # DeleteResult of the last complete preview
+        self.dry_run = True
+        self._reset()
+
+    def _reset(self):
+        self.files = 0
+        self.dirs = 0
+        self.size = 0
+        self.errors = {}  # Error name -> count
+        self.error_paths = []  # (path, error name, message) of the first errors
+        self.removed = []
+
+    def cancel(self):
+        """Stops the run; directories being emptied are left as they are."""
+        self.token.cancel()
+
+    def preview(self):
+        """Counts what delete() would remove, without deleting anything.
+
+        Returns:
+            DeleteResult: Totals of the dry run.
+        """
+        result = self._run(dry_run=True)
+        self.previewed = None if result.cancelled else result
+        return result
+
+    def delete(self):
+        """Deletes the targets after a preview.
+
+        Each preview allows a single delete(); running it again needs a new
+        preview, since the targets may have changed since.
+
+        Returns:
+            DeleteResult: What was deleted.
+
+        Raises:
+            RuntimeError: preview() has not completed for these targets
+                since the last delete().
+        """
+        if self.previewed is None:
+            raise RuntimeError("Preview the deletion before running it")
+        self.previewed = None
+        return self._run(dry_run=False)
+
+    def _record_error(self, path, error):
+        name = _error_name(error)
+        self.errors[name] = self.errors.get(name, 0) + 1
+        if len(self.error_paths) < self.MAX_ERROR_PATHS:
+            self.error_paths.append((path, name, error.strerror or str(error)))
+            logging.error(f"Error deleting {path}: {error}")
+
+    def _run(self, dry_run):
+        self.dry_run = dry_run
+        self._reset()
+        stack = []
+        opened = []  # Directories whose descriptor may still be open
+        for path in self.paths:
+            directory = self._start(path, opened)
+            if directory is not None:
+                stack.append(directory)
+        futures = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while stack or futures:
+                    while stack and len(futures) < self.workers * 2 and not self.token.cancelled:
+                        directory = stack.pop()
+                        futures[executor.submit(self._clear, directory)] = directory
+                    if not futures:
+                        break  # Cancelled with directories left
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        directory = futures.pop(future)
+                        subdirs, size, files, errors = future.result()
+                        opened.append(directory)
+                        self.size += size
+                        self.files += files
+                        for path, error in errors:
+                            self._record_error(path, error)
+                            directory.failed = True
+                        directory.listed = True
+                        if self.token.cancelled:
+                            continue
+                        for name in subdirs:
+                            stack.append(_DeleteDir(name, os.path.join(directory.path, name), directory,
+                                                    directory.dev))
+                        directory.pending = len(subdirs)
+                        if not subdirs:
+                            self._finish(directory)
+        except BaseException:
+            self.token.cancel()  # e.g. KeyboardInterrupt: let the workers stop early
+            raise
+        finally:
+            for directory in opened:
+                if directory.fd is not None:
+                    os.close(directory.fd)
+                    directory.fd = None
+        return DeleteResult(self.files, self.dirs, self.size, sum(self.errors.values()), list(self.removed),
+                            self.token.cancelled)
+
+    def _start(self, path, opened):
+        """Sets up one target; files and symlinks are deleted at once.
+
+        Returns:
+            _DeleteDir: The target directory to empty, or None.
+        """
+        parent_path, name = os.path.split(path)
+        holder = _DeleteDir(None, parent_path, None, None)  # Parent of the target, never removed itself
+        try:
+            if _DIR_FD_SUPPORTED:
+                holder.fd = os.open(parent_path, _DIR_OPEN_FLAGS)
+                opened.append(holder)
+            st = os.stat(name if holder.fd is not None else path, dir_fd=holder.fd, follow_symlinks=False)
+        except OSError as e:
+            self._record_error(path, e)
+            return None
+        if stat.S_ISDIR(st.st_mode):
+            holder.pending = 1
+            holder.listed = True
+            return _DeleteDir(name, path, holder, st.st_dev)
+        try:
+            if not self.dry_run:
+                os.unlink(name if holder.fd is not None else path, dir_fd=holder.fd)
+        except OSError as e:
+            self._record_error(path, e)
+            return None
+        if stat.S_ISREG(st.st_mode):
+            self.files += 1
+            self.size += st.st_size
+        self.removed.append(path)
+        return None
+
+    def _clear(self, directory):
+        """Opens a directory and unlinks its files; runs on a worker.
+
+        Returns:
+            tuple: (subdirectory names, bytes, files, [(path, OSError)]).
+        """
+        subdirs = []
+        size = 0
+        files = 0
+        errors = []
+        try:
+            if _DIR_FD_SUPPORTED:
+                directory.fd = os.open(directory.name, _SUBDIR_OPEN_FLAGS, dir_fd=directory.parent.fd)
+                st = os.fstat(directory.fd)
+            else:
+                st = os.stat(directory.path, follow_symlinks=False)
+                if not stat.S_ISDIR(st.st_mode):
+                    raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), directory.path)
+            if st.st_dev != directory.dev:
+                raise OSError(errno.EXDEV, "On another filesystem", directory.path)
+            target = directory.fd if directory.fd is not None else directory.path
+            with os.scandir(target) as entries:
+                for count, entry in enumerate(entries):
+                    if not count & 1023 and self.token.cancelled:
+                        break
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                            continue
+                        entry_size = entry.stat(follow_symlinks=False).st_size \
+                            if entry.is_file(follow_symlinks=False) else None
+                        if not self.dry_run:
+                            if directory.fd is not None:
+                                os.unlink(entry.name, dir_fd=directory.fd)
+                            else:
+                                os.unlink(entry.path)
+                    except OSError as e:
+                        errors.append((os.path.join(directory.path, entry.name), e))
+                        continue
+                    if entry_size is not None:
+                        size += entry_size
+                        files += 1
+        except OSError as e:
+            errors.append((directory.path, e))
+        return subdirs, size, files, errors
+
+    def _finish(self, directory):
+        """Removes an emptied directory, then every ancestor it was the last subdirectory of."""
+        while directory.parent is not None:
+            if directory.fd is not None:
+                os.close(directory.fd)
+                directory.fd = None
+            parent = directory.parent
+            if not directory.failed:
+                try:
+                    if not self.dry_run:
+                        os.rmdir(directory.name if parent.fd is not None else directory.path, dir_fd=parent.fd)
+                    self.dirs += 1
+                except OSError as e:
+                    self._record_error(directory.path, e)
+                    directory.failed = True
+            if directory.failed:
+                parent.failed = True
+            elif parent.parent is None:
+                self.removed.append(directory.path)
+            parent.pending -= 1
+            if parent.pending or not parent.listed:
+                return
+            directory = parent
+        if directory.fd is not None:
+            os.close(directory.fd)
+            directory.fd = None
+
+
+class _RecordWriter:
+    """Writes scan records to a stream in one of the CLI output formats.
+
+    Output is flushed at most every flush_interval seconds so records reach
+    a pipe while the scan is still running without a flush per line; None
+    leaves flushing to the stream's own buffer, as for files.
+    """
+
+    FORMATS = ("text", "csv", "json", "jsonl")
+    FLUSH_INTERVAL = 0.5
+
+    def __init__(self, stream, fmt, flush_interval=FLUSH_INTERVAL):
+        self.stream = stream
+        self.format = fmt
+        self.count = 0
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        if fmt == "csv":
+            self.csv = csv.writer(stream)
+            self.csv.writerow(["path", "depth", "size", "files", "mtime"])
+        elif fmt == "json":
+            stream.write("[")
+
+    def write(self, path, depth, size, files, mtime=None):
+        """Writes one directory record."""
+        if self.format == "csv":
+            self.csv.writerow([path, depth, size, files, "" if mtime is None else mtime])
+        elif self.format == "text":
+            self.stream.write(f"{format_size(size):>12}  {files:>12,}  {path}\n")
+        else:
+            record = json.dumps({"path": path, "depth": depth, "size": size, "files": files, "mtime": mtime})
+            if self.format == "json":
+                self.stream.write(("\n" if not self.count else ",\n") + record)
+            else:
+                self.stream.write(record + "\n")
+        self.count += 1
+        if self.flush_interval is None:
+            return
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.stream.flush()
+            self.last_flush = now
+
+    def write_files(self, kind, files):
+        """Writes ranked file records after the directory records.
+
+        Args:
+            kind (str): "largest" or "oldest".
+            files (list): (path, size, mtime) tuples.
+        """
+        if self.format == "csv":
+            self.csv.writerow([])
+            self.csv.writerow([f"{kind} files", "size", "mtime"])
+            for path, size, mtime in files:
+                self.csv.writerow([path, size, mtime])
+        elif self.format == "text":
+            self.stream.write(f"\n{kind.capitalize()} files:\n")
+            for path, size, mtime in files:
+                modified = time.strftime("%Y-%m-%d", time.localtime(mtime))
+                self.stream.write(f"{format_size(size):>12}  {modified:>12}  {path}\n")
+        else:
+            for path, size, mtime in files:
+                record = json.dumps({"kind": kind, "path": path, "size": size, "mtime": mtime})
+                if self.format == "json":
+                    self.stream.write(("\n" if not self.count else ",\n") + record)
+                else:
+                    self.stream.write(record + "\n")
+                self.count += 1
+
+    def close(self):
+        """Finishes the output."""
+        if self.format == "json":
+            self.stream.write("\n]\n")
+        self.stream.flush()
+
+
+def _positive_int(text):
+    """Parses an integer option that must be at least 1, for argparse."""
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {text!r}")
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return value
+
+
+def _parse_device_limits(specs):
+    """Turns --device-limit KIND=N or PATH=N options into ParallelWalker device_limits.
+
+    Raises:
+        ValueError: A spec is malformed or its path cannot be read.
+    """
+    limits = {}
+    for spec in specs or ():
+        target, _, count = spec.rpartition("=")
+        if not target or not count.isdigit() or int(count) < 1:
+            raise ValueError(f"expected KIND=N or PATH=N with N at least 1: {spec}")
+        if target in DEVICE_KINDS:
+            limits[target] = int(count)
+        else:
+            try:
+                limits[os.stat(target).st_dev] = int(count)
+            except OSError as e:
+                raise ValueError(f"cannot read {target}: {e.strerror}")
+    return limits
+
+
+def _exclude_rules(args):
+    """Builds the ExcludeRules of the --exclude and --exclude-from options.
+
+    Returns:
+        ExcludeRules: The rules, or None when there are none.
+
+    Raises:
+        OSError: The --exclude-from file cannot be read.
+        ValueError: A pattern is not a valid glob.
+    """
+    patterns = []
+    if args.exclude_from:
+        patterns.extend(ExcludeRules.load(args.exclude_from).patterns)
+    patterns.extend(args.exclude or ())
+    return ExcludeRules(patterns) or None
+
+
+def _scanner_for(args):
+    """Returns a DirectoryScanner with the command's exclude rules, or None after reporting bad ones."""
+    scanner = DirectoryScanner()
+    try:
+        scanner.exclude = _exclude_rules(args)
+    except OSError as e:
+        print(f"pcCleaner: cannot read {args.exclude_from}: {e.strerror}", file=sys.stderr)
+        return None
+    except ValueError as e:
+        print(f"pcCleaner: {e}", file=sys.stderr)
+        return None
+    return scanner
+
+
+def _scan_command(args):
+    """Runs the headless "scan" command."""
+    for path in args.paths:
+        if not os.path.isdir(path):
+            print(f"pcCleaner: not a directory: {path}", file=sys.stderr)
+            return 2
+    try:
+        device_limits = _parse_device_limits(args.device_limit)
+    except ValueError as e:
+        print(f"pcCleaner: --device-limit: {e}", file=sys.stderr)
+        return 2
+    scanner = _scanner_for(args)
+    if scanner is None:
+        return 2
+    token = CancelToken()
+    if args.output:
+        try:
+            out = open_export(args.output)
+        except OSError as e:
+            print(f"pcCleaner: cannot write {args.output}: {e}", file=sys.stderr)
+            return 1
+    else:
+        out = sys.stdout
+    writer = _RecordWriter(out, args.format, flush_interval=None if args.output else _RecordWriter.FLUSH_INTERVAL)
+    ranking = FileRanking(args.top) if args.top > 0 else None
+    max_depth = None if args.depth < 0 else args.depth
+    snapshots = {}  # Scanned path -> SnapshotWriter
+    snapshot_ids = []
+    if not args.snapshot:
+        on_dir = writer.write
+    else:
+        store = ScanCache()
+        for path in args.paths:
+            snapshots[os.path.normpath(path)] = SnapshotWriter(store, os.path.abspath(path), path)
+        print_depth = max_depth
+        max_depth = None  # The snapshot needs every level; print_depth filters the output
+
+        def on_dir(path, depth, size, files, mtime):
+            for top in sorted(snapshots, key=len, reverse=True):
+                if _relative_parts(path, top) is not None:
+                    snapshots[top].add(path, depth, size, files, mtime)
+                    break
+            if print_depth is None or depth <= print_depth:
+                writer.write(path, depth, size, files, mtime)
+
+    start_time = time.time()
+    try:
+        roots = stream_scan(args.paths, on_dir, max_depth=max_depth, workers=args.workers, backend=args.backend,
+                            scanner=scanner, ranking=ranking, token=token, one_filesystem=args.one_file_system,
+                            device_limits=device_limits)
+        if ranking is not None:
+            writer.write_files("largest", ranking.largest_files())
+            writer.write_files("oldest", ranking.oldest_files())
+        writer.close()
+        for snapshot in snapshots.values():
+            snapshot_ids.append(snapshot.close())
+    except KeyboardInterrupt:
+        token.cancel()
+        return 130
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head); stop quietly
+        token.cancel()
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except OSError as e:
+        if out is sys.stdout:
+            raise
+        token.cancel()
+        print(f"pcCleaner: cannot write {args.output}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if snapshots:
+            for snapshot in list(snapshots.values())[len(snapshot_ids):]:
+                snapshot.abort()
+            store.close()
+    print(f"Scanned {scanner.dirs_scanned:,} folders, {sum(root.files for root in roots):,} files, "
+          f"{format_size(sum(root.size for root in roots))} in {time.time() - start_time:.2f} seconds",
+          file=sys.stderr)
+    if snapshot_ids:
+        print(f"Saved snapshot{'s' if len(snapshot_ids) > 1 else ''} {', '.join(map(str, snapshot_ids))}",
+              file=sys.stderr)
+    stats = scanner.stats
+    if stats.skipped_mounts:
+        print(f"Left {stats.skipped_mounts:,} mount points on other filesystems unread", file=sys.stderr)
+    if stats.errors:
+        print(f"Skipped {stats.unreadable_dirs:,} unreadable folders; errors: "
+              + ", ".join(f"{name} x{count:,}" for name, count in sorted(stats.errors.items())), file=sys.stderr)
+    if args.stats:
+        try:
+            stats.dump(args.stats)
+        except OSError as e:
+            print(f"pcCleaner: cannot write {args.stats}: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+
+def _duplicates_command(args):
+    """Runs the headless "duplicates" command."""
+    for path in args.paths:
+        if not os.path.isdir(path):
+            print(f"pcCleaner: not a directory: {path}", file=sys.stderr)
+            return 2
+    scanner = _scanner_for(args)
+    if scanner is None:
+        return 2
+    finder = DuplicateFinder(workers=args.workers, min_size=args.min_size, scanner=scanner)
+    try:
+        groups = finder.find(args.paths)
+    except KeyboardInterrupt:
+        finder.cancel()
+        return 130
+    out = sys.stdout
+    if args.format == "csv":
+        writer = csv.writer(out)
+        writer.writerow(["group", "size", "digest", "path"])
+        for number, group in enumerate(groups, 1):
+            for path in group.paths:
+                writer.writerow([number, group.size, group.digest, path])
+    elif args.format in ("json", "jsonl"):
+        records = [json.dumps({"size": group.size, "digest": group.digest, "reclaimable": group.reclaimable,
+                               "paths": group.paths}) for group in groups]
+        if args.format == "json":
+            out.write("[\n" + ",\n".join(records) + "\n]\n")
+        else:
+            out.writelines(record + "\n" for record in records)
+    else:
+        for group in groups:
+            out.write(f"{format_size(group.reclaimable)} reclaimable: {len(group.paths)} copies of "
+                      f"{format_size(group.size)}\n")
+            out.writelines(f"    {path}\n" for path in group.paths)
+    total = sum(group.reclaimable for group in groups)
+    print(f"{len(groups):,} duplicate groups, {format_size(total)} reclaimable", file=sys.stderr)
+    return 0
+
+
+def _estimate_command(args):
+    """Runs the headless "estimate" command."""
+    if not os.path.isdir(args.path):
+        print(f"pcCleaner: not a directory: {args.path}", file=sys.stderr)
+        return 2
+    scanner = _scanner_for(args)
+    if scanner is None:
+        return 2
+    scanner.one_filesystem = args.one_file_system
+    start_time = time.time()
+    token = CancelToken()
+    try:
+        estimates = scanner.estimate(args.path, probes=args.probes, seed=args.seed, token=token)
+    except KeyboardInterrupt:
+        token.cancel()
+        return 130
+    ranked = sorted(estimates.items(), key=lambda item: item[1].size, reverse=True)
+    out = sys.stdout
+    try:
+        if args.format == "csv":
+            writer = csv.writer(out)
+            writer.writerow(["path", "size", "low", "high", "files", "probes"])
+            for name, estimate in ranked:
+                writer.writerow([os.path.join(args.path, name)] + list(estimate))
+        elif args.format in ("json", "jsonl"):
+            records = [json.dumps(dict(estimate._asdict(), path=os.path.join(args.path, name)))
+                       for name, estimate in ranked]
+            if args.format == "json":
+                out.write("[\n" + ",\n".join(records) + "\n]\n")
+            else:
+                out.writelines(record + "\n" for record in records)
+        else:
+            for name, estimate in ranked:
+                out.write(f"≈{format_size(estimate.size):>12}  {format_size(estimate.low):>10} - "
+                          f"{format_size(estimate.high):<10} ≈{estimate.files:>12,}  "
+                          f"{os.path.join(args.path, name)}\n")
+        out.flush()
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    total = sum(estimate.size for estimate in estimates.values())
+    print(f"Estimated {format_size(total)} in {len(estimates):,} folders from {scanner.dirs_scanned:,} folders read "
+          f"in {time.time() - start_time:.2f} seconds", file=sys.stderr)
+    return 0
+
+
+def _watch_command(args):
+    """Runs the headless "watch" command."""
+    if not os.path.isdir(args.path):
+        print(f"pcCleaner: not a directory: {args.path}", file=sys.stderr)
+        return 2
+    scanner = _scanner_for(args)
+    if scanner is None:
+        return 2
+    job = ScanJob(scanner, args.path, max_workers=args.workers, rank_limit=0)
+    job.run()
+    root = None
+    while not job.events.empty():
+        kind, value = job.events.get()[:2]
+        if kind == "error":
+            print(f"pcCleaner: {value}", file=sys.stderr)
+            return 1
+        if kind == "done":
+            root = value
+    index = ScanIndex()
+    index.insert(job.path, root, names=job.names, fingerprint=job.fingerprint)
+    watcher = DirectoryWatcher(index, job.path, scanner=scanner, max_watches=args.max_watches,
+                               poll_interval=args.poll_interval)
+    watcher.start()
+    print(f"{format_size(root.size)} in {root.files:,} files; watching for changes, Ctrl+C to stop",
+          file=sys.stderr)
+    try:
+        while True:
+            change = watcher.changes.get()
+            before = root.size
+            node = watcher.apply(change)
+            if node is not None and root.size != before:
+                delta = root.size - before
+                sys.stdout.write(f"{'+' if delta > 0 else '-'}{format_size(abs(delta)):>11}  "
+                                 f"{format_size(root.size):>11}  {node.path()}\n")
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        watcher.stop()
+    except BrokenPipeError:
+        watcher.stop()
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    print(f"Watched {watcher.watched:,} folders with inotify and polled {watcher.polled:,}", file=sys.stderr)
+    return 130
+
+
+def _diff_command(args):
+    """Runs the headless "diff" command."""
+    root = os.path.normpath(os.path.abspath(args.path))
+    store = ScanCache()
+    try:
+        snapshots = store.snapshots(root)
+        if args.list:
+            for snapshot_id, taken_at, size, files in snapshots:
+                taken = time.strftime("%Y-%m-%d %H:%M", time.localtime(taken_at))
+                print(f"{snapshot_id:>6}  {taken}  {format_size(size):>11}  {files:>12,} files")
+            return 0
+        ids = [snapshot[0] for snapshot in snapshots]
+        new_id = args.new if args.new is not None else (ids[0] if ids else None)
+        if new_id not in ids:
+            print(f"pcCleaner: no snapshot {'' if new_id is None else new_id} of {root}; "
+                  "save one with scan --snapshot", file=sys.stderr)
+            return 2
+        if args.old is not None:
+            old_id = args.old
+        else:
+            older = ids[ids.index(new_id) + 1:]
+            old_id = older[0] if older else None
+        if old_id not in ids:
+            print(f"pcCleaner: no earlier snapshot of {root} to compare with", file=sys.stderr)
+            return 2
+        changes = diff_snapshots(store.snapshot_rows(old_id), store.snapshot_rows(new_id), root)
+        if args.top > 0:
+            changes, counts = rank_changes(changes, args.top)
+        else:
+            counts = dict.fromkeys(SnapshotChange.STATUSES, 0)
+            changes = _count_changes(changes, counts)
+        out = open_export(args.output) if args.output else sys.stdout
+        try:
+            write_changes(out, changes, args.format)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except OSError as e:
+        print(f"pcCleaner: cannot write {args.output}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+    sizes = {snapshot[0]: snapshot[2] for snapshot in snapshots}
+    delta = sizes[new_id] - sizes[old_id]
+    print(f"Snapshot {old_id} to {new_id}: {counts['added']:,} folders added, {counts['removed']:,} removed, "
+          f"{counts['resized']:,} resized; {'-' if delta < 0 else '+'}{format_size(abs(delta))} in total",
+          file=sys.stderr)
+    return 0
+
+
+def _delete_command(args):
+    """Runs the headless "delete" command."""
+    try:
+        deleter = BulkDeleter(args.paths, workers=args.workers)
+    except ValueError as e:
+        print(f"pcCleaner: {e}", file=sys.stderr)
+        return 2
+    start_time = time.time()
+    try:
+        preview = deleter.preview()
+        print(f"{'Deleting' if args.yes else 'Would delete'} {preview.files:,} files in {preview.dirs:,} folders, "
+              f"{format_size(preview.size)}", file=sys.stderr)
+        if preview.errors:
+            print(f"{preview.errors:,} entries cannot be read; the folders holding them are kept", file=sys.stderr)
+        if not args.yes:
+            print("Nothing deleted; run again with --yes to delete", file=sys.stderr)
+            return 0
+        result = deleter.delete()
+    except KeyboardInterrupt:
+        return 130
+    print(f"Deleted {result.files:,} files in {result.dirs:,} folders, {format_size(result.size)} reclaimed "
+          f"in {time.time() - start_time:.2f} seconds", file=sys.stderr)
+    if result.errors:
+        print(f"{result.errors:,} entries could not be deleted: "
+              + ", ".join(f"{name} x{count:,}" for name, count in sorted(deleter.errors.items())), file=sys.stderr)
+        for path, name, message in deleter.error_paths[:10]:
+            print(f"    {path}: {message}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _add_exclude_options(parser):
+    """Adds the --exclude and --exclude-from options to a command."""
+    parser.add_argument("--exclude", action="append", metavar="PATTERN",
+                        help="leave out folders and files matching a gitignore-style PATTERN, e.g. node_modules, "
+                        "*.iso or /proc; excluded folders are never read; repeatable")
+    parser.add_argument("--exclude-from", metavar="FILE", help="read exclusion patterns from FILE, one per line")
+
+
+def build_parser():
+    """Builds the command line parser."""
+    parser = argparse.ArgumentParser(
+        prog="pcCleaner", description="Show folder sizes and file counts. Starts the GUI when no command is given.")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("gui", help="start the graphical interface (default)")
+    scan = commands.add_parser("scan", help="scan folders headlessly and stream the results to stdout")
+    scan.add_argument("paths", nargs="+", metavar="path",
+                      help="folder to scan; several folders are scanned together, each device with its own queue")
+    scan.add_argument("--depth", type=int, default=1,
+                      help="deepest folder level to print, 0 for the folder itself, -1 for all (default: 1)")
+    scan.add_argument("--format", choices=_RecordWriter.FORMATS, default="text",
+                      help="output format (default: text)")
+    scan.add_argument("--workers", type=int, default=None, help="number of scan workers")
+    scan.add_argument("--backend", choices=ParallelWalker.BACKENDS, default="thread",
+                      help="run scan workers as threads or processes (default: thread)")
+    scan.add_argument("--one-file-system", "-x", action="store_true",
+                      help="do not descend into folders on other filesystems (mount points)")
+    scan.add_argument("--device-limit", action="append", metavar="KIND=N|PATH=N",
+                      help="most folder listings in flight on one device: by kind (" + ", ".join(DEVICE_KINDS)
+                      + ") or for the device holding PATH; repeatable (defaults: hdd=2, network=64, "
+                      "others twice the workers)")
+    scan.add_argument("--top", type=int, default=0,
+                      help="also list the N largest and N least recently modified files")
+    scan.add_argument("--output", "-o", metavar="FILE",
+                      help="write the records to FILE instead of stdout, gzip-compressed if it ends in .gz")
+    scan.add_argument("--stats", metavar="FILE",
+                      help="write timings, slowest folders and errors of the scan to FILE as JSON")
+    scan.add_argument("--snapshot", action="store_true",
+                      help="save the folder totals as a snapshot in the scan cache, for the diff command")
+    _add_exclude_options(scan)
+    estimate = commands.add_parser("estimate", help="estimate subfolder sizes within seconds by sampling, "
+                                                    "with 95%% confidence intervals")
+    estimate.add_argument("path", help="folder whose subfolders to estimate")
+    estimate.add_argument("--probes", type=_positive_int, default=ESTIMATE_PROBES,
+                          help=f"random walks per subfolder; more narrow the intervals (default: {ESTIMATE_PROBES})")
+    estimate.add_argument("--seed", type=int, default=None, help="seed the sampling for repeatable estimates")
+    estimate.add_argument("--one-file-system", "-x", action="store_true",
+                          help="count folders on other filesystems (mount points) as empty")
+    estimate.add_argument("--format", choices=_RecordWriter.FORMATS, default="text",
+                          help="output format (default: text)")
+    _add_exclude_options(estimate)
+    duplicates = commands.add_parser("duplicates", help="find duplicate files and the space they waste")
+    duplicates.add_argument("paths", nargs="+", help="folders to search")
+    duplicates.add_argument("--min-size", type=int, default=1, help="ignore files smaller than this many bytes")
+    duplicates.add_argument("--format", choices=_RecordWriter.FORMATS, default="text",
+                            help="output format (default: text)")
+    duplicates.add_argument("--workers", type=int, default=None, help="number of hashing workers")
+    _add_exclude_options(duplicates)
+    watch = commands.add_parser("watch", help="scan a folder, then print its size changes as they happen")
+    watch.add_argument("path", help="folder to watch")
+    watch.add_argument("--workers", type=int, default=None, help="number of scan workers")
+    watch.add_argument("--max-watches", type=int, default=MAX_WATCHES,
+                       help=f"most folders to watch with inotify, the rest are polled (default: {MAX_WATCHES})")
+    watch.add_argument("--poll-interval", type=float, default=WATCH_POLL_INTERVAL,
+                       help=f"seconds per round of polling unwatched folders (default: {WATCH_POLL_INTERVAL})")
+    _add_exclude_options(watch)
+    diff = commands.add_parser("diff", help="compare two snapshots of a folder and list what grew or shrank")
+    diff.add_argument("path", help="folder the snapshots were taken of")
+    diff.add_argument("--list", action="store_true", help="list the folder's snapshots and exit")
+    diff.add_argument("--from", dest="old", type=int, metavar="ID",
+                      help="earlier snapshot (default: the one before --to)")
+    diff.add_argument("--to", dest="new", type=int, metavar="ID", help="later snapshot (default: the latest)")
+    diff.add_argument("--top", type=int, default=50,
+                      help="list the N largest changes, or 0 for every change in path order (default: 50)")
+    diff.add_argument("--format", choices=_RecordWriter.FORMATS, default="text",
+                      help="output format (default: text)")
+    diff.add_argument("--output", "-o", metavar="FILE",
+                      help="write the changes to FILE instead of stdout, gzip-compressed if it ends in .gz")
+    delete = commands.add_parser("delete", help="delete folders and report the space reclaimed; "
+                                                "only previews what would go unless --yes is given")
+    delete.add_argument("paths", nargs="+", help="folders or files to delete")
+    delete.add_argument("--yes", action="store_true", help="delete after the preview instead of stopping at it")
+    delete.add_argument("--workers", type=int, default=None, help="number of deleting workers")
+    return parser
+
+
+def main(argv=None):
+    """Command line entry point."""
+    args = build_parser().parse_args(argv)
+    if args.command == "scan":
+        return _scan_command(args)
+    if args.command == "estimate":
+        return _estimate_command(args)
+    if args.command == "duplicates":
+        return _duplicates_command(args)
+    if args.command == "watch":
+        return _watch_command(args)
+    if args.command == "diff":
+        return _diff_command(args)
+    if args.command == "delete":
+        return _delete_command(args)
+    from pcCleaner_gui import main as gui_main
+    gui_main()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
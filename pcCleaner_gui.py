@@ -0,0 +1,1688 @@
+"""Tkinter interface of pcCleaner; the scanning engine lives in pcCleaner."""
+import tkinter as tk
+from tkinter import ttk, filedialog, font, messagebox
+import os
+import threading
+import time
+import logging
+import platform
+import subprocess
+import sys
+import sqlite3
+import queue
+
+from pcCleaner import (BulkDeleter, CancelToken, DirectoryScanner, DirectoryWatcher, DuplicateFinder, ExcludeRules,
+                       ScanCache, ScanIndex, ScanJob, default_cache_path, diff_snapshots, export_changes, export_tree,
+                       format_size, iter_tree, rank_changes, rules_fingerprint, tree_rows, type_breakdown)
+
+
+def default_log_path():
+    """Returns the GUI's error log, treesize.log next to the scan cache."""
+    return os.path.join(os.path.dirname(default_cache_path()), "treesize.log")
+
+
+def format_change(change):
+    """Returns the Change column text of a SnapshotChange, or "" for None."""
+    if change is None:
+        return ""
+    return f"{'-' if change.delta < 0 else '+'}{format_size(abs(change.delta))} {change.status}"
+
+
+class Row:
+    """One folder line of a VirtualTreeview, kept in Python instead of the Treeview."""
+
+    __slots__ = ("name", "size", "files", "node", "parent", "depth", "children", "pending", "change", "estimate")
+
+    def __init__(self, name, size=0, files=0, node=None, parent=None, pending=False, change=None):
+        self.name = name
+        self.size = size
+        self.files = files
+        self.node = node  # Indexed DirNode, None while the folder is being scanned
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.children = None  # Child rows while expanded
+        self.pending = pending
+        self.change = change  # SnapshotChange while comparing with a snapshot
+        self.estimate = None  # SizeEstimate shown until the exact totals arrive
+
+    def parts(self):
+        """Returns the names from the top-level row down to this one."""
+        parts = []
+        row = self
+        while row is not None:
+            parts.append(row.name)
+            row = row.parent
+        parts.reverse()
+        return parts
+
+
+class VirtualTreeview:
+    """Shows any number of rows by rendering only the visible window into a Treeview.
+
+    Rows are sorted and filtered as Python lists; the Treeview holds one item
+    per visible line plus a small buffer, rewritten in place whenever the view
+    scrolls or the data changes, so a folder with hundreds of thousands of
+    subfolders costs no more Tcl calls than one with fifty.
+    """
+
+    BUFFER = 5
+    SORT_KEYS = {
+        "#0": lambda row: row.name.lower(),
+        "size": lambda row: row.size,
+        "files": lambda row: row.files,
+        "change": lambda row: abs(row.change.delta) if row.change is not None else -1,
+    }
+
+    def __init__(self, tree, scrollbar):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.rows = []  # Top-level rows
+        self.visible = []  # Expanded rows that pass the filter, in display order
+        self.offset = 0  # Index in visible of the first rendered row
+        self.items = []  # Treeview items, one per rendered line
+        self.item_rows = {}  # Treeview item -> row it currently shows
+        self.selected = None
+        self.sort_key = self.SORT_KEYS["size"]
+        self.sort_descending = True
+        self.row_filter = None
+        self.highlight = None
+
+        self.row_height = font.nametofont("TkDefaultFont").metrics("linespace") + 4
+        ttk.Style(tree).configure("Treeview", rowheight=self.row_height)
+        self.page = 20  # Lines that fit in the widget, updated on resize
+        tree.tag_configure("hidden", foreground="gray")
+        scrollbar.configure(command=self.yview)
+        tree.bind("<Configure>", self.on_resize)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            tree.bind(sequence, self.on_wheel)
+        for sequence in ("<Up>", "<Down>", "<Prior>", "<Next>", "<Home>", "<End>"):
+            tree.bind(sequence, self.on_key)
+
+    def set_rows(self, rows):
+        """Replaces all rows, sorts them and repaints.
+
+        Args:
+            rows (list): Top-level Row objects.
+        """
+        self.rows = rows
+        self.offset = 0
+        self.selected = None
+        self.sort(None)
+
+    def append(self, rows):
+        """Adds top-level rows unsorted; call refresh to show them."""
+        self.rows.extend(rows)
+
+    def top_rows(self):
+        """Returns the top-level rows that pass the filter, in display order."""
+        return [row for row in self.rows if self.row_filter is None or self.row_filter(row)]
+
+    def sort(self, column, descending=True):
+        """Sorts every level of the view by a column and repaints.
+
+        Args:
+            column (str): Column identifier, or None to keep the current sort.
+            descending (bool): Largest first.
+        """
+        if column is not None:
+            self.sort_key = self.SORT_KEYS[column]
+            self.sort_descending = descending
+        stack = [self.rows]
+        while stack:
+            rows = stack.pop()
+            rows.sort(key=self.sort_key, reverse=self.sort_descending)
+            stack.extend(row.children for row in rows if row.children)
+        self.refresh()
+
+    def set_filter(self, row_filter):
+        """Hides rows for which row_filter returns False; None shows all rows."""
+        self.row_filter = row_filter
+        self.refresh()
+
+    def set_highlight(self, highlight):
+        """Greys out rows for which highlight returns False; None greys none."""
+        self.highlight = highlight
+        self.repaint()
+
+    def expand(self, row, children):
+        """Shows child rows below row, sorted like the rest of the view."""
+        children.sort(key=self.sort_key, reverse=self.sort_descending)
+        row.children = children
+        self.refresh()
+
+    def collapse(self, row):
+        """Hides the child rows below row."""
+        row.children = None
+        self.refresh()
+
+    def refresh(self):
+        """Rebuilds the display order after rows were added, sorted or filtered."""
+        visible = []
+        stack = [iter(self.rows)]
+        while stack:
+            for row in stack[-1]:
+                if self.row_filter is None or self.row_filter(row):
+                    visible.append(row)
+                    if row.children:
+                        stack.append(iter(row.children))
+                        break
+            else:
+                stack.pop()
+        self.visible = visible
+        self.repaint()
+
+    def repaint(self):
+        """Writes the rows of the current window into the Treeview items."""
+        current = self.tree.selection()
+        if current and current[0] in self.item_rows:
+            self.selected = self.item_rows[current[0]]
+        self.offset = max(0, min(self.offset, len(self.visible) - self.page))
+        window = self.visible[self.offset:self.offset + self.page + self.BUFFER]
+        while len(self.items) < len(window):
+            self.items.append(self.tree.insert("", "end"))
+        if len(self.items) > len(window):
+            self.tree.delete(*self.items[len(window):])
+            del self.items[len(window):]
+
+        self.item_rows = {}
+        selection = ()
+        for item, row in zip(self.items, window):
+            self.item_rows[item] = row
+            if row.children:
+                marker = "▾ "
+            elif row.node is not None and row.node.children:
+                marker = "▸ "
+            else:
+                marker = "  "
+            if row.pending and row.estimate is not None:
+                estimate = row.estimate
+                values = (f"≈ {format_size(estimate.size)} ±{estimate.margin:.0%}", f"≈ {estimate.files:,}", "")
+            elif row.pending:
+                values = ("Calculating...", "", "")
+            else:
+                values = (format_size(row.size), f"{row.files:,}", format_change(row.change))
+            tags = ("hidden",) if self.highlight is not None and not self.highlight(row) else ()
+            self.tree.item(item, text="    " * row.depth + marker + row.name, values=values, tags=tags)
+            if row is self.selected:
+                selection = (item,)
+        self.tree.selection_set(selection)
+        self.tree.yview_moveto(0)
+        total = len(self.visible)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.page) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def row_at(self, y):
+        """Returns the row drawn at a y coordinate of the Treeview, or None."""
+        return self.item_rows.get(self.tree.identify_row(y))
+
+    def selection(self):
+        """Returns the selected row, or None."""
+        current = self.tree.selection()
+        if current and current[0] in self.item_rows:
+            self.selected = self.item_rows[current[0]]
+        return self.selected
+
+    def scroll_to(self, offset):
+        """Moves the window so that it starts at the given display index."""
+        offset = max(0, min(offset, len(self.visible) - self.page))
+        if offset != self.offset:
+            self.offset = offset
+            self.repaint()
+
+    def yview(self, *args):
+        """Scrollbar command: maps moveto/scroll requests onto the window offset."""
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self.visible)))
+        elif args[0] == "scroll":
+            step = self.page if args[2] == "pages" else 1
+            self.scroll_to(self.offset + int(args[1]) * step)
+
+    def on_wheel(self, event):
+        """Scrolls the window instead of the Treeview's own items."""
+        self.scroll_to(self.offset + (-3 if event.num == 4 or event.delta > 0 else 3))
+        return "break"
+
+    def on_key(self, event):
+        """Moves the selection through all rows, not only the rendered ones."""
+        if not self.visible:
+            return "break"
+        selected = self.selection()
+        index = self.visible.index(selected) if selected in self.visible else 0
+        moves = {"Up": -1, "Down": 1, "Prior": -self.page, "Next": self.page,
+                 "Home": -len(self.visible), "End": len(self.visible)}
+        index = max(0, min(index + moves[event.keysym], len(self.visible) - 1))
+        self.selected = self.visible[index]
+        self.tree.selection_set(())
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + self.page:
+            self.offset = index - self.page + 1
+        self.repaint()
+        return "break"
+
+    def on_resize(self, event):
+        """Renders as many lines as now fit, less one for the heading."""
+        page = max(1, event.height // self.row_height - 1)
+        if page != self.page:
+            self.page = page
+            self.repaint()
+
+
+class TreeSizeApp(tk.Tk):
+    """A Tkinter application to display directory sizes and file counts in a file explorer-like interface."""
+
+    SEARCH_DELAY_MS = 250  # Typing pause before a search runs
+    SEARCH_LIMIT = 1000
+    
+    def __init__(self):
+        super().__init__()
+        self.title("Cleaner")
+        self.geometry("800x600")
+
+        # Initialize data
+        self.cache = ScanIndex()
+        try:
+            self.store = ScanCache()
+        except (sqlite3.Error, OSError) as e:
+            logging.error(f"Scan cache unavailable: {e}")
+            self.store = None
+        self.sort_by = "size"
+        self.sort_descending = True
+        self.last_path = None  # No initial directory
+        self.scanner = DirectoryScanner(self)
+        self.scan_job = None  # Background scan, drained by poll_scan_events
+        self.scan_workers = None  # None picks a default from the CPU count
+        self.scan_backend = "thread"  # Or "process" to sidestep the GIL
+        self.scan_device_limits = None  # Device kind or st_dev -> listings in flight, over DEVICE_CONCURRENCY
+        self.scan_rows = {}  # Folder name -> row of the running scan
+        self.scan_progress = [0, 0, 0]  # Folders done, bytes and files so far
+        self.scan_resort = False  # Estimates arrived; sort the rows by them on the next tick
+        self.save_thread = None
+        self.watcher = None  # DirectoryWatcher of the shown tree while Watch is on
+        self.export_token = None  # CancelToken of the running export
+        self.comparison = None  # (snapshot id, taken_at) the view is compared with
+        self.deleter = None  # BulkDeleter of the running deletion
+        self.search_after = None  # Pending debounced search
+        self.search_generation = 0  # Bumped per search so stale results are dropped
+        self.search_results = queue.Queue()
+
+        # Configure style
+        self.style = ttk.Style()
+        self.style.theme_use("clam")
+
+        # --- Create GUI Elements ---
+
+        # Top frame for buttons and filters
+        self.top_frame = ttk.Frame(self, padding="5")
+        self.top_frame.pack(side="top", fill="x")
+
+        # Select Directory button
+        self.select_button = ttk.Button(self.top_frame, text="Select Directory", command=self.select_directory)
+        self.select_button.pack(side="left", padx=5)
+
+        # Up button
+        self.up_button = ttk.Button(self.top_frame, text="Up", command=self.navigate_up, state="disabled")
+        self.up_button.pack(side="left", padx=5)
+
+        # Cancel button
+        self.cancel_button = ttk.Button(self.top_frame, text="Cancel", command=self.cancel_scan, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
+
+        # Refresh button
+        self.refresh_button = ttk.Button(self.top_frame, text="Refresh", command=self.refresh_scan)
+        self.refresh_button.pack(side="left", padx=5)
+
+        # Watch toggle: keep the shown tree current as files change
+        self.watch_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.top_frame, text="Watch", variable=self.watch_var,
+                        command=self.toggle_watch).pack(side="left", padx=5)
+
+        # One filesystem toggle: leave mount points under the scanned folder unread
+        self.one_filesystem_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.top_frame, text="One Filesystem",
+                        variable=self.one_filesystem_var).pack(side="left", padx=5)
+
+        # Estimate toggle: show sampled sizes within seconds, then scan the largest folders first
+        self.estimate_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.top_frame, text="Estimate First", variable=self.estimate_var).pack(side="left", padx=5)
+
+        # Export button
+        self.export_button = ttk.Button(self.top_frame, text="Export", command=self.export_to_csv)
+        self.export_button.pack(side="left", padx=5)
+
+        # Snapshot buttons: save the current folder's totals, compare with a saved snapshot
+        self.snapshot_button = ttk.Button(self.top_frame, text="Snapshot", command=self.save_snapshot)
+        self.snapshot_button.pack(side="left", padx=5)
+        self.compare_button = ttk.Button(self.top_frame, text="Compare", command=self.compare_snapshots)
+        self.compare_button.pack(side="left", padx=5)
+
+        # Open in Explorer button
+        self.open_explorer_button = ttk.Button(self.top_frame, text="Open in Explorer", command=self.open_in_explorer)
+        self.open_explorer_button.pack(side="left", padx=5)
+
+        # Delete button: previews, confirms, then deletes the selected folder
+        self.delete_button = ttk.Button(self.top_frame, text="Delete", command=self.delete_selected)
+        self.delete_button.pack(side="left", padx=5)
+
+        # Exclusions button: edit the rules for folders and files scans leave unread
+        ttk.Button(self.top_frame, text="Exclusions", command=self.edit_exclusions).pack(side="left", padx=5)
+
+        # Find Duplicates button
+        self.duplicates_button = ttk.Button(self.top_frame, text="Find Duplicates", command=self.find_duplicates)
+        self.duplicates_button.pack(side="left", padx=5)
+
+        # Progress bar
+        self.progress = ttk.Progressbar(self.top_frame, mode='indeterminate')
+        self.progress.pack(side="left", padx=5)
+        self.progress.pack_forget()
+
+        # Search bar
+        self.search_var = tk.StringVar()
+        self.search_entry = ttk.Entry(self.top_frame, textvariable=self.search_var)
+        self.search_entry.pack(side="left", padx=5)
+        self.search_var.trace("w", self.filter_by_search)
+
+        # Filter frame
+        self.filter_frame = ttk.Frame(self.top_frame)
+        self.filter_frame.pack(side="left", padx=5)
+        ttk.Label(self.filter_frame, text="Min Size (MB):").pack(side="left")
+        self.filter_size = ttk.Entry(self.filter_frame, width=10)
+        self.filter_size.pack(side="left", padx=2)
+        self.filter_size.bind("<Return>", lambda event: self.apply_filter())
+        ttk.Button(self.filter_frame, text="Apply Filter", command=self.apply_filter).pack(side="left")
+
+        # Treeview frame
+        self.tree_frame = ttk.Frame(self, padding="5")
+        self.tree_frame.pack(side="top", fill="both", expand=True)
+
+        # Treeview widget
+        self.tree = ttk.Treeview(self.tree_frame, columns=("size", "files", "change"), displaycolumns=("size", "files"),
+                                 selectmode="browse")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        # Configure Treeview columns
+        self.tree.heading("#0", text="Directory", command=lambda: self.sort_by_column("#0"))
+        self.tree.heading("size", text="Size ▼", command=lambda: self.sort_by_column("size"))
+        self.tree.heading("files", text="Files", command=lambda: self.sort_by_column("files"))
+        self.tree.heading("change", text="Change", command=lambda: self.sort_by_column("change"))
+
+        self.tree.column("#0", width=400, anchor="w", stretch=True)
+        self.tree.column("size", width=150, anchor="e", stretch=True)
+        self.tree.column("files", width=100, anchor="e", stretch=True)
+        self.tree.column("change", width=150, anchor="e", stretch=True)
+
+        # Scrollbar, driven by the virtual view rather than the Treeview's own items
+        self.scrollbar = ttk.Scrollbar(self.tree_frame, orient="vertical")
+        self.scrollbar.pack(side="right", fill="y")
+        self.view = VirtualTreeview(self.tree, self.scrollbar)
+
+        # Bind events
+        self.tree.bind("<Button-1>", self.navigate_into_directory)  # Single-click to navigate
+        self.tree.bind("<Double-1>", self.expand_directory)  # Double-click to expand
+
+        # Status bar
+        self.status_var = tk.StringVar()
+        self.status_bar = ttk.Label(self, textvariable=self.status_var, relief="sunken", anchor="w", padding="2")
+        self.status_bar.pack(side="bottom", fill="x")
+        self.status_var.set("Select a directory to begin.")
+
+        # Largest and oldest files of the current directory, ranked during the scan
+        self.files_panel = ttk.Notebook(self, padding="5")
+        self.files_panel.pack(side="bottom", fill="x")
+        self.largest_tree = self.create_files_tab("Largest Files")
+        self.oldest_tree = self.create_files_tab("Oldest Files")
+        self.search_tree = self.create_files_tab("Search Results", "Type")
+        self.search_tree.bind("<Double-1>", self.open_search_result)
+        self.stats_tree = self.create_stats_tab()
+        self.types_tree = self.create_types_tab()
+        self.stats_path = os.path.join(os.path.dirname(default_cache_path()), "last_scan_stats.json")
+        self.exclude_path = os.path.join(os.path.dirname(default_cache_path()), "exclude_rules.txt")
+        self.log_path = default_log_path()
+        self.load_exclusions()
+
+        # Handle window close for graceful exit
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
+
+    def on_closing(self):
+        """Handles cleanup when the window is closed."""
+        if self.scan_job:
+            self.scan_job.cancel()
+        if self.watcher:
+            self.watcher.stop()
+        if self.export_token:
+            self.export_token.cancel()
+        if self.deleter:
+            self.deleter.cancel()
+        if self.store and not (self.save_thread and self.save_thread.is_alive()):
+            self.store.close()
+        self.destroy()  # Destroy Tkinter window
+        sys.exit(0)  # Ensure complete program exit
+
+    def select_directory(self):
+        """Opens a directory dialog and starts scanning."""
+        path = filedialog.askdirectory()
+        if path:
+            self.show_directory(path)
+
+    def show_directory(self, path):
+        """Shows a directory from the index, the persistent cache or a fresh scan.
+
+        Args:
+            path (str): Directory path to show.
+        """
+        if self.scan_job:
+            self.status_var.set("A scan is running; wait for it or cancel it first.")
+            return
+        if path in self.cache or self.load_from_store(path):
+            self.populate_tree_from_cache(path)
+        else:
+            self.scan_directory(path)
+
+    def load_from_store(self, path):
+        """Loads the saved tree holding path from the persistent cache into the index.
+
+        Args:
+            path (str): Directory path to look for.
+
+        Returns:
+            bool: True if the path is now indexed.
+        """
+        if not self.store:
+            return False
+        fingerprint = rules_fingerprint(self.scanner.exclude)
+        try:
+            found = self.store.find_root(path, fingerprint)
+            if found is None:
+                return False
+            root = self.store.load(found[0])
+            rankings = self.store.load_rankings(found[0])
+        except sqlite3.Error as e:
+            logging.error(f"Error loading scan cache for {path}: {e}")
+            return False
+        if root is None:
+            return False
+        self.cache.insert(found[0], root, rankings, fingerprint=fingerprint)
+        return path in self.cache
+
+    def save_to_store(self, path):
+        """Persists the indexed tree holding path on a background thread.
+
+        Args:
+            path (str): Any path inside the tree to save.
+        """
+        if not self.store:
+            return
+        root_path = self.cache.containing_root(path)
+        if root_path is None:
+            return
+
+        def save(store=self.store, root=self.cache.roots[root_path],
+                 rankings=dict(self.cache.rankings.get(root_path) or {}),
+                 fingerprint=self.cache.fingerprint(root_path), lock=self.cache.lock):
+            try:
+                with lock:
+                    store.save(root_path, root, rankings, fingerprint)
+            except sqlite3.Error as e:
+                logging.error(f"Error saving scan cache for {root_path}: {e}")
+
+        self.save_thread = threading.Thread(target=save, daemon=True)
+        self.save_thread.start()
+
+    def scan_directory(self, path, refresh=False):
+        """Starts a background scan of a directory and streams its rows into the view.
+
+        Args:
+            path (str): Directory path to scan.
+            refresh (bool): Recheck indexed subtrees by mtime instead of
+                reusing them as they are.
+        """
+        if self.scan_job:
+            self.status_var.set("A scan is running; wait for it or cancel it first.")
+            return
+        path = os.path.normpath(path)
+        self.last_path = path
+        self.stop_watching()  # The scan replaces the watched tree
+        self.end_comparison()
+        # Clear previous results
+        self.view.set_rows([])
+        self.scan_rows.clear()
+        self.scan_progress = [0, 0, 0]
+        self.scan_resort = False
+        self.show_file_ranking(path)
+        self.show_file_types(path)
+
+        self.cancel_button.configure(state="normal")
+        self.up_button.configure(state="disabled")
+        self.select_button.configure(state="disabled")
+
+        self.status_var.set(f"Scanning: {path}...")
+        self.progress.pack(side="left", padx=5)
+        self.progress.start()
+
+        try:
+            os.makedirs(os.path.dirname(self.stats_path), exist_ok=True)
+        except OSError as e:
+            logging.error(f"Cannot create {os.path.dirname(self.stats_path)}: {e}")
+        self.scan_job = ScanJob(self.scanner, path, index=self.cache, refresh=refresh,
+                                max_workers=self.scan_workers, backend=self.scan_backend, stats_path=self.stats_path,
+                                store=self.store, one_filesystem=self.one_filesystem_var.get(),
+                                device_limits=self.scan_device_limits, estimate=self.estimate_var.get())
+        self.scan_job.start()
+        self.after(100, self.poll_scan_events)
+
+    def poll_scan_events(self):
+        """Drains the running scan's event queue and reschedules itself."""
+        job = self.scan_job
+        if job is None:
+            return
+        try:
+            for _ in range(1000):  # Bound the work done per tick
+                self.handle_scan_event(job, job.events.get_nowait())
+                if self.scan_job is not job:
+                    return
+        except queue.Empty:
+            pass
+        if self.scan_resort:
+            self.scan_resort = False
+            self.view.sort(None)
+        else:
+            self.view.refresh()  # One repaint for everything drained this tick
+        done, total_size, total_files = self.scan_progress
+        self.status_var.set(f"Scanning: {job.path}... {done}/{len(self.scan_rows)} folders done, "
+                            f"{self.format_size(total_size)} in {total_files:,} files so far "
+                            f"({self.scanner.dirs_scanned:,} folders read)")
+        if self.files_panel.index("current") == self.files_panel.index(self.stats_tree.master):
+            self.show_scan_stats()
+        self.after(100, self.poll_scan_events)
+
+    def handle_scan_event(self, job, event):
+        """Applies one scan event to the view.
+
+        Args:
+            job (ScanJob): Scan that produced the event.
+            event (tuple): Event tuple as documented on ScanJob.
+        """
+        kind = event[0]
+        if kind == "resumed":
+            self.status_var.set(f"Scanning: {job.path}... resuming from {event[1]:,} saved folders")
+        elif kind == "entries":
+            rows = []
+            for name, cached in event[1]:
+                if cached is not None:
+                    row = Row(name, cached.size, cached.files, cached)
+                    self.count_scan_progress(cached)
+                else:
+                    row = Row(name, pending=True)
+                self.scan_rows[name] = row
+                rows.append(row)
+            self.view.append(rows)
+        elif kind == "estimate":
+            _, name, estimate = event
+            row = self.scan_rows.get(name)
+            if row is not None and row.pending:
+                row.size, row.files, row.estimate = estimate.size, estimate.files, estimate
+                self.scan_resort = True
+        elif kind == "dir":
+            _, name, child = event
+            row = self.scan_rows.get(name)
+            self.count_scan_progress(child)
+            if row is not None:
+                row.size, row.files, row.node, row.pending = child.size, child.files, child, False
+                row.estimate = None
+        elif kind == "done":
+            root = event[1]
+            if not job.token.cancelled:
+                self.cache.insert(job.path, root, job.rankings, job.names, job.fingerprint)
+                self.save_to_store(job.path)
+                self.show_file_ranking(job.path)
+                self.show_file_types(job.path)
+            stats = self.scanner.stats
+            skipped = f" {stats.unreadable_dirs:,} folders unreadable." if stats.unreadable_dirs else ""
+            self.status_var.set(f"Scan complete in {time.time() - job.start_time:.2f} seconds. "
+                                f"Total: {self.format_size(root.size)}, {root.files:,} files.{skipped} "
+                                f"Current: {job.path}")
+            self.show_scan_stats()
+            self.finish_scan()
+        elif kind == "cancelled":
+            saved = " Progress saved; scanning it again resumes." if self.store is not None else ""
+            self.status_var.set(f"Scan cancelled.{saved}")
+            self.finish_scan()
+        elif kind == "error":
+            self.status_var.set(f"Error: {event[1]}. Current: {job.path}")
+            self.finish_scan()
+
+    def count_scan_progress(self, child):
+        """Adds a completed top-level folder to the running totals."""
+        self.scan_progress[0] += 1
+        self.scan_progress[1] += child.size
+        self.scan_progress[2] += child.files
+
+    def finish_scan(self):
+        """Restores the controls once the running scan has ended."""
+        self.scan_job = None
+        self.scan_rows.clear()
+        self.progress.stop()
+        self.progress.pack_forget()
+        self.cancel_button.configure(state="normal" if self.export_token or self.deleter else "disabled")
+        self.up_button.configure(state="normal")
+        self.select_button.configure(state="normal")
+        self.sort_by_column("size", initial_sort=True)
+        if self.watch_var.get():
+            self.start_watching()
+
+    def populate_tree_from_cache(self, path):
+        """Populates the Treeview from the scan index.
+
+        Args:
+            path (str): Directory path to load from the index.
+        """
+        path = os.path.normpath(path)
+        self.last_path = path
+        self.end_comparison()
+        self.view.set_rows([Row(child.name, child.size, child.files, child)
+                            for child in self.cache.lookup(path).children or ()])
+        self.sort_by_column("size", initial_sort=True)
+        self.show_file_ranking(path)
+        self.show_file_types(path)
+        self.status_var.set(f"Loaded from cache: {path}")
+        if self.watch_var.get():
+            self.start_watching()
+
+    def toggle_watch(self):
+        """Starts or stops watching the shown tree when Watch is toggled."""
+        if self.watch_var.get():
+            self.start_watching()
+        else:
+            self.stop_watching()
+
+    def start_watching(self):
+        """Watches the indexed tree holding the current directory."""
+        root_path = self.cache.containing_root(self.last_path) if self.last_path else None
+        if self.watcher and self.watcher.path == root_path:
+            return
+        self.stop_watching()
+        if root_path is None or self.scan_job:
+            return  # Watching starts once a scan has finished
+        self.watcher = DirectoryWatcher(self.cache, root_path, scanner=self.background_scanner())
+        self.watcher.start()
+        self.after(500, self.poll_watch)
+
+    def stop_watching(self):
+        """Stops the watcher and saves the tree if it changed."""
+        watcher = self.watcher
+        if watcher is None:
+            return
+        self.watcher = None
+        watcher.stop()
+        if watcher.applied:
+            self.save_to_store(watcher.path)
+
+    def poll_watch(self):
+        """Applies the watcher's changes to the index and the visible rows."""
+        watcher = self.watcher
+        if watcher is None:
+            return
+        changed = set()  # Folders whose subfolders were added or removed
+        applied = 0
+        # Background exports, snapshots and searches read the tree under the
+        # lock; the changes wait for the next tick rather than freeze the window
+        if self.cache.lock.acquire(blocking=False):
+            try:
+                for _ in range(1000):  # Bound the work done per tick
+                    change = watcher.changes.get_nowait()
+                    node = watcher.apply(change)
+                    if node is not None:
+                        applied += 1
+                        if change[0] == "listing":
+                            changed.add(node)
+            except queue.Empty:
+                pass
+            finally:
+                self.cache.lock.release()
+        if applied:
+            if self.comparison is None:
+                self.show_watch_changes(changed)
+            self.show_file_types(self.last_path)
+            node = self.cache.lookup(self.last_path)
+            if node is not None:
+                self.status_var.set(f"Updated {time.strftime('%H:%M:%S')}: {self.format_size(node.size)}, "
+                                    f"{node.files:,} files in {self.last_path} (watching {watcher.watched:,} "
+                                    f"folders, polling {watcher.polled:,})")
+        self.after(500, self.poll_watch)
+
+    def show_watch_changes(self, changed):
+        """Refreshes the numbers of every row and the rows of changed folders.
+
+        Args:
+            changed (set): DirNodes whose subfolders were added or removed.
+        """
+        def child_rows(node, parent):
+            return [Row(child.name, child.size, child.files, child, parent) for child in node.children or ()]
+
+        current = self.cache.lookup(self.last_path)
+        if current is None:
+            return
+        if current in changed:
+            self.view.rows = child_rows(current, None)
+        stack = list(self.view.rows)
+        while stack:
+            row = stack.pop()
+            if row.node is None:
+                continue
+            row.size, row.files = row.node.size, row.node.files
+            if row.children is not None:
+                if row.node in changed:
+                    row.children = child_rows(row.node, row)
+                stack.extend(row.children)
+        self.view.sort(None)
+
+    def create_files_tab(self, title, last_heading="Modified"):
+        """Adds a tab listing files to the files panel.
+
+        Args:
+            title (str): Tab title.
+            last_heading (str): Heading of the column after the size.
+
+        Returns:
+            ttk.Treeview: The tab's file list.
+        """
+        frame = ttk.Frame(self.files_panel)
+        tree = ttk.Treeview(frame, columns=("size", "modified"), height=6, selectmode="browse")
+        tree.heading("#0", text="File")
+        tree.heading("size", text="Size")
+        tree.heading("modified", text=last_heading)
+        tree.column("#0", width=500, anchor="w", stretch=True)
+        tree.column("size", width=120, anchor="e", stretch=True)
+        tree.column("modified", width=130, anchor="e", stretch=True)
+        tree.pack(side="left", fill="both", expand=True)
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        scrollbar.pack(side="right", fill="y")
+        tree.configure(yscrollcommand=scrollbar.set)
+        self.files_panel.add(frame, text=title)
+        return tree
+
+    def create_stats_tab(self):
+        """Adds the tab showing the instrumentation of the latest scan.
+
+        Returns:
+            ttk.Treeview: The tab's figure list.
+        """
+        frame = ttk.Frame(self.files_panel)
+        tree = ttk.Treeview(frame, columns=("value",), height=6, selectmode="browse")
+        tree.heading("#0", text="Scan Stats")
+        tree.heading("value", text="Value")
+        tree.column("#0", width=500, anchor="w", stretch=True)
+        tree.column("value", width=250, anchor="e", stretch=True)
+        tree.pack(side="left", fill="both", expand=True)
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        scrollbar.pack(side="right", fill="y")
+        tree.configure(yscrollcommand=scrollbar.set)
+        self.files_panel.add(frame, text="Scan Stats")
+        return tree
+
+    def show_scan_stats(self):
+        """Fills the Scan Stats tab from the scanner's live figures."""
+        stats = self.scanner.stats.snapshot()
+        tree = self.stats_tree
+        opened = {tree.item(item, "text") for item in tree.get_children() if tree.item(item, "open")}
+        tree.delete(*tree.get_children())
+        rate = stats["entries_per_second"]
+        for label, value in (("Elapsed", f"{stats['elapsed_seconds']:.1f} s"),
+                             ("Folders listed", f"{stats['dirs']:,}"),
+                             ("Entries", f"{stats['entries']:,}"),
+                             ("Entries per second", f"{rate:,.0f}" if rate is not None else ""),
+                             ("Unreadable folders", f"{stats['unreadable_dirs']:,}"),
+                             ("Skipped mount points", f"{stats['skipped_mount_points']:,}"),
+                             ("Unaccounted space", self.format_size(stats["unaccounted_bytes"]))):
+            tree.insert("", "end", text=label, values=(value,))
+        groups = (
+            ("Errors", sum(stats["errors"].values()),
+             [(f"{name}", f"{count:,}") for name, count in sorted(stats["errors"].items())]
+             + [(f"{error['path']} ({error['error']})", error["message"]) for error in stats["error_paths"][:100]]),
+            ("Slowest folders", len(stats["slowest_dirs"]),
+             [(entry["path"], f"{entry['seconds'] * 1000:.1f} ms, {entry['entries']:,} entries")
+              for entry in stats["slowest_dirs"][:20]]),
+            ("Filesystems", len(stats["devices"]),
+             [(device["path"], f"{device['kind']}, {device['seconds']:.1f} s, {device['dirs']:,} folders")
+              for device in sorted(stats["devices"], key=lambda device: -device["seconds"])]),
+        )
+        for label, count, rows in groups:
+            group = tree.insert("", "end", text=label, values=(f"{count:,}",), open=label in opened)
+            for text, value in rows:
+                tree.insert(group, "end", text=text, values=(value,))
+
+    def create_types_tab(self):
+        """Adds the tab breaking the current directory down by file type and age.
+
+        Returns:
+            ttk.Treeview: The tab's breakdown list.
+        """
+        frame = ttk.Frame(self.files_panel)
+        tree = ttk.Treeview(frame, columns=("size", "files", "share"), height=6, selectmode="browse")
+        tree.heading("#0", text="File Types")
+        tree.heading("size", text="Size")
+        tree.heading("files", text="Files")
+        tree.heading("share", text="Share")
+        tree.column("#0", width=400, anchor="w", stretch=True)
+        tree.column("size", width=120, anchor="e", stretch=True)
+        tree.column("files", width=100, anchor="e", stretch=True)
+        tree.column("share", width=80, anchor="e", stretch=True)
+        tree.pack(side="left", fill="both", expand=True)
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        scrollbar.pack(side="right", fill="y")
+        tree.configure(yscrollcommand=scrollbar.set)
+        self.files_panel.add(frame, text="File Types")
+        return tree
+
+    def show_file_types(self, path):
+        """Shows how the bytes below path split by extension and by age.
+
+        Args:
+            path (str): Indexed directory path.
+        """
+        node = self.cache.lookup(path)
+        tree = self.types_tree
+        opened = {tree.item(item, "text"): tree.item(item, "open") for item in tree.get_children()}
+        tree.delete(*tree.get_children())
+        if node is None:
+            return
+        ages, extensions = type_breakdown(node.types)
+
+        def share(size):
+            return f"{size / node.size:.1%}" if node.size else ""
+
+        group = tree.insert("", "end", text="By extension", values=("", f"{len(extensions):,} kinds", ""),
+                            open=opened.get("By extension", True))
+        for extension, size, files in extensions:
+            tree.insert(group, "end", text=extension or "(no extension)",
+                        values=(self.format_size(size), f"{files:,}", share(size)))
+        group = tree.insert("", "end", text="By age", values=("", "", ""), open=opened.get("By age", True))
+        for label, size in ages:
+            tree.insert(group, "end", text=label, values=(self.format_size(size), "", share(size)))
+
+    def show_file_ranking(self, path):
+        """Shows the largest and oldest files below path in the files panel.
+
+        Args:
+            path (str): Indexed directory path.
+        """
+        ranking, exact = self.cache.file_ranking(path)
+        suffix = "" if exact else " (partial)"
+        for index, (tree, title, files) in enumerate((
+                (self.largest_tree, "Largest Files", ranking.largest_files() if ranking else []),
+                (self.oldest_tree, "Oldest Files", ranking.oldest_files() if ranking else []))):
+            tree.delete(*tree.get_children())
+            for file_path, size, mtime in files:
+                tree.insert("", "end", text=file_path, values=(
+                    self.format_size(size), time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime))))
+            self.files_panel.tab(index, text=title + suffix)
+
+    def sort_by_column(self, col, initial_sort=False):
+        """Sorts the rows by a column; the view repaints once.
+
+        Args:
+            col (str): Column identifier.
+            initial_sort (bool): Whether this is the initial sort after scanning.
+        """
+        if not initial_sort and col == self.sort_by:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_descending = True
+        self.sort_by = col
+        
+        # Update heading text
+        self.tree.heading("size", text="Size")
+        self.tree.heading("#0", text="Directory")
+        self.tree.heading("files", text="Files")
+        self.tree.heading("change", text="Change")
+        arrow = "▼" if self.sort_descending else "▲"
+        self.tree.heading(col, text=f"{col.capitalize() if col != '#0' else 'Directory'} {arrow}")
+
+        self.view.sort(col, self.sort_descending)
+
+    def expand_directory(self, event):
+        """Expands or collapses a directory's subdirectories on double-click.
+
+        Args:
+            event: Tkinter event object.
+        """
+        row = self.view.row_at(event.y)
+        if row is None or self.tree.identify_element(event.x, event.y) not in ("image", "text"):
+            return
+        if self.scan_job:
+            return
+        if row.children is not None:
+            self.view.collapse(row)
+            return
+        if row.change is not None and row.change.status == "removed":
+            return
+        full_path = os.path.join(self.last_path, *row.parts())
+        
+        try:
+            # Look the subdirectories up in the index; only unindexed paths hit the disk
+            dir_node = self.cache.lookup(full_path)
+            if dir_node is None:
+                dir_node = self.scanner.scan_tree(full_path)
+                self.cache.insert(full_path, dir_node, fingerprint=rules_fingerprint(self.scanner.exclude))
+                self.save_to_store(full_path)
+            row.node = dir_node
+            self.view.expand(row, [Row(child.name, child.size, child.files, child, row)
+                                   for child in dir_node.children or ()])
+        except Exception as e:
+            logging.error(f"Error expanding directory {full_path}: {e}")
+            self.status_var.set(f"Error expanding directory: {e}")
+
+    def navigate_into_directory(self, event):
+        """Navigates into a directory on single-click.
+
+        Args:
+            event: Tkinter event object.
+        """
+        row = self.view.row_at(event.y)
+        if row is None or self.tree.identify_element(event.x, event.y) not in ("image", "text"):
+            return
+        full_path = os.path.join(self.last_path, *row.parts())
+        
+        # Check if directory exists and is accessible
+        if os.path.isdir(full_path):
+            self.show_directory(full_path)
+
+    def navigate_up(self):
+        """Navigates to the parent directory."""
+        if self.last_path:
+            parent_path = os.path.dirname(self.last_path)
+            if os.path.isdir(parent_path) and parent_path != self.last_path:  # Avoid infinite loop at root
+                self.show_directory(parent_path)
+            else:
+                self.status_var.set("Cannot navigate up: already at root.")
+        else:
+            self.status_var.set("No directory selected.")
+
+    def open_in_explorer(self):
+        """Opens the selected directory in the system's file explorer."""
+        row = self.view.selection()
+        if row is None:
+            self.status_var.set("No directory selected.")
+            return
+        full_path = os.path.join(self.last_path, *row.parts())
+        
+        try:
+            if platform.system() == "Windows":
+                os.startfile(full_path)
+            elif platform.system() == "Linux":
+                subprocess.run(["xdg-open", full_path], check=True)
+            elif platform.system() == "Darwin":  # macOS
+                subprocess.run(["open", full_path], check=True)
+            else:
+                self.status_var.set("Unsupported platform for opening directory.")
+                return
+            self.status_var.set(f"Opened {full_path} in file explorer.")
+        except Exception as e:
+            logging.error(f"Error opening directory {full_path}: {e}")
+            self.status_var.set(f"Error opening directory: {e}")
+
+    def find_duplicates(self):
+        """Opens a duplicate-file view for the current directory."""
+        if not self.last_path:
+            self.status_var.set("No directory selected.")
+            return
+        DuplicatesWindow(self, self.last_path)
+
+    def cancel_scan(self):
+        """Cancels the current scan or export."""
+        if self.scan_job:
+            self.scan_job.cancel()
+            self.status_var.set("Cancelling scan...")
+        if self.export_token:
+            self.export_token.cancel()
+            self.status_var.set("Cancelling export...")
+        if self.deleter:
+            self.deleter.cancel()
+            self.status_var.set("Cancelling deletion...")
+        self.cancel_button.configure(state="disabled")
+
+    def refresh_scan(self):
+        """Refreshes the scan for the current directory."""
+        if self.last_path:
+            # Only directories whose mtime changed are read again
+            self.scan_directory(self.last_path, refresh=True)
+        else:
+            self.status_var.set("No directory selected.")
+
+    def export_to_csv(self):
+        """Exports the current directory and every folder below it on a background thread.
+
+        Each folder becomes one record (path, depth, size, files, mtime),
+        followed by the largest and oldest files; while comparing with a
+        snapshot, every changed folder is exported instead, with its old and
+        new totals. The format follows the chosen file name: .csv or .jsonl,
+        gzip-compressed when it ends in .gz.
+        """
+        if self.export_token:
+            self.status_var.set("An export is running; wait for it or cancel it first.")
+            return
+        node = self.cache.lookup(self.last_path) if self.last_path and not self.scan_job else None
+        if node is None:
+            self.status_var.set("Nothing to export yet; scan a directory first.")
+            return
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("Compressed CSV files", "*.csv.gz"),
+                       ("JSON Lines files", "*.jsonl"), ("Compressed JSON Lines files", "*.jsonl.gz")])
+        if not file_path:
+            return
+        fmt = "jsonl" if file_path.endswith((".jsonl", ".jsonl.gz")) else "csv"
+        path = self.last_path
+        ranking = self.cache.file_ranking(path)[0]
+        comparison = self.comparison
+        store = self.store
+        lock = self.cache.lock
+        token = self.export_token = CancelToken()
+        progress = [0]
+        result = queue.Queue()
+
+        def on_progress(count):
+            progress[0] = count
+
+        def export():
+            try:
+                with lock:
+                    if comparison is not None:
+                        changes = diff_snapshots(store.snapshot_rows(comparison[0]), tree_rows(node), path)
+                        count = export_changes(changes, file_path, fmt, token=token, on_progress=on_progress)
+                    else:
+                        count = export_tree(node, file_path, fmt, path=path, ranking=ranking, token=token,
+                                            on_progress=on_progress)
+                result.put((count, None))
+            except (OSError, sqlite3.Error) as e:
+                logging.error(f"Error exporting to {file_path}: {e}")
+                result.put((None, e))
+
+        self.cancel_button.configure(state="normal")
+        self.status_var.set(f"Exporting {path} to {file_path}...")
+        threading.Thread(target=export, daemon=True).start()
+        self.after(200, self.poll_export, file_path, progress, result)
+
+    def poll_export(self, file_path, progress, result):
+        """Shows the progress of the running export and its outcome."""
+        try:
+            count, error = result.get_nowait()
+        except queue.Empty:
+            self.status_var.set(f"Exporting to {file_path}... {progress[0]:,} records")
+            self.after(200, self.poll_export, file_path, progress, result)
+            return
+        self.export_token = None
+        if not self.scan_job and not self.deleter:
+            self.cancel_button.configure(state="disabled")
+        if error is not None:
+            self.status_var.set(f"Error exporting to {file_path}: {error}")
+        elif count is None:
+            self.status_var.set("Export cancelled.")
+        else:
+            self.status_var.set(f"Exported {count:,} records to {file_path}")
+
+    def save_snapshot(self):
+        """Saves the totals of the current directory's tree as a snapshot on a background thread."""
+        node = self.cache.lookup(self.last_path) if self.last_path and not self.scan_job else None
+        if node is None or not self.store:
+            self.status_var.set("Nothing to snapshot yet; scan a directory first.")
+            return
+        path = self.last_path
+        result = queue.Queue()
+
+        def save(store=self.store, lock=self.cache.lock):
+            try:
+                with lock:
+                    store.save_snapshot(path, iter_tree(node, path))
+                result.put(None)
+            except sqlite3.Error as e:
+                logging.error(f"Error saving snapshot of {path}: {e}")
+                result.put(e)
+
+        self.status_var.set(f"Saving snapshot of {path}...")
+        threading.Thread(target=save, daemon=True).start()
+        self.after(100, self.poll_snapshot, path, node, result)
+
+    def poll_snapshot(self, path, node, result):
+        """Reports the outcome of a snapshot once it is saved."""
+        try:
+            error = result.get_nowait()
+        except queue.Empty:
+            self.after(100, self.poll_snapshot, path, node, result)
+            return
+        if error is not None:
+            self.status_var.set(f"Error saving snapshot: {error}")
+        else:
+            self.status_var.set(f"Saved snapshot of {path}: {self.format_size(node.size)}, {node.files:,} files")
+
+    def compare_snapshots(self):
+        """Lets the user pick a snapshot of the current directory to compare with."""
+        if self.comparison is not None:
+            self.populate_tree_from_cache(self.last_path)
+            return
+        if self.scan_job or not self.last_path or self.last_path not in self.cache or not self.store:
+            self.status_var.set("Scan a directory first.")
+            return
+        try:
+            snapshots = self.store.snapshots(self.last_path)
+        except sqlite3.Error as e:
+            logging.error(f"Error listing snapshots of {self.last_path}: {e}")
+            snapshots = []
+        if not snapshots:
+            self.status_var.set(f"No snapshots of {self.last_path}; save one with Snapshot first.")
+            return
+        SnapshotsWindow(self, self.last_path, snapshots)
+
+    def run_comparison(self, path, snapshot):
+        """Diffs a snapshot against the indexed tree on a background thread.
+
+        Args:
+            path (str): Directory the snapshot was taken of.
+            snapshot (tuple): (id, taken_at, size, files) as listed by ScanCache.snapshots.
+        """
+        node = self.cache.lookup(path)
+        if node is None or self.scan_job or path != self.last_path:
+            return
+        result = queue.Queue()
+
+        def compare(store=self.store, lock=self.cache.lock):
+            try:
+                with lock:
+                    changes = diff_snapshots(store.snapshot_rows(snapshot[0]), tree_rows(node), path)
+                    outcome = rank_changes(changes)
+                result.put(outcome)
+            except sqlite3.Error as e:
+                logging.error(f"Error comparing {path} with snapshot {snapshot[0]}: {e}")
+                result.put(e)
+
+        self.status_var.set(f"Comparing {path} with its snapshot...")
+        threading.Thread(target=compare, daemon=True).start()
+        self.after(100, self.poll_comparison, path, snapshot, result)
+
+    def poll_comparison(self, path, snapshot, result):
+        """Shows the result of a comparison once it is ready, unless the view moved on."""
+        try:
+            outcome = result.get_nowait()
+        except queue.Empty:
+            self.after(100, self.poll_comparison, path, snapshot, result)
+            return
+        if path != self.last_path or self.scan_job:
+            return
+        if isinstance(outcome, Exception):
+            self.status_var.set(f"Error comparing with snapshot: {outcome}")
+            return
+        self.show_comparison(path, snapshot, *outcome)
+
+    def show_comparison(self, path, snapshot, changes, counts):
+        """Lists the changed folders in the view with a Change column, largest change first.
+
+        Args:
+            path (str): Directory that was compared.
+            snapshot (tuple): Snapshot it was compared with.
+            changes (list): SnapshotChange records ranked by rank_changes.
+            counts (dict): Number of changes of each status.
+        """
+        self.comparison = snapshot[:2]
+        prefix = path if path.endswith(os.sep) else path + os.sep
+        rows = []
+        for change in changes:
+            name = change.path[len(prefix):] if change.path != path else os.curdir
+            node = self.cache.lookup(change.path) if change.status != "removed" else None
+            rows.append(Row(name, change.new_size, change.new_files, node, change=change))
+        self.tree.configure(displaycolumns=("size", "files", "change"))
+        self.compare_button.configure(text="End Compare")
+        self.view.set_rows(rows)
+        self.sort_by_column("change", initial_sort=True)
+        node = self.cache.lookup(path)
+        delta = node.size - snapshot[2]
+        taken = time.strftime("%Y-%m-%d %H:%M", time.localtime(snapshot[1]))
+        shown = f" Showing the {len(changes):,} largest." if sum(counts.values()) > len(changes) else ""
+        self.status_var.set(f"Since {taken}: {'-' if delta < 0 else '+'}{self.format_size(abs(delta))}; "
+                            f"{counts['added']:,} folders added, {counts['removed']:,} removed, "
+                            f"{counts['resized']:,} resized.{shown}")
+
+    def end_comparison(self):
+        """Returns the view to plain folder listings."""
+        if self.comparison is None:
+            return
+        self.comparison = None
+        self.tree.configure(displaycolumns=("size", "files"))
+        self.compare_button.configure(text="Compare")
+
+    def delete_selected(self):
+        """Deletes the selected folder after a dry run and a confirmation.
+
+        The dry run walks the folder on a background thread to count what
+        will go; the deletion itself runs there too, and the reclaimed bytes
+        are then taken off the indexed totals of every folder above it
+        instead of rescanning. Only what a partial deletion leaves behind is
+        rescanned, and replaces the folder in the index.
+        """
+        if self.scan_job or self.deleter:
+            self.status_var.set("Wait for the running scan or deletion to finish, or cancel it first.")
+            return
+        row = self.view.selection()
+        if row is None or self.last_path is None:
+            self.status_var.set("No directory selected.")
+            return
+        if row.change is not None and row.change.status == "removed":
+            self.status_var.set("That folder no longer exists.")
+            return
+        path = os.path.normpath(os.path.join(self.last_path, *row.parts()))
+        if path == self.last_path:
+            self.status_var.set("Cannot delete the folder being shown; go up first.")
+            return
+        self.stop_watching()  # The deletion updates the index itself
+        deleter = self.deleter = BulkDeleter([path])
+        result = queue.Queue()
+        threading.Thread(target=lambda: result.put(deleter.preview()), daemon=True).start()
+        self.cancel_button.configure(state="normal")
+        self.status_var.set(f"Counting what deleting {path} removes...")
+        self.after(100, self.poll_delete, path, result, True)
+
+    def run_delete(self, path):
+        """Runs the confirmed deletion on a background thread."""
+        deleter = self.deleter
+        scanner = self.background_scanner()
+        result = queue.Queue()
+
+        def delete():
+            outcome = deleter.delete()
+            # Whatever is left of a partly deleted folder is rescanned; it is usually little
+            leftovers = {} if path in outcome.removed else {path: scanner.scan_tree(path)}
+            result.put((outcome, leftovers))
+
+        threading.Thread(target=delete, daemon=True).start()
+        self.cancel_button.configure(state="normal")
+        self.after(100, self.poll_delete, path, result, False)
+
+    def poll_delete(self, path, result, previewing):
+        """Shows deletion progress; asks for confirmation after the dry run and updates the index after the run."""
+        deleter = self.deleter
+        try:
+            outcome = result.get_nowait()
+        except queue.Empty:
+            verb = "Counting" if previewing else "Deleting"
+            self.status_var.set(f"{verb} {path}... {deleter.files:,} files, {self.format_size(deleter.size)}")
+            self.after(100, self.poll_delete, path, result, previewing)
+            return
+        if previewing:
+            if outcome.cancelled or not messagebox.askyesno("Delete", self.describe_deletion(path, outcome)):
+                self.end_delete("Deletion cancelled; nothing was deleted.")
+                return
+            self.status_var.set(f"Deleting {path}...")
+            self.run_delete(path)
+            return
+        outcome, leftovers = outcome
+        if path in outcome.removed:
+            self.cache.remove(path)
+        else:
+            self.cache.replace(path, leftovers[path], fingerprint=rules_fingerprint(self.scanner.exclude))
+        self.save_to_store(path)
+        if self.last_path in self.cache:
+            self.populate_tree_from_cache(self.last_path)
+        errors = f" {outcome.errors:,} entries could not be deleted; see {self.log_path}." if outcome.errors else ""
+        stopped = " Cancelled part way." if outcome.cancelled else ""
+        self.end_delete(f"Deleted {outcome.files:,} files in {outcome.dirs:,} folders, "
+                        f"{self.format_size(outcome.size)} reclaimed.{stopped}{errors}")
+
+    def describe_deletion(self, path, preview):
+        """Returns the confirmation text for a dry run's totals."""
+        text = (f"Permanently delete {path}?\n\n{preview.files:,} files in {preview.dirs:,} folders, "
+                f"{self.format_size(preview.size)}, will be removed. This cannot be undone.")
+        if preview.errors:
+            text += f"\n\n{preview.errors:,} entries cannot be read; the folders holding them will be kept."
+        return text
+
+    def end_delete(self, message):
+        """Restores the controls once a deletion has ended."""
+        self.deleter = None
+        if not self.scan_job and not self.export_token:
+            self.cancel_button.configure(state="disabled")
+        self.status_var.set(message)
+        if self.watch_var.get():
+            self.start_watching()
+
+    def apply_filter(self):
+        """Hides directories below a minimum size; clearing the field shows them again.
+
+        The filter only hides rows of the scanned tree, so changing it never reads the disk.
+        """
+        try:
+            min_size_mb = float(self.filter_size.get()) * 1024 * 1024
+        except ValueError:
+            min_size_mb = 0
+        self.view.set_filter((lambda row: row.size >= min_size_mb) if min_size_mb > 0 else None)
+        if min_size_mb > 0:
+            self.status_var.set(f"Filtered directories smaller than {min_size_mb/1024/1024:.2f} MB")
+        else:
+            self.status_var.set("Showing all directories")
+
+    def background_scanner(self):
+        """Returns a fresh DirectoryScanner with the exclusion rules, for work beside the main scan."""
+        scanner = DirectoryScanner()
+        scanner.exclude = self.scanner.exclude
+        return scanner
+
+    def load_exclusions(self):
+        """Reads the saved exclusion rules into the scanner."""
+        try:
+            self.scanner.exclude = ExcludeRules.load(self.exclude_path) or None
+        except FileNotFoundError:
+            self.scanner.exclude = None
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading exclusion rules from {self.exclude_path}: {e}")
+
+    def edit_exclusions(self):
+        """Opens the exclusion rules editor on the saved rules, comments included."""
+        try:
+            with open(self.exclude_path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            lines = self.scanner.exclude.patterns if self.scanner.exclude is not None else []
+        ExclusionsWindow(self, lines)
+
+    def save_exclusions(self, lines):
+        """Saves new exclusion rules and rescans the current directory with them.
+
+        The in-memory scan index is dropped, since its trees were scanned with
+        the old rules. Trees and checkpoints in the scan cache are kept but
+        recorded under the old rules' fingerprint, so they are only loaded or
+        resumed again if the rules are changed back.
+
+        Args:
+            lines (list): Rule lines as typed, comments included.
+
+        Returns:
+            bool: False if a rule is invalid or the rules could not be saved.
+        """
+        try:
+            rules = ExcludeRules(lines)
+        except ValueError as e:
+            messagebox.showerror("Exclusions", str(e), parent=self)
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.exclude_path), exist_ok=True)
+            with open(self.exclude_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines).strip() + "\n")
+        except OSError as e:
+            logging.error(f"Error saving exclusion rules to {self.exclude_path}: {e}")
+            messagebox.showerror("Exclusions", f"Cannot save {self.exclude_path}: {e}", parent=self)
+            return False
+        self.scanner.exclude = rules or None
+        self.stop_watching()
+        self.cache.clear()
+        if self.scan_job is None and self.last_path:
+            self.scan_directory(self.last_path)
+        else:
+            self.status_var.set(f"Saved {len(rules):,} exclusion rules; they apply from the next scan")
+        return True
+
+    def filter_by_search(self, *args):
+        """Greys out non-matching rows and schedules a search of the whole tree.
+
+        The search waits for a pause in typing, so keystrokes never run it.
+        """
+        search_term = self.search_var.get().lower()
+        self.view.set_highlight((lambda row: search_term in row.name.lower()) if search_term else None)
+        if self.search_after is not None:
+            self.after_cancel(self.search_after)
+        self.search_after = self.after(self.SEARCH_DELAY_MS, self.run_search)
+
+    def run_search(self):
+        """Searches the names below the current directory on a background thread."""
+        self.search_after = None
+        self.search_generation += 1
+        generation = self.search_generation
+        term = self.search_var.get().strip()
+        self.search_tree.delete(*self.search_tree.get_children())
+        names, node = self.cache.name_index(self.last_path) if self.last_path else (None, None)
+        if not term or names is None:
+            return
+
+        def search(lock=self.cache.lock):
+            start = time.time()
+            try:
+                with lock:
+                    results = names.search(term, node, self.SEARCH_LIMIT)
+            except Exception as e:
+                logging.error(f"Error searching for {term}: {e}")
+                results = []
+            self.search_results.put((generation, term, results, time.time() - start))
+
+        threading.Thread(target=search, daemon=True).start()
+        self.after(50, self.poll_search, generation)
+
+    def poll_search(self, generation):
+        """Shows the results of the latest search once they arrive."""
+        try:
+            while True:
+                result = self.search_results.get_nowait()
+                if result[0] == self.search_generation:
+                    self.show_search_results(*result[1:])
+                    return
+        except queue.Empty:
+            pass
+        if generation == self.search_generation:
+            self.after(50, self.poll_search, generation)
+
+    def show_search_results(self, term, results, elapsed):
+        """Fills the Search Results tab.
+
+        Args:
+            term (str): Query that was searched.
+            results (list): (path, size, is_dir) tuples.
+            elapsed (float): Search time in seconds.
+        """
+        for path, size, is_dir in results:
+            self.search_tree.insert("", "end", text=path,
+                                    values=(self.format_size(size), "Folder" if is_dir else "File"))
+        self.files_panel.select(2)
+        more = f" (first {self.SEARCH_LIMIT:,})" if len(results) >= self.SEARCH_LIMIT else ""
+        self.status_var.set(f"{len(results):,} matches for '{term}'{more} in {elapsed * 1000:.0f} ms")
+
+    def open_search_result(self, event):
+        """Shows the folder of a search result on double-click.
+
+        Args:
+            event: Tkinter event object.
+        """
+        item = self.search_tree.identify_row(event.y)
+        if not item:
+            return
+        path = self.search_tree.item(item, "text")
+        if self.search_tree.set(item, "modified") != "Folder":
+            path = os.path.dirname(path)
+        if os.path.isdir(path):
+            self.show_directory(path)
+
+    def format_size(self, size_bytes):
+        """Formats a size in bytes to a human-readable string.
+
+        Args:
+            size_bytes (int): Size in bytes.
+
+        Returns:
+            str: Formatted size string.
+        """
+        return format_size(size_bytes)
+
+
+class DuplicatesWindow(tk.Toplevel):
+    """Shows duplicate-file groups under a directory, most reclaimable first."""
+
+    def __init__(self, master, path):
+        super().__init__(master)
+        self.title(f"Duplicates in {path}")
+        self.geometry("800x500")
+        self.path = path
+        self.finder = DuplicateFinder()
+        self.groups = None
+        self.error = None
+
+        top_frame = ttk.Frame(self, padding="5")
+        top_frame.pack(side="top", fill="x")
+        self.cancel_button = ttk.Button(top_frame, text="Cancel", command=self.finder.cancel)
+        self.cancel_button.pack(side="left", padx=5)
+
+        tree_frame = ttk.Frame(self, padding="5")
+        tree_frame.pack(side="top", fill="both", expand=True)
+        self.tree = ttk.Treeview(tree_frame, columns=("size", "reclaimable"), selectmode="browse")
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.tree.heading("#0", text="Duplicate group / File")
+        self.tree.heading("size", text="File Size")
+        self.tree.heading("reclaimable", text="Reclaimable")
+        self.tree.column("#0", width=500, anchor="w", stretch=True)
+        self.tree.column("size", width=120, anchor="e", stretch=True)
+        self.tree.column("reclaimable", width=120, anchor="e", stretch=True)
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
+        scrollbar.pack(side="right", fill="y")
+        self.tree.configure(yscrollcommand=scrollbar.set)
+
+        self.status_var = tk.StringVar()
+        ttk.Label(self, textvariable=self.status_var, relief="sunken", anchor="w", padding="2").pack(
+            side="bottom", fill="x")
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
+
+        threading.Thread(target=self.run, daemon=True).start()
+        self.after(200, self.poll)
+
+    def run(self):
+        """Searches for duplicates on a background thread."""
+        try:
+            self.groups = self.finder.find([self.path])
+        except Exception as e:
+            logging.error(f"Error finding duplicates in {self.path}: {e}")
+            self.error = e
+
+    def poll(self):
+        """Shows progress until the search ends, then fills the view."""
+        if not self.winfo_exists():
+            return
+        if self.error is not None:
+            self.status_var.set(f"Error finding duplicates: {self.error}")
+            self.cancel_button.configure(state="disabled")
+            return
+        if self.groups is None:
+            self.status_var.set(f"{self.finder.stage.capitalize()}... {self.finder.scanner.files_scanned:,} files "
+                                f"seen, {self.finder.files_hashed:,} hashed "
+                                f"({format_size(self.finder.bytes_hashed)} read)")
+            self.after(200, self.poll)
+            return
+        self.cancel_button.configure(state="disabled")
+        for group in self.groups:
+            node = self.tree.insert("", "end", text=f"{len(group.paths)} copies",
+                                    values=(format_size(group.size), format_size(group.reclaimable)))
+            for path in group.paths:
+                self.tree.insert(node, "end", text=path, values=(format_size(group.size), ""))
+        total = sum(group.reclaimable for group in self.groups)
+        prefix = "Search cancelled. " if self.finder.stage == "cancelled" else ""
+        self.status_var.set(f"{prefix}{len(self.groups):,} duplicate groups, {format_size(total)} reclaimable.")
+
+    def on_closing(self):
+        """Stops the search when the window is closed."""
+        self.finder.cancel()
+        self.destroy()
+
+
+class SnapshotsWindow(tk.Toplevel):
+    """Lists the snapshots of a directory to compare it with or delete."""
+
+    def __init__(self, master, path, snapshots):
+        super().__init__(master)
+        self.title(f"Snapshots of {path}")
+        self.geometry("500x300")
+        self.path = path
+        self.snapshots = {}
+
+        self.tree = ttk.Treeview(self, columns=("size", "files"), selectmode="browse")
+        self.tree.heading("#0", text="Taken")
+        self.tree.heading("size", text="Size")
+        self.tree.heading("files", text="Files")
+        self.tree.column("size", anchor="e")
+        self.tree.column("files", anchor="e")
+        self.tree.pack(side="top", fill="both", expand=True, padx=5, pady=5)
+        for snapshot in snapshots:
+            item = self.tree.insert("", "end", text=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snapshot[1])),
+                                    values=(format_size(snapshot[2]), f"{snapshot[3]:,}"))
+            self.snapshots[item] = snapshot
+        self.tree.selection_set(self.tree.get_children()[:1])
+        self.tree.bind("<Double-1>", lambda event: self.compare())
+
+        buttons = ttk.Frame(self, padding="5")
+        buttons.pack(side="bottom", fill="x")
+        ttk.Button(buttons, text="Compare", command=self.compare).pack(side="left", padx=5)
+        ttk.Button(buttons, text="Delete", command=self.delete).pack(side="left", padx=5)
+
+    def selected(self):
+        """Returns the selected snapshot, or None."""
+        selection = self.tree.selection()
+        return self.snapshots.get(selection[0]) if selection else None
+
+    def compare(self):
+        """Compares the directory with the selected snapshot and closes the window."""
+        snapshot = self.selected()
+        if snapshot is not None:
+            self.master.run_comparison(self.path, snapshot)
+            self.destroy()
+
+    def delete(self):
+        """Deletes the selected snapshot from the scan cache."""
+        selection = self.tree.selection()
+        snapshot = self.selected()
+        if snapshot is None:
+            return
+        try:
+            self.master.store.delete_snapshot(snapshot[0])
+        except sqlite3.Error as e:
+            logging.error(f"Error deleting snapshot {snapshot[0]}: {e}")
+            return
+        del self.snapshots[selection[0]]
+        self.tree.delete(selection[0])
+
+
+class ExclusionsWindow(tk.Toplevel):
+    """Edits the gitignore-style rules for folders and files that scans leave unread."""
+
+    HELP = ("One pattern per line, as in .gitignore: node_modules or *.iso match at any depth, a trailing / "
+            "matches folders only, /proc or /mnt/backup are absolute paths, ** spans folders and ! re-includes. "
+            "Lines starting with # are comments.")
+
+    def __init__(self, master, lines):
+        super().__init__(master)
+        self.title("Exclusions")
+        self.geometry("500x350")
+
+        ttk.Label(self, text=self.HELP, wraplength=480, justify="left").pack(side="top", fill="x", padx=5, pady=5)
+        buttons = ttk.Frame(self, padding="5")
+        buttons.pack(side="bottom", fill="x")
+        ttk.Button(buttons, text="Save", command=self.save).pack(side="left", padx=5)
+        ttk.Button(buttons, text="Cancel", command=self.destroy).pack(side="left", padx=5)
+        self.text = tk.Text(self, height=10, undo=True)
+        self.text.pack(side="top", fill="both", expand=True, padx=5)
+        self.text.insert("1.0", "\n".join(lines))
+        self.text.focus_set()
+
+    def save(self):
+        """Saves the rules and closes the window, unless a rule is invalid."""
+        if self.master.save_exclusions(self.text.get("1.0", "end").splitlines()):
+            self.destroy()
+
+
+def main():
+    """Starts the GUI."""
+    # Log next to the scan cache, not into whatever the current directory is
+    log_path = default_log_path()
+    try:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        logging.basicConfig(filename=log_path, level=logging.ERROR, format="%(asctime)s - %(message)s")
+    except OSError:  # Unwritable cache directory; log to the terminal instead
+        logging.basicConfig(level=logging.ERROR, format="%(asctime)s - %(message)s")
+    app = TreeSizeApp()
+    app.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""Tests of the pcCleaner engine and command line, run against small trees in tmp_path."""
+import os
+import queue
+import threading
+import time
+
+import pytest
+
+import pcCleaner
+
+
+def make_tree(root, layout):
+    """Creates the files of layout, a dict mapping relative paths to sizes, under root."""
+    for relative, size in layout.items():
+        path = os.path.join(root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+    return str(root)
+
+
+def subcommands(parser):
+    """Yields the subparsers of a parser built by build_parser."""
+    for action in parser._subparsers._group_actions:
+        yield from action.choices.values()
+
+
+def test_help_renders_for_every_command():
+    parser = pcCleaner.build_parser()
+    assert "estimate" in parser.format_help()
+    for command in subcommands(parser):
+        assert command.format_help()
+
+
+@pytest.mark.parametrize("probes", ["0", "-3", "many"])
+def test_estimate_rejects_probes_below_one(probes, capsys):
+    with pytest.raises(SystemExit):
+        pcCleaner.build_parser().parse_args(["estimate", ".", "--probes", probes])
+    assert "--probes" in capsys.readouterr().err
+
+
+def test_estimator_requires_a_probe():
+    with pytest.raises(ValueError):
+        pcCleaner.SizeEstimator(probes=0)
+
+
+def test_estimate_counts_small_trees_exactly(tmp_path):
+    root = make_tree(tmp_path, {"a/one": 100, "a/b/two": 200, "c/three": 50})
+    estimates = pcCleaner.DirectoryScanner().estimate(root, seed=1)
+    assert estimates["a"] == pcCleaner.SizeEstimate(300, 300, 300, 2, 0)
+    assert estimates["c"].size == 50
+
+
+def test_estimator_probes_below_the_listed_frontier(tmp_path):
+    layout = {f"d{i}/e{j}/f": 10 for i in range(4) for j in range(3)}
+    root = make_tree(tmp_path, layout)
+    estimate = pcCleaner.SizeEstimator(listings=1, probes=1, seed=2).estimate(root)
+    assert estimate.probes == 1
+    assert estimate.size == 120  # Every walk sees the same branching and sizes
+
+
+def test_estimator_draws_a_fresh_file_sample_per_probe(tmp_path):
+    root = make_tree(tmp_path, {f"d/f{i}": i * 10 for i in range(40)})
+    estimate = pcCleaner.SizeEstimator(listings=1, probes=200, file_sample=4, seed=3).estimate(root)
+    assert estimate.files == 40
+    assert estimate.low < 7800 < estimate.high  # The probes' spread reflects the file sampling
+
+
+LAYOUT = {"a/one": 100, "a/b/two": 200, "a/b/c/three": 300, "d/four": 40, "five": 5}
+
+
+def run_job(job):
+    """Runs a ScanJob on the calling thread and returns its events."""
+    job.run()
+    events = []
+    while not job.events.empty():
+        events.append(job.events.get())
+    return events
+
+
+@pytest.mark.parametrize("options", [{}, {"one_filesystem": True}, {"estimate": True}])
+def test_scan_job_end_to_end(tmp_path, options):
+    root_path = make_tree(tmp_path, LAYOUT)
+    job = pcCleaner.ScanJob(pcCleaner.DirectoryScanner(), root_path, max_workers=2, **options)
+    events = run_job(job)
+    kind, root = events[-1][:2]
+    assert kind == "done", events[-1]
+    assert (root.size, root.files) == (645, 5)
+    assert {event[1]: event[2].size for event in events if event[0] == "dir"} == {"a": 600, "d": 40}
+    assert job.names.search("three", root) == [(os.path.join(root_path, "a", "b", "c", "three"), 300, False)]
+    index = pcCleaner.ScanIndex()
+    index.insert(job.path, root, names=job.names)
+    with open(os.path.join(root_path, "a", "b", "new"), "wb") as f:
+        f.write(b"x" * 1000)
+    refresh = pcCleaner.ScanJob(pcCleaner.DirectoryScanner(), root_path, index=index, refresh=True, **options)
+    kind, refreshed = run_job(refresh)[-1][:2]
+    assert kind == "done"
+    assert (refreshed.size, refreshed.files) == (1645, 6)
+
+
+def test_exclude_rules_precedence_and_anchoring(tmp_path):
+    rules = pcCleaner.ExcludeRules(["# comment", "", "*.log", "!keep.log", "build/", "/opt/cache",
+                                    ".git/objects", "docs/**/*.tmp"])
+    excluded = rules.excluded
+    assert len(rules) == 6
+    assert excluded("/home/me/app.log", False)
+    assert not excluded("/home/me/keep.log", False)  # The later negation wins
+    assert excluded("/src/build") and not excluded("/src/build", False)  # Folders only
+    assert excluded("/opt/cache") and not excluded("/srv/opt/cache")  # Anchored at the filesystem root
+    assert excluded("/repo/.git/objects") and not excluded("/repo/objects")
+    assert excluded("/x/docs/a/b/c.tmp", False) and excluded("/x/docs/c.tmp", False)
+    assert not excluded("/x/other/c.tmp", False)
+    assert pcCleaner.ExcludeRules(["!keep.log", "*.log"]).excluded("/keep.log", False)  # Last rule wins
+    assert pcCleaner.ExcludeRules(["*.log", "!keep.log"]).fingerprint != rules.fingerprint
+    assert pcCleaner.rules_fingerprint(None) == pcCleaner.rules_fingerprint(pcCleaner.ExcludeRules()) == ""
+    with pytest.raises(ValueError):
+        pcCleaner.ExcludeRules(["[z-a]"])
+
+
+def test_refresh_with_new_rules_rereads_reused_listings(tmp_path):
+    root_path = make_tree(tmp_path, {"a/one.log": 1000, "a/two.txt": 20, "a/b/three.log": 300, "b/four.txt": 4})
+    index = pcCleaner.ScanIndex()
+    job = pcCleaner.ScanJob(pcCleaner.DirectoryScanner(), root_path, index=index)
+    index.insert(job.path, run_job(job)[-1][1], names=job.names, fingerprint=job.fingerprint)
+    scanner = pcCleaner.DirectoryScanner()
+    scanner.exclude = pcCleaner.ExcludeRules(["*.log"])
+    kind, refreshed = run_job(pcCleaner.ScanJob(scanner, root_path, index=index, refresh=True))[-1][:2]
+    assert kind == "done"
+    assert (refreshed.size, refreshed.files) == (24, 2)
+
+
+def test_scan_cache_keys_trees_and_checkpoints_by_rules(tmp_path):
+    root_path = make_tree(tmp_path / "tree", {"a/one": 10})
+    store = pcCleaner.ScanCache(str(tmp_path / "cache.sqlite3"))
+    try:
+        root = pcCleaner.DirectoryScanner().scan_tree(root_path)
+        store.save(root_path, root, fingerprint="old")
+        assert store.find_root(root_path, "old")[0] == root_path
+        assert store.find_root(root_path, "new") is None
+        store.save_checkpoint(root_path, [(os.path.join(root_path, "a"), root.child("a"))], "old")
+        assert store.load_checkpoints(root_path, "new") == {}
+        assert store.checkpoint_count(root_path) == 0
+    finally:
+        store.close()
+
+
+def test_resume_grafts_only_unchanged_checkpoints(tmp_path):
+    root_path = make_tree(tmp_path / "tree", {"a/one": 10, "b/two": 20, "c/three": 30})
+    store = pcCleaner.ScanCache(str(tmp_path / "cache.sqlite3"))
+    try:
+        scanned = pcCleaner.DirectoryScanner().scan_tree(root_path)
+        for name in ("a", "b"):
+            stale = scanned.child(name)
+            stale.size = stale.own_size = 1000
+            store.save_checkpoint(root_path, [(os.path.join(root_path, name), stale)])
+        os.mkdir(os.path.join(root_path, "b", "new"))  # b changed after its checkpoint
+        job = pcCleaner.ScanJob(pcCleaner.DirectoryScanner(), root_path, store=store)
+        kind, root = run_job(job)[-1][:2]
+        assert kind == "done" and job.resumed == 2
+        assert {child.name: child.size for child in root.children} == {"a": 1000, "b": 20, "c": 30}
+        store.save_checkpoint(root_path, [(os.path.join(root_path, "a"), scanned.child("a"))])
+        assert store.load_checkpoints(root_path, max_age=-1) == {}
+    finally:
+        store.close()
+
+
+class WorkerCancelToken(pcCleaner.CancelToken):
+    """Reads as cancelled on worker threads only, so the coordinator still sees cut listings come back."""
+
+    __slots__ = ()
+
+    @property
+    def cancelled(self):
+        return threading.current_thread() is not threading.main_thread()
+
+
+def test_cancelled_listings_are_never_finished_or_checkpointed(tmp_path):
+    root_path = make_tree(tmp_path, {f"a/f{i}": 100 for i in range(5)})
+    token = pcCleaner.CancelToken()
+    token.cancel()
+    listing = pcCleaner.list_directory(os.path.join(root_path, "a"), token=token)
+    assert isinstance(listing.error, pcCleaner.ListingCancelled)
+    completed, checkpoints = [], []
+    top = pcCleaner.DirNode("a")
+    walker = pcCleaner.ParallelWalker(pcCleaner.DirectoryScanner(), workers=2)
+    walker.walk([pcCleaner.WalkTop(top, os.path.join(root_path, "a"), None, None)], completed.append,
+                token=WorkerCancelToken(), on_checkpoint=checkpoints.extend, checkpoint_interval=0)
+    assert completed == [] and checkpoints == []
+
+
+def test_iter_files_skips_files_that_vanish_mid_listing(tmp_path):
+    root_path = make_tree(tmp_path, dict({f"f{i}": 10 for i in range(8)}, **{"sub/kept": 5}))
+    scanner = pcCleaner.DirectoryScanner()
+    found = []
+    for file_path, size, _, _ in scanner.iter_files(root_path):
+        if not found:
+            for i in range(8):  # Already listed, not yet stat()ed
+                if os.path.join(root_path, f"f{i}") != file_path:
+                    os.unlink(os.path.join(root_path, f"f{i}"))
+        found.append(file_path)
+    assert os.path.join(root_path, "sub", "kept") in found
+    assert len(found) == 2
+    assert scanner.stats.errors == {"ENOENT": 7}
+
+
+@pytest.mark.parametrize("count", [3, 500])
+def test_dir_node_children_by_name(count):
+    parent = pcCleaner.DirNode("/root")
+    for i in range(count):
+        child = pcCleaner.DirNode(f"d{i}")
+        child.size = child.files = 1
+        parent.add_child(child)
+        parent.adjust(1, 1)
+    assert parent.child("d1").name == "d1" and parent.child("missing") is None
+    bigger = pcCleaner.DirNode("new")
+    bigger.size = 10
+    parent.replace_child("d1", bigger)
+    assert parent.child("d1") is bigger and parent.size == count + 9
+    parent.remove_child(parent.child("d0"))
+    parent.add_child(pcCleaner.DirNode("late"))
+    assert parent.child("d0") is None and parent.child("late").parent is parent
+    assert sorted(node.name for node in parent.children) == sorted(
+        [f"d{i}" for i in range(1, count)] + ["late"])
+    assert all(parent.child(node.name) is node for node in parent.children)
+
+
+@pytest.mark.parametrize("max_watches", [0, pcCleaner.MAX_WATCHES])
+def test_watcher_applies_new_files_and_folders(tmp_path, max_watches):
+    root_path = make_tree(tmp_path, {"a/one": 100})
+    index = pcCleaner.ScanIndex()
+    index.insert(root_path, pcCleaner.DirectoryScanner().scan_tree(root_path))
+    watcher = pcCleaner.DirectoryWatcher(index, root_path, max_watches=max_watches, poll_interval=0.2, settle=0.05)
+    watcher.start()
+    try:
+        time.sleep(0.3)  # Let it take its watches
+        make_tree(root_path, {"a/two": 20, "b/three": 3})
+        root = index.lookup(root_path)
+        deadline = time.monotonic() + 10
+        while (root.size, root.files) != (123, 3) and time.monotonic() < deadline:
+            try:
+                watcher.apply(watcher.changes.get(timeout=0.1))
+            except queue.Empty:
+                pass
+    finally:
+        watcher.stop()
+        watcher.join(5)
+    assert (root.size, root.files) == (123, 3)
+    assert index.lookup(os.path.join(root_path, "b")).size == 3
+
+
+def test_stopped_watcher_queues_nothing(tmp_path):
+    root_path = make_tree(tmp_path, {"a/one": 100})
+    index = pcCleaner.ScanIndex()
+    index.insert(root_path, pcCleaner.DirectoryScanner().scan_tree(root_path))
+    watcher = pcCleaner.DirectoryWatcher(index, root_path)
+    make_tree(root_path, {"a/two": 20, "b/three": 3})
+    watcher.stop()
+    watcher._reread(root_path)
+    assert watcher.changes.empty()
+
+
+def test_benchmark_reports_bad_paths(tmp_path, capsys):
+    import benchmark
+    assert benchmark.main(["compare", str(tmp_path / "missing"), str(tmp_path / "missing")]) == 2
+    assert "cannot read" in capsys.readouterr().err
+    output = tmp_path / "out.jsonl"
+    assert benchmark.main(["run", "--root", str(tmp_path / "new" / "root"), "--shapes", "wide", "--strategies",
+                           "serial", "--scale", "0.01", "--repeat", "1", "--warmup", "0",
+                           "--output", str(output)]) == 0
+    assert benchmark.main(["compare", str(output), str(output)]) == 0
+
+
+def test_file_types_pack_and_merge():
+    now = time.time()
+    day = 86400
+    types = pcCleaner.FileTypes(now)
+    types.add("a.ISO", 1000, now - day)
+    types.add("b.iso", 500, now - 400 * day)
+    types.add("README", 7, now - day)
+    packed = types.pack()
+    ages, extensions = pcCleaner.type_breakdown(packed)
+    assert ages[0] == ("Under a week", 1007) and ages[4][1] == 500
+    assert extensions == [(".iso", 1500, 2), ("", 7, 1)]
+    other = pcCleaner.FileTypes(now)
+    other.add("c.txt", 30, now - day)
+    total = pcCleaner.merge_types([packed, other.pack(), None])
+    assert pcCleaner.type_breakdown(total)[1] == [(".iso", 1500, 2), (".txt", 30, 1), ("", 7, 1)]
+    assert pcCleaner.merge_types([total], [other.pack()]) == packed
+    assert pcCleaner.merge_types([packed]) is packed  # A single input is not copied
+    assert pcCleaner.merge_types([packed], [packed]) is None
+    assert pcCleaner._types_from_json(pcCleaner._types_to_json(total)) == total
+
+
+def test_file_types_fold_the_smallest_extensions_into_other():
+    types = pcCleaner.FileTypes()
+    for i in range(pcCleaner.MAX_EXTENSIONS + 10):
+        types.add(f"f.e{i}", i + 1, types.now)
+    extensions = pcCleaner.type_breakdown(types.pack())[1]
+    assert len(extensions) == pcCleaner.MAX_EXTENSIONS
+    assert (pcCleaner.OTHER_EXTENSION, sum(range(1, 12)), 11) in extensions
+
+
+def test_diff_snapshots_reports_added_and_removed_subtrees_once():
+    old = [(b"", 100, 10), (b"a", 50, 5), (b"a\0x", 20, 2), (b"a\0x\0y", 5, 1), (b"b", 30, 3)]
+    new = [(b"", 90, 9), (b"a", 30, 3), (b"b", 40, 4), (b"c", 20, 2), (b"c\0d", 10, 1)]
+    changes = list(pcCleaner.diff_snapshots(old, new, "/r"))
+    assert [(os.path.relpath(change.path, "/r"), change.status, change.delta) for change in changes] == [
+        (".", "resized", -10), ("a", "resized", -20), (os.path.join("a", "x"), "removed", -20),
+        ("b", "resized", 10), ("c", "added", 20)]
+
+
+def test_diff_snapshots_of_trees_in_memory(tmp_path):
+    root_path = make_tree(tmp_path, {"a/one": 10, "b/two": 20})
+    before = list(pcCleaner.tree_rows(pcCleaner.DirectoryScanner().scan_tree(root_path)))
+    make_tree(root_path, {"a/new/three": 30})
+    after = pcCleaner.tree_rows(pcCleaner.DirectoryScanner().scan_tree(root_path))
+    changes = {change.path: change.status for change in pcCleaner.diff_snapshots(before, after, root_path)}
+    assert changes == {root_path: "resized", os.path.join(root_path, "a"): "resized",
+                       os.path.join(root_path, "a", "new"): "added"}
+
+
+def test_rank_changes_keeps_the_largest_deltas_and_counts_all():
+    changes = [pcCleaner.SnapshotChange(f"/r/{i}", status, 0, delta, 0, 0)
+               for i, (status, delta) in enumerate([("added", 5), ("resized", -50), ("removed", 20), ("added", 1)])]
+    ranked, counts = pcCleaner.rank_changes(iter(changes), limit=2)
+    assert [change.path for change in ranked] == ["/r/1", "/r/2"]
+    assert counts == {"added": 2, "removed": 1, "resized": 1}
+
+
+def test_name_index_search(tmp_path):
+    root_path = make_tree(tmp_path, {"photos/Holiday.JPG": 300, "photos/2020/beach.jpg": 200,
+                                     "docs/holiday-plan.txt": 10, "holiday/notes.md": 1})
+    job = pcCleaner.ScanJob(pcCleaner.DirectoryScanner(), root_path)
+    root = run_job(job)[-1][1]
+    search = job.names.search
+    relative = lambda results: [(os.path.relpath(path, root_path), size, is_dir) for path, size, is_dir in results]
+    assert relative(search("HOLIDAY", root)) == [
+        (os.path.join("photos", "Holiday.JPG"), 300, False), (os.path.join("docs", "holiday-plan.txt"), 10, False),
+        ("holiday", 1, True)]
+    assert relative(search("*.jpg", root)) == [
+        (os.path.join("photos", "Holiday.JPG"), 300, False), (os.path.join("photos", "2020", "beach.jpg"), 200, False)]
+    assert relative(search("holiday", root.child("docs"))) == [(os.path.join("docs", "holiday-plan.txt"), 10, False)]
+    assert search("no such name", root) == [] and search("  ", root) == []
+    assert len(search("*o*", root, limit=3)) == 3  # No trigram: every name is checked
+
+
+def test_bulk_deleter_previews_before_deleting(tmp_path):
+    target = make_tree(tmp_path / "target", {"one": 10, "sub/two": 20, "sub/deeper/three": 30})
+    outside = make_tree(tmp_path / "outside", {"kept": 5})
+    os.symlink(outside, os.path.join(target, "link"))
+    deleter = pcCleaner.BulkDeleter([target], workers=2)
+    with pytest.raises(RuntimeError):
+        deleter.delete()
+    preview = deleter.preview()
+    assert (preview.files, preview.dirs, preview.size, preview.errors) == (3, 3, 60, 0)
+    assert os.path.exists(os.path.join(target, "sub", "deeper", "three"))  # A preview deletes nothing
+    result = deleter.delete()
+    assert (result.files, result.dirs, result.size, result.errors) == (3, 3, 60, 0)
+    assert result.removed == [target] and not os.path.lexists(target)
+    assert os.path.exists(os.path.join(outside, "kept"))  # Symlinks are removed, never followed
+    with pytest.raises(RuntimeError):
+        deleter.delete()  # Each preview allows a single delete
+    with pytest.raises(ValueError):
+        pcCleaner.BulkDeleter([os.sep])
+
+
+def test_scan_index_replace_rolls_totals_up(tmp_path):
+    root_path = make_tree(tmp_path, {"a/b/one": 100, "a/b/two": 20, "c/three": 3})
+    scanner = pcCleaner.DirectoryScanner()
+    index = pcCleaner.ScanIndex()
+    index.insert(root_path, scanner.scan_tree(root_path))
+    leftover = os.path.join(root_path, "a", "b")
+    os.remove(os.path.join(leftover, "one"))  # As if a deletion stopped part way
+    assert index.replace(leftover, scanner.scan_tree(leftover)) is not None
+    assert [(index.lookup(path).size, index.lookup(path).files)
+            for path in (leftover, os.path.join(root_path, "a"), root_path)] == [(20, 1), (20, 1), (23, 2)]
+    assert index.replace(os.path.join(root_path, "missing"), pcCleaner.DirNode("missing")) is None
+    assert index.lookup(root_path).size == 23
+
+
+def test_bulk_deleter_refuses_to_delete_after_a_cancelled_preview(tmp_path):
+    target = make_tree(tmp_path / "target", {"one": 10})
+    token = pcCleaner.CancelToken()
+    token.cancel()
+    deleter = pcCleaner.BulkDeleter([target], token=token)
+    assert deleter.preview().cancelled
+    with pytest.raises(RuntimeError):
+        deleter.delete()
+    assert os.path.exists(os.path.join(target, "one"))
+
+
+def tree_totals(node, path=""):
+    """Returns {relative path: (size, files, own_size, own_files)} of every node of a tree."""
+    totals = {path: (node.size, node.files, node.own_size, node.own_files)}
+    for child in node.children or ():
+        totals.update(tree_totals(child, os.path.join(path, child.name)))
+    return totals
+
+
+@pytest.mark.parametrize("backend", pcCleaner.ParallelWalker.BACKENDS)
+def test_parallel_backends_match_the_serial_scan(tmp_path, backend):
+    layout = {f"d{i}/e{j}/f{k}.dat": i * 100 + j * 10 + k for i in range(4) for j in range(5) for k in range(3)}
+    layout.update({"top.txt": 7, "d0/empty/.keep": 0})
+    root_path = make_tree(tmp_path, layout)
+    os.symlink("d1", os.path.join(root_path, "link"))
+    serial = pcCleaner.DirectoryScanner().scan_tree(root_path)
+    root = pcCleaner.DirNode(root_path)
+    walker = pcCleaner.ParallelWalker(pcCleaner.DirectoryScanner(), workers=3, backend=backend, batch_size=2,
+                                      collect_types=True)
+    walker.walk([pcCleaner.WalkTop(root, root_path, None, None)])
+    assert (serial.size, serial.files) == (sum(layout.values()), len(layout))
+    assert tree_totals(root) == tree_totals(serial)
+    assert root.types == serial.types
+    streamed = pcCleaner.stream_scan(root_path, lambda *record: None, backend=backend, workers=3)
+    assert (streamed.size, streamed.files) == (serial.size, serial.files)